@@ -0,0 +1,204 @@
+# This file announces committed changes to accounts to the /events streams (see routes/events_routes.py). It includes the following key components:
+# - record: transfer_engine.insert_transactions notes the accounts it writes on the session. A session event
+#   publishes them after the transaction commits and drops them on rollback, so every writer (/transfer,
+#   /transfers/batch, the group-commit writer and the login transaction simulator) announces exactly what it made
+#   visible, and never a change that was rolled back.
+# - AccountEventHub: The per-process pub/sub hub. Streams subscribe to their account and get an asyncio.Event that is
+#   set on every change; several changes before the stream wakes up collapse into one, so a burst of transfers costs
+#   a stream one read. publish() may be called from any thread (routes run their commits in the threadpool, the
+#   simulator and group commit in their own threads); the hub hands the ids to its event loop.
+# - Fan-out Backends: ACCOUNT_EVENTS_URI selects how changes reach the other workers. "memory://" only notifies the
+#   streams of the process that committed, which is enough with one worker; a Redis URI such as
+#   "redis://redis:6379/0" publishes every change on a pub/sub channel that each worker listens to. If Redis is
+#   unreachable the change still reaches the local streams.
+# - StreamTickets: Single-use tickets that open one /events stream. EventSource cannot send an Authorization header,
+#   so instead of putting the access token in the URL (and in every access log) the client trades it for a random
+#   ticket that expires after EVENTS_TICKET_SECONDS and is deleted when a stream redeems it. Tickets live in the
+#   same place as the fan-out: per process with "memory://", in Redis otherwise, so any worker can redeem them.
+# - Prometheus Metrics: Accounts announced, and open subscriptions.
+
+# account_events.py
+import asyncio
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+from loguru import logger
+from prometheus_client import Counter, Gauge
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+ACCOUNT_EVENTS_URI = os.getenv("ACCOUNT_EVENTS_URI", "memory://")
+ACCOUNT_EVENTS_CHANNEL = "account_events"
+EVENTS_TICKET_SECONDS = float(os.getenv("EVENTS_TICKET_SECONDS", "30"))
+
+# Prometheus Metrics
+ACCOUNT_EVENTS_PUBLISHED = Counter("account_events_published", "Changed accounts announced to the event streams after a commit")
+ACCOUNT_EVENT_SUBSCRIPTIONS = Gauge("account_event_subscriptions", "Event streams subscribed to an account", multiprocess_mode="livesum")
+
+
+class MemoryBackend:
+    """Delivers changes to this process only."""
+
+    async def publish(self, account_ids, notify):
+        notify(account_ids)
+
+    async def listen(self, notify):
+        return
+
+    async def close(self):
+        return
+
+
+class RedisBackend:
+    """Delivers changes to every worker through a Redis pub/sub channel, this one included."""
+
+    def __init__(self, uri: str, channel: str = ACCOUNT_EVENTS_CHANNEL):
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(uri)
+        self.channel = channel
+
+    async def publish(self, account_ids, notify):
+        try:
+            await self.redis.publish(self.channel, ",".join(str(account_id) for account_id in account_ids))
+        except Exception as e:
+            logger.warning(f"Account events not published to Redis, notifying this worker only | Error: {str(e)}")
+            notify(account_ids)
+
+    async def listen(self, notify):
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            notify([int(account_id) for account_id in message["data"].split(b",")])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Account events listener lost Redis, retrying | Error: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def make_backend(uri: str):
+    if uri.startswith(("redis://", "rediss://")):
+        return RedisBackend(uri)
+    return MemoryBackend()
+
+
+class AccountEventHub:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self._subscribers = {}  # account id -> set of asyncio.Event
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener = None
+
+    def start(self):
+        """Binds the hub to the running event loop and starts listening to the backend; called from the app lifespan."""
+        self._loop = asyncio.get_running_loop()
+        self._listener = self._loop.create_task(self.backend.listen(self._notify))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self.backend.close()
+        self._loop = None
+
+    def publish(self, account_ids: Iterable[int]):
+        """Announces changed accounts; safe to call from any thread. A no-op until start(), when nothing can listen."""
+        loop = self._loop
+        account_ids = sorted(set(account_ids))
+        if loop is None or not account_ids:
+            return
+        ACCOUNT_EVENTS_PUBLISHED.inc(len(account_ids))
+        try:
+            loop.call_soon_threadsafe(lambda: loop.create_task(self.backend.publish(account_ids, self._notify)))
+        except RuntimeError:
+            pass  # the loop closed during shutdown
+
+    def _notify(self, account_ids):
+        for account_id in account_ids:
+            for changed in self._subscribers.get(account_id, ()):
+                changed.set()
+
+    @contextmanager
+    def subscribe(self, account_id: int):
+        """Yields an asyncio.Event set whenever the account changes; the subscriber clears it before reading."""
+        changed = asyncio.Event()
+        self._subscribers.setdefault(account_id, set()).add(changed)
+        ACCOUNT_EVENT_SUBSCRIPTIONS.inc()
+        try:
+            yield changed
+        finally:
+            ACCOUNT_EVENT_SUBSCRIPTIONS.dec()
+            subscribers = self._subscribers.get(account_id)
+            subscribers.discard(changed)
+            if not subscribers:
+                del self._subscribers[account_id]
+
+
+class StreamTickets:
+    def __init__(self, storage_uri: str = "memory://", ttl_seconds: float = EVENTS_TICKET_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._tickets = {}  # ticket -> (user id, token expiry, monotonic deadline), with memory:// storage
+        self._redis = None
+        if storage_uri.startswith(("redis://", "rediss://")):
+            import redis.asyncio
+
+            self._redis = redis.asyncio.from_url(storage_uri)
+
+    async def issue(self, user_id: int, expires_at: Optional[float]) -> str:
+        """Returns a new ticket for the user; the stream it opens ends at expires_at, the access token's expiry."""
+        ticket = secrets.token_urlsafe(32)
+        if self._redis is not None:
+            await self._redis.set(f"events_ticket:{ticket}", f"{user_id}:{expires_at or ''}", px=max(1, int(self.ttl_seconds * 1000)))
+            return ticket
+        now = time.monotonic()
+        self._tickets = {key: value for key, value in self._tickets.items() if value[2] > now}
+        self._tickets[ticket] = (user_id, expires_at, now + self.ttl_seconds)
+        return ticket
+
+    async def redeem(self, ticket: str) -> Optional[Tuple[int, Optional[float]]]:
+        """Returns (user id, token expiry) and invalidates the ticket, or None if it is unknown, used or expired."""
+        if self._redis is not None:
+            value = await self._redis.getdel(f"events_ticket:{ticket}")
+            if value is None:
+                return None
+            user_id, _, expires_at = value.decode().partition(":")
+            return int(user_id), float(expires_at) if expires_at else None
+        entry = self._tickets.pop(ticket, None)
+        if entry is None or entry[2] <= time.monotonic():
+            return None
+        return entry[0], entry[1]
+
+
+hub = AccountEventHub(make_backend(ACCOUNT_EVENTS_URI))
+tickets = StreamTickets(ACCOUNT_EVENTS_URI)
+
+
+def record(db: Session, account_ids: Iterable[int]):
+    """Marks accounts as changed by the session's transaction; they are announced once it commits."""
+    db.info.setdefault("changed_accounts", set()).update(account_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    changed = session.info.pop("changed_accounts", None)
+    if changed:
+        hub.publish(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop("changed_accounts", None)
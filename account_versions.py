@@ -0,0 +1,77 @@
+# This file maintains the per-account version counters behind the ETags of /balance and /transactions. It includes the following key components:
+# - bump: Adds one to the version of each given account. transfer_engine.record_transactions calls it for every
+#   transfer, batch, group commit and simulated transaction, and registration for the new account, all in the
+#   transaction that makes the change, so a version never becomes visible before its data. Accounts are bumped in id
+#   order through rollups.upsert, so concurrent writers cannot deadlock.
+# - Slots: Like the rollups, each account's version is spread over ROLLUP_SLOTS rows and every bump adds one to a
+#   random slot, so the transfers into a popular account do not all queue on one version row. The version is the sum
+#   of the slots, which every committed bump raises.
+# - current_version: The user's account id and version in one query: the account found by user_id, joined to its
+#   version slots. An account without version rows is at 0. Routes read it before the data they serve, so a version
+#   can be older than the data it tags but never newer; the worst case is one extra full response.
+# - ETags: etag() builds a strong ETag from the route, account, version and request parameters, and etag_matches()
+#   checks it against If-None-Match. not_modified() is the empty 304 answer.
+# - Prometheus Metrics: 304 responses per route.
+
+# account_versions.py
+import random
+import zlib
+from typing import Iterable, Optional, Tuple
+
+import sqlalchemy as sa
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+
+import rollups
+from models import Account, AccountVersion
+
+# Browsers keep the response but revalidate it on every use; shared caches must not store it
+CACHE_CONTROL = "private, no-cache"
+
+versions = AccountVersion.__table__
+
+# Prometheus Metrics
+NOT_MODIFIED_RESPONSES = Counter("not_modified_responses", "Conditional GETs answered with 304 Not Modified", ["route"])
+
+
+def bump(db: Session, account_ids: Iterable[int]):
+    """Adds one to the version of every given account; the caller commits."""
+    slot = random.randrange(rollups.ROLLUP_SLOTS)
+    rollups.upsert(db, versions, ["account_id", "slot"], [
+        {"account_id": account_id, "slot": slot, "version": 1} for account_id in set(account_ids)
+    ])
+
+
+def current_version(db: Session, user_id: int) -> Optional[Tuple[int, int]]:
+    """Returns (account id, version) for the user's account, or None when the user has no account."""
+    row = db.execute(
+        sa.select(Account.id, sa.func.coalesce(sa.func.sum(AccountVersion.version), 0))
+        .outerjoin(AccountVersion, AccountVersion.account_id == Account.id)
+        .where(Account.user_id == user_id)
+        .group_by(Account.id)
+        .order_by(Account.id)
+        .limit(1)
+    ).first()
+    return (row[0], row[1]) if row else None
+
+
+def etag(route: str, account_id: int, version: int, *params) -> str:
+    """A strong ETag for one representation; params are the request parameters that select it (page, cursor...)."""
+    tag = f"{route}-{account_id}-{version}"
+    if params:
+        tag += f"-{zlib.crc32(repr(params).encode('utf-8')):08x}"
+    return f'"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], current: str) -> bool:
+    """True when an If-None-Match header lists the current ETag (weak or strong) or is "*"."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == current for candidate in candidates)
+
+
+def not_modified(route: str, current: str) -> Response:
+    NOT_MODIFIED_RESPONSES.labels(route=route).inc()
+    return Response(status_code=304, headers={"ETag": current, "Cache-Control": CACHE_CONTROL})
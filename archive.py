@@ -0,0 +1,485 @@
+# This file implements the cold-history archive for transactions. It includes the following key components:
+# - Segments: Transactions older than ARCHIVE_AFTER_DAYS are moved out of the transactions table into compressed
+#   columnar segment files, one per calendar month and range of ARCHIVE_ACCOUNTS_PER_SEGMENT account ids
+#   (ARCHIVE_DIR/YYYY-MM/accounts-<first account id>.seg). Rows are sorted by account, then newest first, and cut into
+#   row groups of ARCHIVE_ROW_GROUP_SIZE rows; every column of a row group is a separately zlib-compressed block. A
+#   footer holds the block offsets and a per-account index (first row, row count, oldest date), so reading one
+#   account decompresses only the row groups it spans.
+# - Segment: Opens a segment through a read-only memory map and parses its footer once. open_segment keeps the
+#   ARCHIVE_OPEN_SEGMENTS most recently used segments open per process (an LRU), reopens one when its file changes,
+#   and unmaps an evicted or replaced segment (closing its file descriptor) once no reader is inside it, so a worker
+#   that reads the whole archive does not keep every file mapped.
+# - iter_account: Yields an account's archived rows newest first, optionally only those before a (date, id) keyset
+#   position, so /transactions and the exports can continue from the live table into the archive.
+# - iter_archived: Yields every archived row, segment by segment, for rollups.rebuild.
+# - archive_month / archive_old_transactions / run_archiver: The transaction_archiver job. Every ARCHIVE_INTERVAL
+#   seconds it archives each whole month that ended more than ARCHIVE_AFTER_DAYS days ago: it writes the month's
+#   segments (temporary file, fsync, rename), then deletes the rows (TRUNCATE of the month's partition when the table
+#   is partitioned, see partitions.py) and advances the archived_before watermark in the same transaction. Readers
+#   only take archived rows dated before the watermark, so a run that dies between writing files and committing never
+#   shows a row twice; the next run merges its files. A month holding ledger postings that no balance snapshot covers
+#   yet is left in place, because balances are computed from those postings. On PostgreSQL an advisory lock lets only
+#   one worker archive at a time.
+# - Prometheus Metrics: Rows archived, segments written and archived rows read back.
+# ARCHIVE_DIR must be shared by every worker that serves /transactions, and readable where rollups.py rebuild runs.
+#
+# Usage: python archive.py run | show <account_id>
+
+# archive.py
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import BalanceSnapshot, Transaction, TransactionArchiveState
+from partitions import add_months, attached_partitions, is_partitioned, partition_name
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_ACCOUNTS_PER_SEGMENT = int(os.getenv("ARCHIVE_ACCOUNTS_PER_SEGMENT", "10000"))
+ARCHIVE_ROW_GROUP_SIZE = int(os.getenv("ARCHIVE_ROW_GROUP_SIZE", "4096"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_OPEN_SEGMENTS = int(os.getenv("ARCHIVE_OPEN_SEGMENTS", "256"))
+
+# pg_try_advisory_xact_lock key shared by every worker's archiver
+_ARCHIVE_LOCK_KEY = 0x61726368
+MAGIC = b"TXSEG1"
+_TRAILER = struct.Struct("<Q6s")
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Stands in for a NULL signed_amount in its int64 column
+NULL_CENTS = -(2 ** 63)
+CENT = Decimal("0.01")
+
+INT_COLUMNS = ("id", "account_id", "transaction_date", "amount", "signed_amount")
+STR_COLUMNS = ("transaction_type", "description")
+
+# Prometheus Metrics
+ARCHIVE_ROWS = Counter("archive_rows", "Transactions moved from the transactions table into archive segments")
+ARCHIVE_SEGMENTS_WRITTEN = Counter("archive_segments_written", "Archive segment files written")
+ARCHIVE_ROWS_READ = Counter("archive_rows_read", "Archived transactions read back for /transactions and exports")
+
+
+@dataclass(frozen=True)
+class ArchivedTransaction:
+    id: int
+    account_id: int
+    transaction_type: str
+    amount: Decimal
+    transaction_date: datetime
+    description: Optional[str]
+    signed_amount: Optional[Decimal]
+
+
+def archive_enabled() -> bool:
+    return ARCHIVE_AFTER_DAYS > 0
+
+
+def segment_path(directory: str, month: date, account_id: int, accounts_per_segment: Optional[int] = None) -> str:
+    """Returns the segment file that holds account_id's rows for month."""
+    accounts_per_segment = accounts_per_segment or ARCHIVE_ACCOUNTS_PER_SEGMENT
+    first_account = account_id - account_id % accounts_per_segment
+    return os.path.join(directory, f"{month:%Y-%m}", f"accounts-{first_account:010d}.seg")
+
+
+def _encode_ints(values: Iterable[int]) -> bytes:
+    return zlib.compress(array("q", values).tobytes())
+
+
+def _decode_ints(block: bytes) -> array:
+    values = array("q")
+    values.frombytes(zlib.decompress(block))
+    return values
+
+
+def _cents(amount: Optional[Decimal]) -> int:
+    return NULL_CENTS if amount is None else int(Decimal(amount).quantize(CENT) * 100)
+
+
+def write_segment(path: str, month: date, rows: List[ArchivedTransaction], row_group_size: Optional[int] = None):
+    """Writes rows (any order) to a new segment file, atomically replacing any file already at path."""
+    row_group_size = max(1, row_group_size or ARCHIVE_ROW_GROUP_SIZE)
+    # By account, then newest first (sorted is stable)
+    rows = sorted(sorted(rows, key=lambda row: (row.transaction_date, row.id), reverse=True), key=lambda row: row.account_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    groups = []
+    accounts = {}
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        for first_row in range(0, len(rows), row_group_size):
+            group = rows[first_row:first_row + row_group_size]
+            blocks = {
+                "id": _encode_ints(row.id for row in group),
+                "account_id": _encode_ints(row.account_id for row in group),
+                "transaction_date": _encode_ints((row.transaction_date - EPOCH) // MICROSECOND for row in group),
+                "amount": _encode_ints(_cents(row.amount) for row in group),
+                "signed_amount": _encode_ints(_cents(row.signed_amount) for row in group),
+                "transaction_type": zlib.compress(json.dumps([row.transaction_type for row in group]).encode("utf-8")),
+                "description": zlib.compress(json.dumps([row.description for row in group]).encode("utf-8")),
+            }
+            columns = {}
+            for name, block in blocks.items():
+                columns[name] = [f.tell(), len(block)]
+                f.write(block)
+            groups.append({"first_row": first_row, "rows": len(group), "columns": columns})
+
+        for index, row in enumerate(rows):
+            entry = accounts.setdefault(str(row.account_id), [index, 0, None])
+            entry[1] += 1
+            # Rows run newest first, so the last one seen is the oldest
+            entry[2] = (row.transaction_date - EPOCH) // MICROSECOND
+
+        footer = zlib.compress(json.dumps({
+            "version": 1,
+            "month": month.isoformat(),
+            "rows": len(rows),
+            "row_groups": groups,
+            "accounts": accounts,
+        }, separators=(",", ":")).encode("utf-8"))
+        footer_offset = f.tell()
+        f.write(footer)
+        f.write(_TRAILER.pack(footer_offset, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    ARCHIVE_SEGMENTS_WRITTEN.inc()
+
+
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_offset, magic = _TRAILER.unpack(self._map[-_TRAILER.size:])
+        if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not an archive segment: {path}")
+        footer = json.loads(zlib.decompress(self._map[footer_offset:len(self._map) - _TRAILER.size]))
+        self.month = date.fromisoformat(footer["month"])
+        self.rows = footer["rows"]
+        self.row_groups = footer["row_groups"]
+        self.accounts = {int(account_id): entry for account_id, entry in footer["accounts"].items()}
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+
+    def close(self):
+        """Unmaps the file now, or when the last reader pinned through open_segment is done."""
+        with self._lock:
+            self._closing = True
+            if self._readers:
+                return
+        self._map.close()
+
+    def _pin(self):
+        with self._lock:
+            self._readers += 1
+
+    def _unpin(self):
+        with self._lock:
+            self._readers -= 1
+            if self._readers or not self._closing:
+                return
+        self._map.close()
+
+    def _block(self, group: Dict, column: str) -> bytes:
+        offset, length = group["columns"][column]
+        return self._map[offset:offset + length]
+
+    def _read_group(self, group: Dict, start: int, stop: int) -> List[ArchivedTransaction]:
+        ints = {name: _decode_ints(self._block(group, name))[start:stop] for name in INT_COLUMNS}
+        strs = {name: json.loads(zlib.decompress(self._block(group, name)))[start:stop] for name in STR_COLUMNS}
+        return [
+            ArchivedTransaction(
+                id=ints["id"][i],
+                account_id=ints["account_id"][i],
+                transaction_type=strs["transaction_type"][i],
+                amount=(Decimal(ints["amount"][i]) * CENT),
+                transaction_date=EPOCH + ints["transaction_date"][i] * MICROSECOND,
+                description=strs["description"][i],
+                signed_amount=None if ints["signed_amount"][i] == NULL_CENTS else Decimal(ints["signed_amount"][i]) * CENT,
+            )
+            for i in range(stop - start)
+        ]
+
+    def _read_rows(self, first_row: int, count: int) -> List[ArchivedTransaction]:
+        rows = []
+        for group in self.row_groups:
+            start = max(first_row, group["first_row"])
+            stop = min(first_row + count, group["first_row"] + group["rows"])
+            if start < stop:
+                rows.extend(self._read_group(group, start - group["first_row"], stop - group["first_row"]))
+        return rows
+
+    def account_rows(self, account_id: int) -> List[ArchivedTransaction]:
+        """Returns the account's rows in this segment, newest first."""
+        entry = self.accounts.get(account_id)
+        return self._read_rows(entry[0], entry[1]) if entry else []
+
+    def all_rows(self) -> List[ArchivedTransaction]:
+        return self._read_rows(0, self.rows)
+
+    def oldest(self, account_id: int) -> Optional[datetime]:
+        entry = self.accounts.get(account_id)
+        return EPOCH + entry[2] * MICROSECOND if entry else None
+
+
+# path -> (mtime, Segment), least recently used first
+_segments: "OrderedDict[str, Tuple[int, Segment]]" = OrderedDict()
+_segments_lock = threading.Lock()
+
+
+@contextmanager
+def open_segment(path: str) -> Iterator[Segment]:
+    """Yields the cached Segment for path, reopening it when the file was replaced. The segment stays mapped until the
+    block exits, even if another thread evicts it meanwhile."""
+    mtime = os.stat(path).st_mtime_ns
+    with _segments_lock:
+        cached = _segments.get(path)
+        if cached is not None and cached[0] == mtime:
+            _segments.move_to_end(path)
+            segment = cached[1]
+        else:
+            if cached is not None:
+                del _segments[path]
+                cached[1].close()
+            segment = Segment(path)
+            _segments[path] = (mtime, segment)
+            while len(_segments) > max(1, ARCHIVE_OPEN_SEGMENTS):
+                _, (_, evicted) = _segments.popitem(last=False)
+                evicted.close()
+        segment._pin()
+    try:
+        yield segment
+    finally:
+        segment._unpin()
+
+
+def has_segments(directory: Optional[str] = None) -> bool:
+    """True once anything has been archived into directory."""
+    return os.path.isdir(directory or ARCHIVE_DIR)
+
+
+def account_segments(account_id: int, directory: Optional[str] = None, accounts_per_segment: Optional[int] = None) -> List[str]:
+    """Returns the paths of the segments that can hold the account's rows, newest month first."""
+    directory = directory or ARCHIVE_DIR
+    if not has_segments(directory):
+        return []
+    name = os.path.basename(segment_path(directory, date(1970, 1, 1), account_id, accounts_per_segment))
+    paths = (os.path.join(directory, month, name) for month in sorted(os.listdir(directory), reverse=True))
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def iter_account(account_id: int, archived_before: Optional[datetime], before: Optional[Tuple[datetime, int]] = None,
+                 directory: Optional[str] = None, accounts_per_segment: Optional[int] = None) -> Iterator[ArchivedTransaction]:
+    """Yields the account's archived rows dated before archived_before, newest first, after the (date, id) position before."""
+    if archived_before is None:
+        return
+    for path in account_segments(account_id, directory, accounts_per_segment):
+        with open_segment(path) as segment:
+            oldest = segment.oldest(account_id)
+            if oldest is None or oldest >= archived_before or (before is not None and oldest > before[0]):
+                continue
+            rows = segment.account_rows(account_id)
+        for row in rows:
+            if row.transaction_date >= archived_before:
+                continue
+            if before is not None and (row.transaction_date, row.id) >= before:
+                continue
+            ARCHIVE_ROWS_READ.inc()
+            yield row
+
+
+def iter_archived(archived_before: Optional[datetime], directory: Optional[str] = None) -> Iterator[ArchivedTransaction]:
+    """Yields every archived row dated before archived_before, one segment at a time and in no particular order."""
+    directory = directory or ARCHIVE_DIR
+    if archived_before is None or not has_segments(directory):
+        return
+    for month in sorted(os.listdir(directory)):
+        month_dir = os.path.join(directory, month)
+        if not os.path.isdir(month_dir):
+            continue
+        for name in sorted(os.listdir(month_dir)):
+            if not name.endswith(".seg"):
+                continue
+            # Not through open_segment: a full scan would push the segments /transactions reads out of the cache
+            segment = Segment(os.path.join(month_dir, name))
+            try:
+                for row in segment.all_rows():
+                    if row.transaction_date < archived_before:
+                        ARCHIVE_ROWS_READ.inc()
+                        yield row
+            finally:
+                segment.close()
+
+
+def archived_before(db: Session) -> Optional[datetime]:
+    """Returns the watermark: every transaction dated before it lives in the archive, none after it does."""
+    return db.execute(sa.select(TransactionArchiveState.archived_before).where(TransactionArchiveState.id == 1)).scalar()
+
+
+def _month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _has_unsnapshotted_postings(db: Session, start: datetime, end: datetime) -> bool:
+    return db.execute(
+        sa.select(Transaction.id)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.account_id == Transaction.account_id)
+        .where(
+            Transaction.transaction_date >= start,
+            Transaction.transaction_date < end,
+            Transaction.signed_amount.isnot(None),
+            sa.or_(BalanceSnapshot.through_date.is_(None), Transaction.transaction_date > BalanceSnapshot.through_date),
+        )
+        .limit(1)
+    ).first() is not None
+
+
+def archive_month(db: Session, month: date, directory: Optional[str] = None,
+                  accounts_per_segment: Optional[int] = None) -> Optional[int]:
+    """Moves the month's transactions into segments and advances the watermark; returns the number of rows moved,
+    or None when the month has to stay in place. The caller commits."""
+    directory = directory or ARCHIVE_DIR
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    if _has_unsnapshotted_postings(db, start, end):
+        logger.warning(f"Archive postponed (ledger postings not yet snapshotted) | Month: {month:%Y-%m}")
+        return None
+
+    rows = db.execute(
+        sa.select(
+            Transaction.id, Transaction.account_id, Transaction.transaction_type, Transaction.amount,
+            Transaction.transaction_date, Transaction.description, Transaction.signed_amount,
+        )
+        .where(Transaction.transaction_date >= start, Transaction.transaction_date < end)
+        .order_by(Transaction.account_id)
+        .execution_options(yield_per=ARCHIVE_ROW_GROUP_SIZE)
+    )
+
+    moved = 0
+    path, pending = None, []
+
+    def flush():
+        if not pending:
+            return
+        # A file left behind by a run that never committed already holds some of these rows
+        merged = {}
+        if os.path.isfile(path):
+            leftover = Segment(path)
+            merged = {row.id: row for row in leftover.all_rows()}
+            leftover.close()
+        merged.update((row.id, row) for row in pending)
+        write_segment(path, month, list(merged.values()))
+        pending.clear()
+
+    for row in rows:
+        row_path = segment_path(directory, month, row.account_id, accounts_per_segment)
+        if row_path != path:
+            flush()
+            path = row_path
+        pending.append(ArchivedTransaction(*row))
+        moved += 1
+    flush()
+
+    bind = db.get_bind()
+    name = partition_name(month)
+    if bind.dialect.name == "postgresql" and is_partitioned(db.connection()) and name in attached_partitions(db.connection()):
+        db.execute(sa.text(f"TRUNCATE {name}"))
+    # After a TRUNCATE this only finds the month's rows that went to the default partition, if any
+    db.execute(sa.delete(Transaction).where(Transaction.transaction_date >= start, Transaction.transaction_date < end))
+
+    state = db.get(TransactionArchiveState, 1)
+    if state is None:
+        db.add(TransactionArchiveState(id=1, archived_before=end, updated_at=datetime.utcnow()))
+    else:
+        state.archived_before = end
+        state.updated_at = datetime.utcnow()
+    db.flush()
+    ARCHIVE_ROWS.inc(moved)
+    return moved
+
+
+def archive_old_transactions(db: Session, cutoff: datetime, directory: Optional[str] = None,
+                             accounts_per_segment: Optional[int] = None) -> int:
+    """Archives every whole month that ended at or before cutoff, committing month by month; returns the rows moved."""
+    watermark = archived_before(db)
+    oldest = watermark or db.execute(sa.select(sa.func.min(Transaction.transaction_date))).scalar()
+    db.rollback()
+    if oldest is None:
+        return 0
+
+    total = 0
+    month = _month_start(oldest)
+    while datetime.combine(add_months(month, 1), datetime.min.time()) <= cutoff:
+        try:
+            if db.get_bind().dialect.name == "postgresql":
+                if not db.execute(sa.text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _ARCHIVE_LOCK_KEY}).scalar():
+                    break
+            moved = archive_month(db, month, directory, accounts_per_segment)
+            if moved is None:
+                db.rollback()
+                break
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        total += moved
+        logger.info(f"Transactions archived | Month: {month:%Y-%m} | Rows: {moved}")
+        month = add_months(month, 1)
+    return total
+
+
+def run_archiver():
+    """Archives the months that ended more than ARCHIVE_AFTER_DAYS days ago."""
+    db = SessionLocal()
+    try:
+        archive_old_transactions(db, datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS))
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old transactions into compressed columnar segments.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="archive the months that ended more than --after-days days ago")
+    run.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    show = commands.add_parser("show", help="print an account's archived transactions, newest first")
+    show.add_argument("account_id", type=int)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "run":
+            if args.after_days <= 0:
+                logger.error("Set --after-days (or ARCHIVE_AFTER_DAYS) to a positive number of days")
+                return 1
+            archive_old_transactions(db, datetime.utcnow() - timedelta(days=args.after_days))
+        else:
+            for row in iter_account(args.account_id, archived_before(db)):
+                print(f"{row.transaction_date.isoformat()}\t{row.id}\t{row.transaction_type}\t{row.amount}\t{row.description or ''}")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
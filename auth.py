@@ -5,8 +5,11 @@ import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from models import User
-from database import SessionLocal
+from database import SessionLocal, AsyncSessionLocal, ReplicaSessionLocal, AsyncReplicaSessionLocal, run_db
+from principal_cache import Principal, principal_cache
+from replicas import replica_router
 
 JWT_SECRET = os.getenv("JWT_SECRET", "your_jwt_secret")
 JWT_ALGORITHM = "HS256"
@@ -32,9 +35,47 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_async_db():
+    """Session for the async routes: an AsyncSession when DB_MODE=async, otherwise a sync Session closed off the loop."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+def _load_user(db: Session, user_id):
+    return db.query(User).filter(User.id == user_id).first()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_async_db)):
+    # Warm requests skip both the JWT decode and the users lookup
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     payload = verify_token(token)
-    user = db.query(User).filter(User.id == payload.get("id")).first()
+    user = await run_db(db, _load_user, payload.get("id"))
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+
+    principal = Principal(id=user.id, username=user.username, email=user.email)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+async def get_read_db(current_user=Depends(get_current_user), db=Depends(get_async_db)):
+    """Session for the read-only routes: on the replica while it is fresh and the user has no recent write, else the
+    request's primary session (the one get_current_user already used)."""
+    if not await replica_router.use_replica(current_user.id):
+        yield db
+    elif AsyncReplicaSessionLocal is not None:
+        async with AsyncReplicaSessionLocal() as replica_db:
+            yield replica_db
+    else:
+        replica_db = ReplicaSessionLocal()
+        try:
+            yield replica_db
+        finally:
+            await run_in_threadpool(replica_db.close)
@@ -0,0 +1,62 @@
+# This file contains the periodic background jobs runner used by the application lifespan. It includes the following key components:
+# - PeriodicJob: Runs a callable on a daemon thread every `interval` seconds (first run immediately), outside any
+#   request. Failures are logged and counted and never stop the schedule; an interval <= 0 disables the job.
+# - Prometheus Metrics: Runs per job and outcome, and run duration per job.
+
+# background_jobs.py
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+from prometheus_client import Counter, Histogram
+
+# Prometheus Metrics
+BACKGROUND_JOB_RUNS = Counter("background_job_runs", "Background job runs", ["job", "status"])
+BACKGROUND_JOB_DURATION = Histogram("background_job_duration_seconds", "Background job run time", ["job"])
+
+
+class PeriodicJob:
+    def __init__(self, name: str, interval: float, fn: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Background job started | Job: {self.name} | Interval: {self.interval}s")
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self):
+        start_time = time.perf_counter()
+        try:
+            self.fn()
+        except Exception as e:
+            BACKGROUND_JOB_RUNS.labels(job=self.name, status="failed").inc()
+            logger.error(f"Background job failed | Job: {self.name} | Error: {str(e)}")
+        else:
+            BACKGROUND_JOB_RUNS.labels(job=self.name, status="success").inc()
+        finally:
+            BACKGROUND_JOB_DURATION.labels(job=self.name).observe(time.perf_counter() - start_time)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
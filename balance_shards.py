@@ -0,0 +1,260 @@
+# This file implements sharded balances for hot (e.g. merchant) accounts. It includes the following key components:
+# - Shards: A sharded account (accounts.shard_count = K) keeps its money in K account_balance_shards rows. Its balance
+#   is accounts.balance plus the sum of its shards, so an update that reaches the main row while sharding is being
+#   switched on or off is never lost.
+# - credit: Adds to one shard chosen at random, so K concurrent inbound transfers usually update K different rows
+#   instead of queueing on the account row lock.
+# - debit: Takes the amount from the richest shard that covers it with one conditional UPDATE. When no single shard
+#   covers it, it locks the account row and all shards (in shard order) and drains them, richest first.
+# - rebalance_account / run_rebalancer: The balance_shard_rebalancer job. Every BALANCE_SHARD_REBALANCE_INTERVAL
+#   seconds it folds the main row into the shards and spreads each account's total evenly across them, so the
+#   single-shard debit path keeps succeeding. Each account is rebalanced in its own short transaction.
+# - configure_sharding: Enables, resizes (shard_count=K) or disables (shard_count=None) sharding for an account.
+# Locks are always taken account row first, then shards in ascending order, and accounts in ascending id order by
+# transfer_engine, so sharded transfers cannot deadlock. Sharding is for BALANCE_MODE=column; in ledger mode credits
+# are inserts already, so disable sharding before switching modes.
+#
+# Usage: python balance_shards.py enable <username> --shards 8 | disable <username> | rebalance
+
+# balance_shards.py
+import argparse
+import os
+import random
+import sys
+from decimal import ROUND_DOWN, Decimal
+from typing import Dict, Optional
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Account, AccountBalanceShard, User
+
+BALANCE_SHARD_REBALANCE_INTERVAL = float(os.getenv("BALANCE_SHARD_REBALANCE_INTERVAL", "60"))
+MAX_SHARDS = 64
+CENT = Decimal("0.01")
+
+# Prometheus Metrics
+SHARD_DEBITS = Counter("balance_shard_debits", "Debits from sharded accounts", ["path"])
+SHARD_REBALANCES = Counter("balance_shard_rebalances", "Sharded accounts rebalanced")
+
+shards = AccountBalanceShard.__table__
+
+
+def credit(db: Session, account_id: int, shard_count: int, amount: Decimal):
+    """Adds amount to a random shard (to the main row if the account has just been unsharded)."""
+    credited = db.execute(
+        shards.update()
+        .where(shards.c.account_id == account_id, shards.c.shard == random.randrange(shard_count))
+        .values(balance=shards.c.balance + amount)
+        .returning(shards.c.shard)
+    ).scalar_one_or_none()
+    if credited is None:
+        _apply(db, account_id, {None: amount})
+
+
+def debit(db: Session, account_id: int, amount: Decimal) -> bool:
+    """Subtracts amount from the account's shards; returns False when its total balance does not cover it."""
+    richest = (
+        sa.select(shards.c.shard)
+        .where(shards.c.account_id == account_id, shards.c.balance >= amount)
+        .order_by(shards.c.balance.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    taken = db.execute(
+        shards.update()
+        .where(shards.c.account_id == account_id, shards.c.shard == richest, shards.c.balance >= amount)
+        .values(balance=shards.c.balance - amount)
+        .returning(shards.c.shard)
+    ).scalar_one_or_none()
+    if taken is not None:
+        SHARD_DEBITS.labels(path="single").inc()
+        return True
+
+    SHARD_DEBITS.labels(path="spread").inc()
+    locked = lock_all(db, account_id)
+    if sum(locked.values()) < amount:
+        return False
+    _apply(db, account_id, drain(locked, amount))
+    return True
+
+
+def lock_all(db: Session, account_id: int) -> Dict[Optional[int], Decimal]:
+    """Locks the account row, then every shard in order; returns {None: main balance, shard: balance}."""
+    main = db.execute(
+        sa.select(Account.balance).where(Account.id == account_id).with_for_update()
+    ).scalar_one()
+    locked = {None: main or Decimal("0")}
+    rows = db.execute(
+        sa.select(shards.c.shard, shards.c.balance)
+        .where(shards.c.account_id == account_id)
+        .order_by(shards.c.shard)
+        .with_for_update()
+    ).all()
+    locked.update({shard: balance for shard, balance in rows})
+    return locked
+
+
+def lock_one(db: Session, account_id: int, shard_count: int) -> Optional[int]:
+    """Locks one random shard for a later credit and returns its number (None: the account row, if just unsharded)."""
+    shard = db.execute(
+        sa.select(shards.c.shard)
+        .where(shards.c.account_id == account_id, shards.c.shard == random.randrange(shard_count))
+        .with_for_update()
+    ).scalar_one_or_none()
+    if shard is None:
+        db.execute(sa.select(Account.id).where(Account.id == account_id).with_for_update()).all()
+    return shard
+
+
+def drain(locked: Dict[Optional[int], Decimal], amount: Decimal) -> Dict[Optional[int], Decimal]:
+    """Returns {shard: -taken}, taking amount from the richest rows first."""
+    deltas = {}
+    for shard, balance in sorted(locked.items(), key=lambda item: item[1], reverse=True):
+        if amount <= 0:
+            break
+        taken = min(balance, amount)
+        if taken > 0:
+            deltas[shard] = -taken
+            amount -= taken
+    return deltas
+
+
+def apply_deltas(db: Session, deltas: Dict[int, Dict[Optional[int], Decimal]]):
+    """Adds {account_id: {shard: delta}} to already locked rows; shard None is the accounts row."""
+    main = [{"account_id": a, "delta": d} for a, by_shard in sorted(deltas.items()) for s, d in by_shard.items() if s is None]
+    split = [
+        {"shard_account_id": a, "shard_no": s, "delta": d}
+        for a, by_shard in sorted(deltas.items())
+        for s, d in sorted((s, d) for s, d in by_shard.items() if s is not None)
+    ]
+    if main:
+        accounts = Account.__table__
+        db.execute(
+            accounts.update()
+            .where(accounts.c.id == sa.bindparam("account_id"))
+            .values(balance=accounts.c.balance + sa.bindparam("delta")),
+            main,
+        )
+    if split:
+        db.execute(
+            shards.update()
+            .where(shards.c.account_id == sa.bindparam("shard_account_id"), shards.c.shard == sa.bindparam("shard_no"))
+            .values(balance=shards.c.balance + sa.bindparam("delta")),
+            split,
+        )
+
+
+def _apply(db: Session, account_id: int, deltas: Dict[Optional[int], Decimal]):
+    apply_deltas(db, {account_id: deltas})
+
+
+def total_balance(db: Session, account: Account) -> Decimal:
+    """Returns the balance of a sharded account: its main row plus all its shards."""
+    in_shards = db.execute(
+        sa.select(sa.func.coalesce(sa.func.sum(shards.c.balance), 0)).where(shards.c.account_id == account.id)
+    ).scalar_one()
+    return (Decimal(account.balance or 0) + Decimal(in_shards)).quantize(CENT)
+
+
+def even_split(total: Decimal, shard_count: int) -> Dict[int, Decimal]:
+    """Splits total into shard_count cent amounts; the first shards get the leftover cents."""
+    share = (total / shard_count).quantize(CENT, rounding=ROUND_DOWN)
+    leftover = int((total - share * shard_count) / CENT)
+    return {shard: share + (CENT if shard < leftover else 0) for shard in range(shard_count)}
+
+
+def rebalance_account(db: Session, account_id: int, shard_count: int) -> bool:
+    """Moves the main row into the shards and evens them out; returns whether anything changed. The caller commits."""
+    locked = lock_all(db, account_id)
+    targets = even_split(sum(locked.values()), shard_count)
+    targets[None] = Decimal("0")
+    deltas = {shard: targets.get(shard, Decimal("0")) - balance for shard, balance in locked.items()}
+    deltas = {shard: delta for shard, delta in deltas.items() if delta != 0}
+    if not deltas:
+        return False
+    _apply(db, account_id, deltas)
+    return True
+
+
+def run_rebalancer():
+    """Rebalances every sharded account, one transaction per account."""
+    db = SessionLocal()
+    try:
+        accounts = db.execute(sa.select(Account.id, Account.shard_count).where(Account.shard_count.isnot(None))).all()
+        db.rollback()
+        changed = 0
+        for account_id, shard_count in accounts:
+            try:
+                changed += rebalance_account(db, account_id, shard_count)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        SHARD_REBALANCES.inc(changed)
+        if changed:
+            logger.info(f"Balance shards rebalanced | Accounts: {changed}")
+    finally:
+        db.close()
+
+
+def configure_sharding(db: Session, account_id: int, shard_count: Optional[int]):
+    """Spreads the account over shard_count shards, or moves everything back to the account row for None."""
+    if shard_count is not None and not 1 <= shard_count <= MAX_SHARDS:
+        raise ValueError(f"shard_count must be between 1 and {MAX_SHARDS}")
+    total = sum(lock_all(db, account_id).values())
+    db.execute(shards.delete().where(shards.c.account_id == account_id))
+    if shard_count is None:
+        db.execute(sa.update(Account).where(Account.id == account_id).values(balance=total, shard_count=None))
+        return
+    db.execute(sa.update(Account).where(Account.id == account_id).values(balance=0, shard_count=shard_count))
+    db.execute(sa.insert(AccountBalanceShard), [
+        {"account_id": account_id, "shard": shard, "balance": balance}
+        for shard, balance in even_split(total, shard_count).items()
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage sharded balances for hot accounts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enable = commands.add_parser("enable", help="shard a user's account (or change its shard count)")
+    enable.add_argument("username")
+    enable.add_argument("--shards", type=int, default=8)
+    disable = commands.add_parser("disable", help="move a user's balance back to the account row")
+    disable.add_argument("username")
+    commands.add_parser("rebalance", help="even out every sharded account now")
+    args = parser.parse_args(argv)
+
+    from ledger import ledger_enabled
+    if ledger_enabled() and args.command == "enable":
+        logger.error("Balance sharding is not used in ledger mode, where credits only insert postings")
+        return 1
+
+    if args.command == "rebalance":
+        run_rebalancer()
+        return 0
+
+    db = SessionLocal()
+    try:
+        account_id = db.execute(
+            sa.select(Account.id).join(User, User.id == Account.user_id).where(User.username == args.username).order_by(Account.id)
+        ).scalars().first()
+        if account_id is None:
+            logger.error(f"Account not found | User: {args.username}")
+            return 1
+        configure_sharding(db, account_id, args.shards if args.command == "enable" else None)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Balance sharding updated | User: {args.username} | Shards: {args.shards if args.command == 'enable' else 'off'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# This script measures the per-request overhead of the request-instrumentation middleware. It includes the following key components:
+# - build_app: A minimal FastAPI app with one parameterised JSON route and the chosen instrumentation:
+#   "none", "http" (the previous @app.middleware("http") track_requests, reproduced here) or "asgi" (MetricsMiddleware).
+# - run: Drives the ASGI app directly (no HTTP client or sockets), so the numbers isolate the middleware itself.
+# Logging is disabled for every variant to compare only the instrumentation cost.
+#
+# Usage: python benchmarks/middleware_overhead.py [requests]
+
+# benchmarks/middleware_overhead.py
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from loguru import logger
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from metrics_middleware import MetricsMiddleware
+
+
+def build_app(variant: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        return {"id": item_id}
+
+    if variant == "http":
+        registry = CollectorRegistry()
+        request_count = Counter("request_count", "", ["method", "endpoint"], registry=registry)
+        request_latency = Histogram("request_latency_seconds", "", ["method", "endpoint"], registry=registry)
+        response_status = Counter("response_status", "", ["status_code"], registry=registry)
+
+        @app.middleware("http")
+        async def track_requests(request: Request, call_next):
+            method = request.method
+            endpoint = request.url.path
+            request_count.labels(method=method, endpoint=endpoint).inc()
+            start_time = time.time()
+            response = await call_next(request)
+            latency = time.time() - start_time
+            request_latency.labels(method=method, endpoint=endpoint).observe(latency)
+            response_status.labels(status_code=response.status_code).inc()
+            logger.info(f"Request: {method} {endpoint} | Status: {response.status_code} | Latency: {latency:.4f}s")
+            return response
+    elif variant == "asgi":
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def run(app, requests: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    elapsed = 0.0
+    for i in range(requests):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": f"/items/{i % 100}", "raw_path": f"/items/{i % 100}".encode(),
+            "root_path": "", "query_string": b"", "headers": [], "client": ("127.0.0.1", 5000),
+            "server": ("testserver", 80),
+        }
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        elapsed += time.perf_counter() - start
+    return elapsed / requests
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logger.remove()
+
+    results = {}
+    for variant in ("none", "http", "asgi"):
+        app = build_app(variant)
+        asyncio.run(run(app, 1000))  # warm up
+        results[variant] = asyncio.run(run(app, requests))
+
+    print(f"{'variant':<8} {'us/request':>11} {'overhead us':>12}")
+    for variant, seconds in results.items():
+        print(f"{variant:<8} {seconds * 1e6:>11.1f} {(seconds - results['none']) * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# This script measures the per-request CPU cost of building a /transactions page. It includes the following key components:
+# - build_bank: An in-memory SQLite database with one account holding ROWS transactions.
+# - orm_page: The previous path, reproduced here: full Transaction ORM objects, dicts with float(amount), then FastAPI's
+#   default rendering (jsonable_encoder, then JSONResponse).
+# - core_page: The current path: _load_page's Core rows, _transaction_json and FastJSONResponse.
+# - run: Times both with time.process_time for page sizes 10 to 1000; the route itself caps limit at 100, the larger
+#   sizes show how the cost grows per row.
+# Logging is disabled, and both paths run the same queries against the same database.
+#
+# Usage: python benchmarks/transactions_serialization.py [requests]
+
+# benchmarks/transactions_serialization.py
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy as sa
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from loguru import logger
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from fast_json import FastJSONResponse
+from models import Account, Transaction, User
+from routes.transactions_routes import _load_page, _transaction_json
+
+ROWS = 5000
+PAGE_SIZES = (10, 100, 1000)
+
+
+def build_bank():
+    engine = sa.create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(id=1, username="alice", email="alice@example.com", password_hash="x"), Account(id=1, user_id=1, balance=Decimal("0"))])
+    start = datetime(2025, 1, 1)
+    db.execute(sa.insert(Transaction), [
+        {
+            "account_id": 1, "transaction_type": "transfer", "amount": Decimal(f"{i % 500}.{i % 100:02d}"),
+            "transaction_date": start + timedelta(minutes=i), "description": f"Transfer to user {i % 97}",
+        }
+        for i in range(ROWS)
+    ])
+    db.commit()
+    return db
+
+
+def orm_page(db, limit: int) -> bytes:
+    account = db.query(Account).filter(Account.user_id == 1).first()
+    txns = (
+        db.query(Transaction).filter(Transaction.account_id == account.id)
+        .order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+        .offset(0).limit(limit + 1).all()
+    )[:limit]
+    content = {
+        "transactions": [
+            {
+                "id": txn.id,
+                "transaction_type": txn.transaction_type,
+                "amount": float(txn.amount),
+                "transaction_date": txn.transaction_date,
+                "description": txn.description,
+            }
+            for txn in txns
+        ],
+        "next_cursor": None,
+    }
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def core_page(db, limit: int) -> bytes:
+    _, txns = _load_page(db, 1, None, 1, limit)
+    return FastJSONResponse({"transactions": [_transaction_json(txn) for txn in txns[:limit]], "next_cursor": None}).body
+
+
+def run(db, page, limit: int, requests: int) -> float:
+    elapsed = 0.0
+    for _ in range(requests):
+        start = time.process_time()
+        page(db, limit)
+        elapsed += time.process_time() - start
+        # Both paths start from an empty identity map, as a request's session does
+        db.expunge_all()
+    return elapsed / requests
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logger.remove()
+    db = build_bank()
+
+    print(f"{'page size':>9} {'orm us/request':>15} {'core us/request':>16} {'speedup':>8}")
+    for limit in PAGE_SIZES:
+        results = {}
+        for name, page in (("orm", orm_page), ("core", core_page)):
+            run(db, page, limit, 20)  # warm up
+            results[name] = run(db, page, limit, max(10, requests * 10 // limit))
+        print(f"{limit:>9} {results['orm'] * 1e6:>15.0f} {results['core'] * 1e6:>16.0f} {results['orm'] / results['core']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
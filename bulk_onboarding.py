@@ -0,0 +1,212 @@
+# This file is the bulk user onboarding command, for migrating a partner bank's customers without one HTTP call each.
+# It includes the following key components:
+# - CSV Input: A header row with username, email and either password (plaintext, hashed here) or password_hash
+#   (an existing bcrypt hash, imported as-is); an optional balance column sets the opening balance.
+# - Validation: Rows with missing fields, and usernames/emails that repeat in the file or already exist in the database,
+#   are skipped and reported, so an interrupted import can simply be re-run.
+# - Parallel Hashing: Plaintext passwords are hashed per batch across the password_hasher process pool. --rounds can
+#   lower the work factor for the import; login re-hashes those users with BCRYPT_ROUNDS on their first sign-in.
+# - Bulk Writes: Each batch is one transaction. The "insert" method writes users with multi-row INSERT ... RETURNING
+#   and then their accounts with one multi-row INSERT; the "copy" method (PostgreSQL) COPYs the batch into a temporary
+#   staging table and creates users and accounts with a single INSERT ... SELECT. "auto" picks copy on PostgreSQL.
+#   The batch's transaction also adds its users and accounts to the signup counters (see rollups.py).
+#
+# Usage: python bulk_onboarding.py customers.csv [--batch-size 5000] [--rounds 10] [--method auto|insert|copy]
+
+# bulk_onboarding.py
+import argparse
+import csv
+import io
+import sys
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import sqlalchemy as sa
+from loguru import logger
+
+import password_hasher
+import rollups
+from models import Account, User
+
+DEFAULT_BALANCE = Decimal("1000.00")
+
+
+@dataclass
+class OnboardingReport:
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def read_users(lines: Iterable[str], report: OnboardingReport, default_balance: Decimal = DEFAULT_BALANCE) -> Iterator[Dict]:
+    """Yields validated rows, dropping (and reporting) invalid ones and in-file duplicates."""
+    seen_usernames: Set[str] = set()
+    seen_emails: Set[str] = set()
+    reader = csv.DictReader(lines)
+    for line_no, row in enumerate(reader, start=2):
+        username = (row.get("username") or "").strip()
+        email = (row.get("email") or "").strip()
+        password = row.get("password") or ""
+        password_hash = (row.get("password_hash") or "").strip()
+
+        problem = None
+        if not username or not email:
+            problem = "username and email are required"
+        elif not password and not password_hash:
+            problem = "password or password_hash is required"
+        elif password_hash and not password_hash.startswith("$2"):
+            problem = "password_hash is not a bcrypt hash"
+
+        balance = default_balance
+        if problem is None and (row.get("balance") or "").strip():
+            try:
+                balance = Decimal(row["balance"].strip()).quantize(Decimal("0.01"))
+            except InvalidOperation:
+                problem = f"invalid balance {row['balance']!r}"
+
+        if problem is not None:
+            report.invalid += 1
+            report.errors.append(f"line {line_no}: {problem}")
+            continue
+        if username in seen_usernames or email in seen_emails:
+            report.duplicates += 1
+            continue
+        seen_usernames.add(username)
+        seen_emails.add(email)
+        yield {"username": username, "email": email, "password": password, "password_hash": password_hash, "balance": balance}
+
+
+def _batches(rows: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _drop_existing(conn, batch: List[Dict]) -> List[Dict]:
+    """Removes rows whose username or email is already registered."""
+    existing = conn.execute(
+        sa.select(User.username, User.email).where(
+            sa.or_(User.username.in_([r["username"] for r in batch]), User.email.in_([r["email"] for r in batch]))
+        )
+    ).all()
+    taken_usernames = {username for username, _ in existing}
+    taken_emails = {email for _, email in existing}
+    return [r for r in batch if r["username"] not in taken_usernames and r["email"] not in taken_emails]
+
+
+def _insert_batch(conn, batch: List[Dict]) -> int:
+    # insertmanyvalues turns this into multi-row INSERT ... VALUES ... RETURNING statements, rows in parameter order
+    user_ids = conn.execute(
+        sa.insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{"username": r["username"], "email": r["email"], "password_hash": r["password_hash"]} for r in batch],
+    ).scalars().all()
+    conn.execute(
+        sa.insert(Account),
+        [{"user_id": user_id, "balance": r["balance"]} for user_id, r in zip(user_ids, batch)],
+    )
+    return len(user_ids)
+
+
+def _copy_batch(conn, batch: List[Dict]) -> int:
+    conn.execute(sa.text(
+        "CREATE TEMP TABLE onboarding_staging (username text, email text, password_hash text, balance numeric(15, 2)) "
+        "ON COMMIT DROP"
+    ))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for r in batch:
+        writer.writerow((r["username"], r["email"], r["password_hash"], r["balance"]))
+
+    copy_sql = "COPY onboarding_staging (username, email, password_hash, balance) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+    # ON CONFLICT covers rows registered between _drop_existing and this insert
+    return conn.execute(sa.text(
+        "WITH new_users AS ("
+        "  INSERT INTO users (username, email, password_hash)"
+        "  SELECT username, email, password_hash FROM onboarding_staging"
+        "  ON CONFLICT DO NOTHING"
+        "  RETURNING id, username"
+        ") "
+        "INSERT INTO accounts (user_id, balance, created_at) "
+        "SELECT n.id, s.balance, now() FROM new_users n JOIN onboarding_staging s USING (username)"
+    )).rowcount
+
+
+def onboard_users(engine, lines: Iterable[str], batch_size: int = 5000, rounds: Optional[int] = None,
+                  method: str = "auto", default_balance: Decimal = DEFAULT_BALANCE) -> OnboardingReport:
+    """Imports users and their accounts from CSV lines, one transaction per batch."""
+    if method == "auto":
+        method = "copy" if engine.dialect.name == "postgresql" else "insert"
+    if method == "copy" and engine.dialect.name != "postgresql":
+        raise ValueError("The copy method requires PostgreSQL")
+
+    report = OnboardingReport()
+    for batch in _batches(read_users(lines, report, default_balance), batch_size):
+        start_time = time.perf_counter()
+        with engine.begin() as conn:
+            fresh = _drop_existing(conn, batch)
+            report.duplicates += len(batch) - len(fresh)
+            if not fresh:
+                continue
+
+            plaintext = [r for r in fresh if not r["password_hash"]]
+            for r, hashed in zip(plaintext, password_hasher.hash_passwords([r["password"] for r in plaintext], rounds)):
+                r["password_hash"] = hashed
+
+            inserted = _copy_batch(conn, fresh) if method == "copy" else _insert_batch(conn, fresh)
+            rollups.record_signups(conn, users=inserted, accounts=inserted)
+        report.duplicates += len(fresh) - inserted
+        report.imported += inserted
+        logger.info(f"Onboarding batch committed | Users: {inserted} | Total: {report.imported} | Time: {time.perf_counter() - start_time:.2f}s")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import users and accounts from a CSV file.")
+    parser.add_argument("csv_path", help="CSV with username,email,password|password_hash[,balance]; '-' reads stdin")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt work factor for imported passwords (default: BCRYPT_ROUNDS)")
+    parser.add_argument("--method", choices=["auto", "insert", "copy"], default="auto")
+    parser.add_argument("--default-balance", type=Decimal, default=DEFAULT_BALANCE)
+    args = parser.parse_args(argv)
+
+    from database import engine
+
+    start_time = time.perf_counter()
+    csv_file = sys.stdin if args.csv_path == "-" else open(args.csv_path, newline="", encoding="utf-8")
+    try:
+        report = onboard_users(engine, csv_file, args.batch_size, args.rounds, args.method, args.default_balance)
+    finally:
+        if csv_file is not sys.stdin:
+            csv_file.close()
+        password_hasher.shutdown()
+
+    for error in report.errors[:100]:
+        logger.warning(f"Onboarding row skipped | {error}")
+    logger.info(
+        f"Onboarding finished | Imported: {report.imported} | Duplicates: {report.duplicates} | "
+        f"Invalid: {report.invalid} | Time: {time.perf_counter() - start_time:.1f}s"
+    )
+    return 0 if report.invalid == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
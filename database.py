@@ -1,23 +1,33 @@
 # This file configures the database connection and ORM for the FastAPI application using SQLAlchemy.
 # It includes the following key components:
 # - Database URL: Configures the database connection URL, defaulting to a PostgreSQL database.
-# - Engine: Creates a SQLAlchemy engine with connection pooling.
+# - Engine: Creates a SQLAlchemy engine with connection pooling; every statement is timed by query_instrumentation.
 # - SessionLocal: Configures a sessionmaker for database sessions.
+# - Replica Engine: With REPLICA_DATABASE_URL set, a second pool on a streaming replica (ReplicaSessionLocal, and
+#   AsyncReplicaSessionLocal with DB_MODE=async) that the read-only routes use; replicas.py decides per request
+#   whether the replica is fresh enough. Writes and everything else always use the primary engine.
+# - Async Engine: An optional asyncio engine/sessionmaker (asyncpg/aiosqlite), enabled with DB_MODE=async so the
+#   hot routes can be A/B tested against the threadpool-bound sync path under the same load.
+# - run_db: Runs a sync ORM callable against either session flavour without blocking the event loop.
 # - Base: Defines the declarative base for SQLAlchemy models.
-# - Prometheus Metrics: Counters, histograms, and gauges to track database queries, execution time, and user count.
-# - Utility Functions: Functions to update user count, track query execution time, and initialize the database schema.
+# - Prometheus Metrics: A gauge to track the user count (per-statement metrics live in query_instrumentation.py).
+#   Registration increments it; reconcile_user_count resets it from the database every USER_COUNT_RECONCILE_INTERVAL
+#   seconds, using an exact count (USER_COUNT_METHOD=exact, answerable from the primary key index) or the
+#   planner's catalog estimate (USER_COUNT_METHOD=estimate, PostgreSQL only, constant time).
+# - Utility Functions: Functions to count users, reconcile the user count and initialize the database schema.
+#   create_all only creates missing tables, so upgrade_schema then adds the nullable columns and the indexes that
+#   the models gained after an existing database was created. init_db also creates the upcoming monthly partitions
+#   of a partitioned transactions table (see partitions.py), so the first write has somewhere to go.
 
 import os
 import sqlalchemy as sa
 
-from time import time
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
-from prometheus_client import Counter, Histogram, Gauge
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import Gauge
 
-# Prometheus Metrics
-DB_QUERY_COUNT = Counter("db_query_count", "Total number of database queries executed")
-DB_QUERY_TIME = Histogram("db_query_time_seconds", "Time taken to execute database queries")
-DB_QUERY_FAILURES = Counter("db_query_failures", "Total number of failed database queries")
+from query_instrumentation import instrument_engine
 
 # Use the Docker database service name (`db`) instead of localhost
 # TODO: Change to your docker DB link if different
@@ -30,24 +40,123 @@ engine = sa.create_engine(
     pool_timeout=30,
     pool_pre_ping=True,
 )
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Optional streaming replica for the read-only routes; unset, every session goes to the primary
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL", "")
+
+replica_engine = None
+ReplicaSessionLocal = None
+if REPLICA_DATABASE_URL:
+    replica_engine = sa.create_engine(
+        REPLICA_DATABASE_URL,
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_pre_ping=True,
+    )
+    instrument_engine(replica_engine)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
 Base = declarative_base()
 
-USER_COUNT = Gauge("user_count", "Total number of registered users")
+# "sync" serves the hot routes from the threadpool with SessionLocal; "async" uses the asyncio engine below
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+
+def _async_database_url(url: str) -> str:
+    """Maps a sync database URL onto the matching asyncio driver."""
+    scheme, _, rest = url.partition("://")
+    if scheme.startswith("postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_database_url(DATABASE_URL))
+ASYNC_REPLICA_DATABASE_URL = os.getenv("ASYNC_REPLICA_DATABASE_URL", _async_database_url(REPLICA_DATABASE_URL))
 
-def update_user_count(db: Session):
-    """Update Prometheus gauge with the current user count."""
+async_engine = None
+AsyncSessionLocal = None
+AsyncReplicaSessionLocal = None
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_pre_ping=True,
+    )
+    instrument_engine(async_engine.sync_engine)
+    # Objects are read after commit on the event loop, where lazy refreshes are not allowed.
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+    if REPLICA_DATABASE_URL:
+        async_replica_engine = create_async_engine(
+            ASYNC_REPLICA_DATABASE_URL,
+            pool_size=20,
+            max_overflow=10,
+            pool_timeout=30,
+            pool_pre_ping=True,
+        )
+        instrument_engine(async_replica_engine.sync_engine)
+        AsyncReplicaSessionLocal = async_sessionmaker(bind=async_replica_engine, autoflush=False, expire_on_commit=False)
+
+
+async def run_db(db, fn, *args):
+    """Runs fn(session, *args) on an AsyncSession via run_sync, or on a sync Session in the threadpool."""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
+
+# With several workers each one counts its own signups on top of its last reconcile; livemax reports the most
+# up-to-date worker, and the next reconcile folds in the other workers' signups.
+USER_COUNT = Gauge("user_count", "Total number of registered users", multiprocess_mode="livemax")
+USER_COUNT_RECONCILE_INTERVAL = float(os.getenv("USER_COUNT_RECONCILE_INTERVAL", "300"))
+USER_COUNT_METHOD = os.getenv("USER_COUNT_METHOD", "exact").lower()
+
+def count_users(db: Session, method: str = "exact") -> int:
+    """Counts users exactly, or from the catalog estimate when method is "estimate" and the database has one."""
+    if method == "estimate" and db.get_bind().dialect.name == "postgresql":
+        estimate = db.execute(sa.text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass")).scalar()
+        # -1 means the table has never been vacuumed or analyzed
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
     from models import User
-    user_count = db.query(User).count()
-    USER_COUNT.set(user_count)
+    return db.execute(sa.select(sa.func.count(User.id))).scalar_one()
+
+def reconcile_user_count():
+    """Resets the user count gauge from the database, correcting any drift from the per-signup increments."""
+    db = SessionLocal()
+    try:
+        USER_COUNT.set(count_users(db, USER_COUNT_METHOD))
+    finally:
+        db.close()
 
-def track_query(start_time):
-    """Manually increment the database query counter inside FastAPI routes."""
-    query_time_ms = (time() - start_time) * 1000
-    DB_QUERY_COUNT.inc()
-    DB_QUERY_TIME.observe(query_time_ms)
+def upgrade_schema(bind):
+    """Adds model columns (nullable, without server defaults) and indexes that existing tables are missing."""
+    inspector = sa.inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable or column.server_default is not None:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
 def init_db():
     from models import Account, Transaction 
+    from partitions import ensure_partitions
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    ensure_partitions(engine)
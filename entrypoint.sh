@@ -8,5 +8,12 @@ until pg_isready -h db -p 5432 -U bank_user; do
   sleep 2
 done
 
+# Multi-worker metrics: start every run with an empty metrics directory so stale worker files are not aggregated
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 echo "PostgreSQL is ready. Starting the application..."
-exec uvicorn main:app --host 0.0.0.0 --port 8000
+# /events streams never finish on their own; on shutdown they are cut after the timeout and the browsers reconnect
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-1}" --timeout-graceful-shutdown "${GRACEFUL_SHUTDOWN_TIMEOUT:-10}"
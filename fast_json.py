@@ -0,0 +1,19 @@
+# This file provides the JSON response class used by the hot read routes. It includes the following key components:
+# - FastJSONResponse: Serializes its content with orjson straight to bytes. A route that returns it instead of a dict
+#   skips FastAPI's jsonable_encoder, which walks and copies every value of the response in Python first.
+#   The content must already be made of types orjson handles natively (dict, list, str, int, float, bool, None and
+#   datetime, written as ISO 8601 like jsonable_encoder does). Decimal is refused rather than rounded through float,
+#   so routes turn money into exact strings with str() first.
+
+# fast_json.py
+from typing import Any
+
+import orjson
+from starlette.responses import Response
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
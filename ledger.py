@@ -0,0 +1,160 @@
+# This file implements the ledger balance mode (BALANCE_MODE=ledger). It includes the following key components:
+# - Postings: In ledger mode transfers and login deposits/withdrawals only insert transactions rows carrying a
+#   signed_amount (negative when money leaves the account). accounts.balance is never rewritten and keeps the balance
+#   the account had when postings started. Rows written in the default "column" mode have no signed_amount and are
+#   already included in accounts.balance, so a database can be switched from column to ledger mode in place (not back).
+# - Snapshots: balance_snapshots holds one compacted (balance, through_date) row per account. An account's balance is
+#   its snapshot (or accounts.balance when it has none) plus the postings dated after through_date, which is a range
+#   scan on idx_transactions_account_date however long the account's history is.
+# - lock_balance: Serializes postings that take money out of an account with SELECT ... FOR NO KEY UPDATE on its
+#   accounts row, then reads the balance. That lock does not conflict with the key-share lock the transactions
+#   foreign key check takes, so crediting a hot account never waits on anyone.
+# - take_snapshots / run_snapshotter: The balance_snapshotter job. Every LEDGER_SNAPSHOT_INTERVAL seconds it folds the
+#   postings older than LEDGER_SNAPSHOT_LAG seconds into the snapshots of the accounts that received them. Postings are
+#   timestamped before their transaction commits, so the lag must comfortably exceed the longest transfer transaction.
+#   On PostgreSQL an advisory lock lets only one worker take snapshots at a time.
+# - Prometheus Metrics: Snapshots written and postings folded into them.
+
+# ledger.py
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Account, BalanceSnapshot, Transaction
+
+BALANCE_MODE = os.getenv("BALANCE_MODE", "column").lower()
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "60"))
+LEDGER_SNAPSHOT_LAG = float(os.getenv("LEDGER_SNAPSHOT_LAG", "300"))
+
+# pg_try_advisory_xact_lock key shared by every worker's snapshotter
+_SNAPSHOT_LOCK_KEY = 0x6C656467
+CENT = Decimal("0.01")
+
+# Prometheus Metrics
+LEDGER_SNAPSHOTS = Counter("ledger_snapshots", "Account balance snapshots written by the snapshotter")
+LEDGER_POSTINGS_COMPACTED = Counter("ledger_postings_compacted", "Ledger postings folded into balance snapshots")
+
+
+def ledger_enabled() -> bool:
+    return BALANCE_MODE == "ledger"
+
+
+def _balances_query():
+    """SELECT account id, snapshot (or opening) balance + postings after the snapshot, for the accounts matched by .where()."""
+    delta = (
+        sa.select(sa.func.coalesce(sa.func.sum(Transaction.signed_amount), 0))
+        .where(
+            Transaction.account_id == Account.id,
+            sa.or_(BalanceSnapshot.through_date.is_(None), Transaction.transaction_date > BalanceSnapshot.through_date),
+        )
+        .correlate(Account, BalanceSnapshot)
+        .scalar_subquery()
+    )
+    return (
+        sa.select(Account.id, sa.func.coalesce(BalanceSnapshot.balance, Account.balance) + delta)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.account_id == Account.id)
+    )
+
+
+def balances(db: Session, account_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """Returns {account_id: balance} for the given accounts."""
+    rows = db.execute(_balances_query().where(Account.id.in_(set(account_ids)))).all()
+    return {account_id: Decimal(balance).quantize(CENT) for account_id, balance in rows}
+
+
+def user_balance(db: Session, user_id: int) -> Optional[Decimal]:
+    """Returns the balance of the user's account, or None when the user has no account."""
+    row = db.execute(_balances_query().where(Account.user_id == user_id).order_by(Account.id).limit(1)).first()
+    return Decimal(row[1]).quantize(CENT) if row else None
+
+
+def lock_balance(db: Session, account_id: int) -> Optional[Decimal]:
+    """Locks the account against concurrent debits and returns its balance, or None when the account does not exist."""
+    locked = db.execute(
+        sa.select(Account.id).where(Account.id == account_id).with_for_update(key_share=True)
+    ).scalar_one_or_none()
+    if locked is None:
+        return None
+    return balances(db, [account_id])[account_id]
+
+
+def take_snapshots(db: Session, cutoff: datetime) -> int:
+    """Folds the postings dated at or before cutoff into their accounts' snapshots; the caller commits."""
+    if db.get_bind().dialect.name == "postgresql":
+        if not db.execute(sa.text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _SNAPSHOT_LOCK_KEY}).scalar():
+            return 0
+
+    # Each run snapshots every account that received postings up to its cutoff, so only postings after the newest
+    # snapshot can still be missing from one.
+    since = db.execute(sa.select(sa.func.max(BalanceSnapshot.through_date))).scalar()
+    if since is not None and cutoff <= since:
+        return 0
+
+    query = (
+        sa.select(
+            Account.id,
+            BalanceSnapshot.through_date,
+            sa.func.coalesce(BalanceSnapshot.balance, Account.balance),
+            sa.func.sum(Transaction.signed_amount),
+            sa.func.count(Transaction.id),
+        )
+        .join(Transaction, Transaction.account_id == Account.id)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.account_id == Account.id)
+        .where(
+            Transaction.signed_amount.isnot(None),
+            Transaction.transaction_date <= cutoff,
+            sa.or_(BalanceSnapshot.through_date.is_(None), Transaction.transaction_date > BalanceSnapshot.through_date),
+        )
+        .group_by(Account.id, BalanceSnapshot.through_date, BalanceSnapshot.balance, Account.balance)
+    )
+    if since is not None:
+        query = query.where(Transaction.transaction_date > since)
+    rows = db.execute(query).all()
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    updates, inserts = [], []
+    for account_id, through_date, base, delta, postings in rows:
+        balance = (Decimal(base) + Decimal(delta)).quantize(CENT)
+        if through_date is None:
+            inserts.append({"account_id": account_id, "balance": balance, "through_date": cutoff, "taken_at": now})
+        else:
+            updates.append({"snapshot_account_id": account_id, "snapshot_balance": balance})
+        LEDGER_POSTINGS_COMPACTED.inc(postings)
+
+    snapshots = BalanceSnapshot.__table__
+    if updates:
+        db.execute(
+            snapshots.update()
+            .where(snapshots.c.account_id == sa.bindparam("snapshot_account_id"))
+            .values(balance=sa.bindparam("snapshot_balance"), through_date=cutoff, taken_at=now),
+            updates,
+        )
+    if inserts:
+        db.execute(sa.insert(BalanceSnapshot), inserts)
+    LEDGER_SNAPSHOTS.inc(len(rows))
+    return len(rows)
+
+
+def run_snapshotter():
+    """Takes one round of snapshots through LEDGER_SNAPSHOT_LAG seconds ago."""
+    cutoff = datetime.utcnow() - timedelta(seconds=LEDGER_SNAPSHOT_LAG)
+    db = SessionLocal()
+    try:
+        written = take_snapshots(db, cutoff)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    if written:
+        logger.info(f"Ledger snapshots taken | Accounts: {written} | Through: {cutoff.isoformat()}")
@@ -0,0 +1,224 @@
+# This file configures application logging once for the whole process. It includes the following key components:
+# - setup_logging: Replaces loguru's handlers with a single sink. Called once from main.py; routes only import `logger`.
+# - BatchedLogWriter: The sink puts each serialized record on a bounded queue and returns immediately. A background
+#   thread drains the queue and writes to LOG_FILE in batches (LOG_BATCH_SIZE lines or every LOG_FLUSH_INTERVAL
+#   seconds), rotating the file weekly, so no file I/O happens on the request path. When the queue is full, records are
+#   dropped and counted rather than blocking the request.
+# - LogSampler: Per-route / per-module sampling of INFO-and-below lines (LOG_SAMPLE_RATES, e.g.
+#   "/balance=0.1,routes.transactions_routes=0.25"); warnings and errors are always kept.
+# - Prometheus Metrics: Queued records (sampled by the writer each batch), records written, write batch sizes and records
+#   dropped (by reason).
+
+# logging_config.py
+import atexit
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Dict, Optional
+
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+
+LOG_FILE = os.getenv("LOG_FILE", "logs.json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ROTATION_SECONDS = float(os.getenv("LOG_ROTATION_SECONDS", str(7 * 24 * 3600)))
+LOG_STDERR = os.getenv("LOG_STDERR", "1") == "1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# Prometheus Metrics
+LOG_QUEUED = Gauge("log_records_queued", "Log records waiting for the background writer", multiprocess_mode="livesum")
+LOG_WRITTEN = Counter("log_records_written", "Log records written to the log file")
+LOG_DROPPED = Counter("log_records_dropped", "Log records dropped before being written", ["reason"])
+LOG_BATCH = Histogram("log_write_batch_size", "Log records written per batch", buckets=(1, 5, 10, 50, 100, 250, 500, 1000))
+
+WARNING_LEVEL_NO = 30
+_STOP = object()
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parses "key=rate,key=rate" where key is a request path or a module name."""
+    rates = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        key, _, rate = part.partition("=")
+        rates[key.strip()] = float(rate)
+    return rates
+
+
+class LogSampler:
+    """loguru filter that keeps a fraction of INFO-and-below records per route (extra["route"]) or module."""
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+
+    def __call__(self, record) -> bool:
+        if not self.rates or record["level"].no >= WARNING_LEVEL_NO:
+            return True
+        rate = self.rates.get(record["extra"].get("route"))
+        if rate is None:
+            rate = self.rates.get(record["name"])
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        LOG_DROPPED.labels(reason="sampled").inc()
+        return False
+
+
+def format_text(record) -> str:
+    """Human-readable line in loguru's default layout, used for the stderr echo."""
+    t = record["time"]
+    text = (
+        f"{t:%Y-%m-%d %H:%M:%S}.{t.microsecond // 1000:03d} | {record['level'].name: <8} | "
+        f"{record['name']}:{record['function']}:{record['line']} - {record['message']}\n"
+    )
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_tb = record["exception"]
+        text += "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
+    return text
+
+
+class BatchedLogWriter:
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 1.0, max_queue: int = 10000,
+                 rotation_seconds: float = 7 * 24 * 3600, echo: bool = False):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotation_seconds = rotation_seconds
+        self.echo = echo
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def sink(self, message):
+        """loguru sink: hands the serialized record to the writer thread without blocking."""
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            LOG_DROPPED.labels(reason="queue_full").inc()
+
+    def stop(self, timeout: float = 5.0):
+        """Flushes everything queued so far and stops the writer thread."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            LOG_QUEUED.set(self.queue.qsize())
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch):
+        try:
+            self._open()
+            self._file.write("".join(batch))
+            self._file.flush()
+        except OSError as e:
+            LOG_DROPPED.labels(reason="write_error").inc(len(batch))
+            sys.stderr.write(f"log writer: failed to write {len(batch)} records to {self.path}: {e}\n")
+        else:
+            LOG_WRITTEN.inc(len(batch))
+            LOG_BATCH.observe(len(batch))
+
+        if self.echo:
+            try:
+                sys.stderr.write("".join(format_text(message.record) for message in batch))
+                sys.stderr.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _open(self):
+        now = time.time()
+        if self._file is not None and now - self._opened_at >= self.rotation_seconds:
+            self._file.close()
+            self._file = None
+            stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+            root, ext = os.path.splitext(self.path)
+            os.replace(self.path, f"{root}.{stamp}{ext}")
+        if self._file is None:
+            self._opened_at = now
+            self._file = open(self.path, "a", encoding="utf-8")
+
+
+_writer: Optional[BatchedLogWriter] = None
+_handler_id: Optional[int] = None
+
+
+def setup_logging():
+    """Installs the single queued log sink; safe to call more than once."""
+    global _writer, _handler_id
+    if _writer is not None:
+        return _writer
+
+    _writer = BatchedLogWriter(
+        LOG_FILE,
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        max_queue=LOG_QUEUE_SIZE,
+        rotation_seconds=LOG_ROTATION_SECONDS,
+        echo=LOG_STDERR,
+    ).start()
+
+    logger.remove()
+    _handler_id = logger.add(
+        _writer.sink,
+        level=LOG_LEVEL,
+        serialize=True,
+        filter=LogSampler(parse_sample_rates(LOG_SAMPLE_RATES)),
+        catch=True,
+    )
+    atexit.register(shutdown_logging)
+    return _writer
+
+
+def shutdown_logging():
+    """Detaches the sink and flushes whatever is still queued."""
+    global _writer, _handler_id
+    if _handler_id is not None:
+        logger.remove(_handler_id)
+        _handler_id = None
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
@@ -1,14 +1,13 @@
 # This file initializes and configures the FastAPI application. It includes the following key components:
 # - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, Prometheus metrics, logging, and CORS middleware.
-# - App Initialization: Creates an instance of FastAPI and initializes the database.
-# - Logging: Configured using loguru to log information and errors to a JSON file.
-# - Routers: Includes routers for authentication, balance, transactions, transfers, and registration routes.
-# - Middleware: Adds CORS and rate limiting middleware, and tracks API requests and response times.
+# - App Initialization: Creates an instance of FastAPI and initializes the database; the lifespan starts the background jobs and the account event hub (see account_events.py) and shuts them, the group-commit writer, the login transaction simulator and the password-hashing pool down on exit.
+# - Logging: setup_logging() installs the single queued, batched JSON log sink (see logging_config.py); routes only import the logger.
+# - Routers: Includes routers for authentication, balance, transactions, transfers, registration and the /events stream.
+# - Middleware: Adds CORS and rate limiting middleware, and the ASGI MetricsMiddleware that tracks API requests and response times per route template.
 # - Exception Handlers: Custom handlers for HTTP exceptions, validation errors, and generic exceptions.
-# - Prometheus Metrics: Counters and histograms to track API requests, response times, and exceptions.
 # - Static Files: Serves static files and templates for SSR.
 # - HTML Endpoints: Defines endpoints for rendering HTML pages.
-# - Metrics Endpoint: Exposes Prometheus metrics.
+# - Metrics Endpoint: Exposes Prometheus metrics, aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set.
 # - Main Entry Point: Runs the application using uvicorn.
 
 from fastapi import FastAPI, Request, Response
@@ -18,23 +17,57 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from prometheus_client import Counter, Histogram, generate_latest
 from slowapi.middleware import SlowAPIMiddleware
 from loguru import logger
-import time
+from contextlib import asynccontextmanager
 import traceback
 
+import account_events
+import group_commit
+import password_hasher
+import transaction_simulator
+from logging_config import setup_logging
+from metrics_middleware import MetricsMiddleware
+from multiprocess_metrics import generate_metrics
+from background_jobs import PeriodicJob
+
 from rate_limiter import limiter
-from database import init_db
-from routes import auth_routes, balance_routes, transactions_routes, transfer_routes, registration_routes
+from database import init_db, reconcile_user_count, USER_COUNT_RECONCILE_INTERVAL
+from ledger import ledger_enabled, run_snapshotter, LEDGER_SNAPSHOT_INTERVAL
+from balance_shards import run_rebalancer, BALANCE_SHARD_REBALANCE_INTERVAL
+from partitions import partitioning_enabled, run_partition_manager, TRANSACTION_PARTITION_MAINTENANCE_INTERVAL
+from archive import archive_enabled, run_archiver, ARCHIVE_INTERVAL
+from replicas import replica_router, REPLICA_LAG_CHECK_INTERVAL
+from routes import auth_routes, balance_routes, transactions_routes, transfer_routes, registration_routes, events_routes
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jobs = [
+        PeriodicJob("user_count_reconciler", USER_COUNT_RECONCILE_INTERVAL, reconcile_user_count),
+        PeriodicJob("balance_snapshotter", LEDGER_SNAPSHOT_INTERVAL if ledger_enabled() else 0, run_snapshotter),
+        PeriodicJob("balance_shard_rebalancer", 0 if ledger_enabled() else BALANCE_SHARD_REBALANCE_INTERVAL, run_rebalancer),
+        PeriodicJob("transaction_partition_manager", TRANSACTION_PARTITION_MAINTENANCE_INTERVAL if partitioning_enabled() else 0, run_partition_manager),
+        PeriodicJob("transaction_archiver", ARCHIVE_INTERVAL if archive_enabled() else 0, run_archiver),
+        PeriodicJob("replica_lag_monitor", REPLICA_LAG_CHECK_INTERVAL if replica_router.enabled else 0, replica_router.check_lag),
+    ]
+    for job in jobs:
+        job.start()
+    account_events.hub.start()
+    yield
+    await account_events.hub.stop()
+    for job in jobs:
+        job.stop()
+    group_commit.shutdown()
+    transaction_simulator.shutdown()
+    password_hasher.shutdown()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.state.limiter = limiter
 init_db()
 
 # Configure logging
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
+setup_logging()
 
 # Include routers
 app.include_router(auth_routes.router)
@@ -42,6 +75,7 @@ app.include_router(balance_routes.router)
 app.include_router(transactions_routes.router)
 app.include_router(transfer_routes.router)
 app.include_router(registration_routes.router)
+app.include_router(events_routes.router)
 
 # CORS Middleware
 app.add_middleware(
@@ -50,14 +84,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the SPA read the ETag it sends back as If-None-Match
+    expose_headers=["ETag"],
 )
 app.add_middleware(SlowAPIMiddleware)
-
-# Prometheus Metrics
-REQUEST_COUNT = Counter("request_count", "Total number of API requests", ["method", "endpoint"])
-REQUEST_LATENCY = Histogram("request_latency_seconds", "Request latency in seconds", ["method", "endpoint"])
-RESPONSE_STATUS = Counter("response_status", "Response status count", ["status_code"])
-EXCEPTION_COUNT = Counter("exception_count", "Total exceptions raised", ["endpoint"])
+# Outermost, so it times the whole stack and sees the route the router matched
+app.add_middleware(MetricsMiddleware)
 
 # Serve static files
 templates = Jinja2Templates(directory="ssr-frontend/templates")
@@ -89,38 +121,10 @@ async def generic_exception_handler(request: Request, exc: Exception):
         content={"error": "Internal server error"},
     )
 
-# Middleware to track API requests and response times
-@app.middleware("http")
-async def track_requests(request: Request, call_next):
-    method = request.method
-    endpoint = request.url.path
-    client_ip = request.client.host
-
-    REQUEST_COUNT.labels(method=method, endpoint=endpoint).inc()
-
-    start_time = time.time()
-    try:
-        response = await call_next(request)
-        latency = time.time() - start_time
-        REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(latency)
-        RESPONSE_STATUS.labels(status_code=response.status_code).inc()
-
-        # Log API requests
-        logger.info(f"Request: {method} {endpoint} | Status: {response.status_code} | Latency: {latency:.4f}s | IP: {client_ip}")
-
-        return response
-    except Exception as e:
-        EXCEPTION_COUNT.labels(endpoint=endpoint).inc()
-
-        # Log errors
-        logger.error(f"Exception at {endpoint} | Method: {method} | IP: {client_ip} | Error: {str(e)}")
-        raise
-
-
 # Expose Prometheus metrics
 @app.get("/metrics")
 def get_metrics():
-    return Response(generate_latest(), media_type="text/plain")
+    return Response(generate_metrics(), media_type="text/plain")
 
 
 # HTML Endpoints (SSR)
@@ -0,0 +1,100 @@
+# This file contains the request instrumentation middleware. It includes the following key components:
+# - MetricsMiddleware: A raw ASGI middleware (no BaseHTTPMiddleware task/stream wrapping) that times every HTTP
+#   request with time.perf_counter, counts requests, statuses and exceptions, and logs the request line.
+# - route_label: Labels requests by the matched route template (e.g. "/transactions/export"), which the router stores
+#   in scope["route"]. Paths that match no route share the single UNMATCHED_ROUTE label, so scanners probing random
+#   URLs cannot create new time series.
+# - Request Context: current_request exposes the in-flight request (its route and statement count) to code running on
+#   its behalf, including threadpool and run_sync work, which query_instrumentation uses to attribute SQL statements.
+# - Prometheus Metrics: request_count, request_latency_seconds, response_status, exception_count and
+#   db_statements_per_request.
+
+# metrics_middleware.py
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from loguru import logger
+from prometheus_client import Counter, Histogram
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Prometheus Metrics
+REQUEST_COUNT = Counter("request_count", "Total number of API requests", ["method", "endpoint"])
+REQUEST_LATENCY = Histogram("request_latency_seconds", "Request latency in seconds", ["method", "endpoint"])
+RESPONSE_STATUS = Counter("response_status", "Response status count", ["status_code"])
+EXCEPTION_COUNT = Counter("exception_count", "Total exceptions raised", ["endpoint"])
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "db_statements_per_request", "Database statements executed per request", ["endpoint"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 10, 15, 20, 30, 50, 100),
+)
+
+
+def route_label(scope) -> str:
+    """Returns the matched route template for a request scope, or UNMATCHED_ROUTE."""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path if path else UNMATCHED_ROUTE
+
+
+class RequestContext:
+    __slots__ = ("scope", "statements")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+
+    @property
+    def route(self) -> str:
+        return route_label(self.scope)
+
+
+current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        client_ip = scope["client"][0] if scope.get("client") else None
+        request = RequestContext(scope)
+        token = current_request.set(request)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            endpoint = route_label(scope)
+            EXCEPTION_COUNT.labels(endpoint=endpoint).inc()
+
+            # Log errors
+            logger.error(f"Exception at {scope['path']} | Method: {method} | IP: {client_ip} | Error: {str(e)}")
+            raise
+        finally:
+            # The router has filled in scope["route"] by now, so label after the request has been handled
+            latency = time.perf_counter() - start_time
+            current_request.reset(token)
+            endpoint = route_label(scope)
+            REQUEST_COUNT.labels(method=method, endpoint=endpoint).inc()
+            REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(latency)
+            DB_STATEMENTS_PER_REQUEST.labels(endpoint=endpoint).observe(request.statements)
+
+        RESPONSE_STATUS.labels(status_code=status_code).inc()
+
+        # Log API requests (bound to the route template so LOG_SAMPLE_RATES can sample per route)
+        logger.bind(route=endpoint).info(
+            f"Request: {method} {scope['path']} | Status: {status_code} | Latency: {latency:.4f}s | IP: {client_ip}"
+        )
@@ -2,12 +2,26 @@
 # - User Model: Represents the users of the application with fields for id, username, email, and password hash.
 # - Account Model: Represents the accounts associated with users, with fields for id, user_id, balance, and creation date.
 # - Transaction Model: Represents the transactions associated with accounts, with fields for id, account_id, transaction type, amount, transaction date, and description.
+#   In ledger mode (see ledger.py) each row is also a posting whose signed_amount is added to the account's balance.
+#   On PostgreSQL the table is range partitioned by month on transaction_date; that is decided when the table is
+#   created, per database, so the model itself is the same everywhere (see partitions.py).
+# - AccountBalanceShard Model: One of the K sub-balances of a sharded hot account (see balance_shards.py); accounts opt in
+#   through Account.shard_count.
+# - BalanceSnapshot Model: The ledger's compacted balance per account, covering every posting up to through_date.
+# - Rollup Models: AccountDailyRollup, DailyTransactionTotal and BankCounter hold the transaction and signup totals
+#   that rollups.py maintains in the same transaction as every write.
+# - AccountVersion Model: A counter per account, bumped by every write that changes its balance or history; the ETags
+#   of /balance and /transactions are built from it (see account_versions.py).
+# - TransactionArchiveState Model: The archive watermark; transactions dated before archived_before live in the
+#   segment files written by archive.py instead of the transactions table.
 # The models include necessary relationships, constraints, and indexes to ensure data integrity and efficient querying.
 
 
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, Text, ForeignKey, Column, String, Index
+from sqlalchemy import BigInteger, Column, Date, Integer, String, Numeric, DateTime, Text, ForeignKey, Column, String, Index
 from datetime import datetime
 from database import Base
+# Registers the PostgreSQL CREATE TABLE that partitions transactions
+import partitions
 
 
 class User(Base):
@@ -28,13 +42,85 @@ class Account(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     balance = Column(Numeric(15, 2), default=0.00)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Number of account_balance_shards rows holding this account's money; NULL for a plain account
+    shard_count = Column(Integer)
+
+
+class AccountBalanceShard(Base):
+    __tablename__ = "account_balance_shards"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    balance = Column(Numeric(15, 2), nullable=False, default=0.00)
 
 
 class Transaction(Base):
     __tablename__ = "transactions"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False, index=True)
     transaction_type = Column(String(20), nullable=False)
     amount = Column(Numeric(15, 2), nullable=False)
     transaction_date = Column(DateTime, default=datetime.utcnow)
-    description = Column(Text)
\ No newline at end of file
+    description = Column(Text)
+    # Ledger postings only: +amount into the account, -amount out of it
+    signed_amount = Column(Numeric(15, 2))
+
+    __table_args__ = (
+        Index('idx_transactions_account_date', 'account_id', 'transaction_date'),
+        # Rows arrive in date order, so a BRIN index finds recent postings for the snapshotter at almost no write cost
+        Index('idx_transactions_date', 'transaction_date', postgresql_using='brin'),
+    )
+
+
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    balance = Column(Numeric(15, 2), nullable=False)
+    through_date = Column(DateTime, nullable=False)
+    taken_at = Column(DateTime, default=datetime.utcnow)
+
+
+class AccountDailyRollup(Base):
+    __tablename__ = "account_daily_rollups"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    # Like the bank-wide totals: a popular account's credits do not all queue on one row; readers sum the slots
+    slot = Column(Integer, primary_key=True, default=0)
+    count = Column(Integer, nullable=False, default=0)
+    # Money into (credits) and out of (debits) the account
+    credits = Column(Numeric(15, 2), nullable=False, default=0.00)
+    debits = Column(Numeric(15, 2), nullable=False, default=0.00)
+
+
+class DailyTransactionTotal(Base):
+    __tablename__ = "daily_transaction_totals"
+    day = Column(Date, primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    # Writers add to a random slot so they do not all queue on one row; readers sum the slots
+    slot = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    credits = Column(Numeric(20, 2), nullable=False, default=0.00)
+    debits = Column(Numeric(20, 2), nullable=False, default=0.00)
+
+
+class BankCounter(Base):
+    __tablename__ = "bank_counters"
+    name = Column(String(40), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class AccountVersion(Base):
+    __tablename__ = "account_versions"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    # Writers bump a random slot, so transfers to one account do not queue on one row; the version is the sum of the
+    # slots, and no row yet reads as version 0
+    slot = Column(Integer, primary_key=True, default=0)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class TransactionArchiveState(Base):
+    __tablename__ = "transaction_archive_state"
+    # A single row, id 1
+    id = Column(Integer, primary_key=True)
+    archived_before = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,80 @@
+# This file adds multi-worker support to the Prometheus metrics. It includes the following key components:
+# - Multi-process Mode: Enabled by pointing PROMETHEUS_MULTIPROC_DIR at an empty, writable directory before the
+#   workers start (entrypoint.sh wipes and recreates it). prometheus_client then keeps every worker's values in
+#   mmap-backed files in that directory instead of in per-process memory.
+# - generate_metrics: Returns the /metrics payload. In multi-process mode it aggregates all workers' files with a
+#   MultiProcessCollector (counters and histograms are summed, gauges follow their multiprocess_mode), otherwise it
+#   returns the default registry as before.
+# - cleanup_dead_workers: Removes the live-gauge files of workers that have exited, so "livesum"/"livemax" gauges stop
+#   counting them. Counter and histogram files are kept so totals never go backwards. Runs at most every
+#   METRICS_DEAD_WORKER_SCAN_INTERVAL seconds from /metrics.
+# Gauges declare how they aggregate: USER_COUNT uses "livemax" (every worker tracks the same global value), and the
+# per-worker queue and cache gauges use "livesum".
+
+# multiprocess_metrics.py
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+METRICS_DEAD_WORKER_SCAN_INTERVAL = float(os.getenv("METRICS_DEAD_WORKER_SCAN_INTERVAL", "30"))
+
+_PID_FILE = re.compile(r"_(\d+)\.db$")
+_reaped = set()
+_last_scan = 0.0
+_scan_lock = threading.Lock()
+
+
+def multiprocess_enabled() -> bool:
+    return bool(PROMETHEUS_MULTIPROC_DIR)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_dead_workers(path: Optional[str] = None) -> List[int]:
+    """Marks every worker that owns files in the metrics directory but is no longer running as dead."""
+    path = path or PROMETHEUS_MULTIPROC_DIR
+    pids = set()
+    for name in os.listdir(path):
+        match = _PID_FILE.search(name)
+        if match:
+            pids.add(int(match.group(1)))
+
+    dead = []
+    for pid in pids:
+        if _pid_alive(pid):
+            _reaped.discard(pid)  # the pid may have been reused by a new worker
+        elif pid not in _reaped:
+            multiprocess.mark_process_dead(pid, path)
+            _reaped.add(pid)
+            dead.append(pid)
+    return dead
+
+
+def generate_metrics() -> bytes:
+    """Returns the Prometheus exposition for this process, or for all workers in multi-process mode."""
+    global _last_scan
+    if not multiprocess_enabled():
+        return generate_latest()
+
+    with _scan_lock:
+        now = time.monotonic()
+        if now - _last_scan >= METRICS_DEAD_WORKER_SCAN_INTERVAL:
+            _last_scan = now
+            cleanup_dead_workers()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    return generate_latest(registry)
@@ -0,0 +1,247 @@
+# This file manages the monthly range partitions of the transactions table on PostgreSQL. It includes the following key components:
+# - Partitioning: With TRANSACTION_PARTITIONING=monthly (the default) a new PostgreSQL database creates transactions as
+#   a table PARTITION BY RANGE (transaction_date) with one partition per calendar month, named transactions_yYYYYmMM.
+#   The primary key becomes (id, transaction_date), since a partitioned table's keys must include the partition key.
+#   Only the CREATE TABLE says so: the Transaction model keeps id as its one primary key on every database, and the
+#   PostgreSQL DDL compiler below adds the partition key and PARTITION BY for the database being created.
+#   Each partition has its own small idx_transactions_account_date and is vacuumed on its own, and queries bounded on
+#   transaction_date (a /transactions cursor page, the ledger snapshotter) only scan the months they can match.
+#   SQLite, and a transactions table created before partitioning, stay a single plain table.
+# - ensure_partitions: Creates the partitions from the current UTC month (rows are dated with utcnow()) through
+#   TRANSACTION_PARTITIONS_AHEAD months ahead, so a write never finds its month missing. init_db runs it on startup,
+#   and the transaction_partition_manager job runs it every TRANSACTION_PARTITION_MAINTENANCE_INTERVAL seconds, under
+#   an advisory lock so workers take turns.
+# - Default Partition: transactions_default takes the rows no monthly partition covers, such as a backfill older
+#   than the first partition or a month the job did not create in time, so those inserts still succeed. It should
+#   stay empty: ensure_partitions reports its row count in a gauge and logs a warning while it has rows, and moves
+#   the rows of a month into that month's partition when it creates it.
+# - detach_partitions: With TRANSACTION_PARTITION_RETENTION_MONTHS > 0 the job detaches partitions that ended more
+#   than that many months ago (DETACH ... CONCURRENTLY on PostgreSQL 14+, so writers are not blocked). A detached
+#   partition stays behind as a plain table to archive or drop; its rows leave /transactions and the exports, while the
+#   rollups keep counting them. A partition still holding ledger postings newer than their account's balance
+#   snapshot is kept, because balances are computed from those postings.
+# - Prometheus Metrics: Partitions created and detached, and rows in the default partition.
+#
+# Usage: python partitions.py ensure | detach | list
+
+# partitions.py
+import argparse
+import os
+import re
+import sys
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter, Gauge
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable
+
+from database import engine
+
+TRANSACTION_PARTITIONING = os.getenv("TRANSACTION_PARTITIONING", "monthly").lower()
+TRANSACTION_PARTITIONS_AHEAD = int(os.getenv("TRANSACTION_PARTITIONS_AHEAD", "3"))
+TRANSACTION_PARTITION_RETENTION_MONTHS = int(os.getenv("TRANSACTION_PARTITION_RETENTION_MONTHS", "0"))
+TRANSACTION_PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("TRANSACTION_PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+# pg_advisory_xact_lock key shared by every worker's partition manager
+_PARTITION_LOCK_KEY = 0x70617274
+_PARTITION_NAME = re.compile(r"^transactions_y(\d{4})m(\d{2})$")
+DEFAULT_PARTITION = "transactions_default"
+
+# Prometheus Metrics
+PARTITIONS_CREATED = Counter("transaction_partitions_created", "Monthly transactions partitions created")
+PARTITIONS_DETACHED = Counter("transaction_partitions_detached", "Monthly transactions partitions detached")
+DEFAULT_PARTITION_ROWS = Gauge(
+    "transaction_default_partition_rows", "Rows in the transactions default partition, outside every monthly partition",
+    multiprocess_mode="max",
+)
+
+
+def partitioning_enabled(bind=engine) -> bool:
+    """True when new transactions tables are created partitioned, which needs PostgreSQL."""
+    return TRANSACTION_PARTITIONING == "monthly" and bind.dialect.name == "postgresql"
+
+
+def utc_today() -> date:
+    """Today's date in UTC, the clock transaction_date is written with."""
+    return datetime.utcnow().date()
+
+
+def _partitions_table(table) -> bool:
+    return table is not None and table.name == "transactions" and TRANSACTION_PARTITIONING == "monthly"
+
+
+@compiles(sa.PrimaryKeyConstraint, "postgresql")
+def _compile_primary_key(constraint, compiler, **kw):
+    ddl = compiler.visit_primary_key_constraint(constraint, **kw)
+    if ddl and _partitions_table(constraint.table) and "transaction_date" not in constraint.columns:
+        # "PRIMARY KEY (id)" -> "PRIMARY KEY (id, transaction_date)"
+        ddl = f"{ddl[:-1]}, transaction_date)"
+    return ddl
+
+
+@compiles(CreateTable, "postgresql")
+def _compile_create_table(create, compiler, **kw):
+    ddl = compiler.visit_create_table(create, **kw)
+    if _partitions_table(create.element):
+        ddl = f"{ddl.rstrip()} PARTITION BY RANGE (transaction_date)\n\n"
+    return ddl
+
+
+def add_months(month: date, months: int) -> date:
+    """Returns the first day of the month `months` after (or before, when negative) month's month."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Returns the month a partition name covers, or None for a table this module did not name."""
+    match = _PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def is_partitioned(conn) -> bool:
+    return conn.execute(sa.text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('transactions')")).scalar() or False
+
+
+def attached_partitions(conn) -> Dict[str, date]:
+    """Returns {partition name: month} for the monthly partitions attached to transactions."""
+    names = conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('transactions')"
+    )).scalars()
+    return {name: month for name, month in ((name, partition_month(name)) for name in names) if month is not None}
+
+
+def has_default_partition(conn) -> bool:
+    return conn.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('transactions') AND partdefid <> 0"
+    )).first() is not None
+
+
+def _create_partition(conn, month: date, has_default: bool):
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    in_range = f"transaction_date >= '{month.isoformat()}' AND transaction_date < '{add_months(month, 1).isoformat()}'"
+    if has_default and conn.execute(sa.text(f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range} LIMIT 1")).first():
+        # A partition cannot be created over rows the default partition already holds; build it on the side, move
+        # the month's rows into it and attach it
+        conn.execute(sa.text(f"CREATE TABLE {name} (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        moved = conn.execute(sa.text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        )).rowcount
+        conn.execute(sa.text(f"ALTER TABLE transactions ATTACH PARTITION {name} FOR VALUES {bounds}"))
+        logger.warning(f"Transactions moved out of the default partition | Partition: {name} | Rows: {moved}")
+    else:
+        conn.execute(sa.text(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES {bounds}"))
+
+
+def ensure_partitions(bind=engine, today: Optional[date] = None, ahead: int = TRANSACTION_PARTITIONS_AHEAD) -> List[str]:
+    """Creates the default partition and the missing monthly ones from today's month (UTC) through `ahead` months
+    later; returns the names of the monthly partitions created."""
+    if bind.dialect.name != "postgresql":
+        return []
+    first = add_months(today or utc_today(), 0)
+    created = []
+    with bind.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        conn.execute(sa.text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PARTITION_LOCK_KEY})
+        has_default = has_default_partition(conn)
+        if not has_default:
+            conn.execute(sa.text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF transactions DEFAULT"))
+            logger.info(f"Transactions default partition created | Partition: {DEFAULT_PARTITION}")
+        existing = attached_partitions(conn)
+        for offset in range(ahead + 1):
+            month = add_months(first, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            _create_partition(conn, month, has_default)
+            created.append(name)
+        default_rows = conn.execute(sa.text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+    PARTITIONS_CREATED.inc(len(created))
+    DEFAULT_PARTITION_ROWS.set(default_rows)
+    if created:
+        logger.info(f"Transactions partitions created | Partitions: {', '.join(created)}")
+    if default_rows:
+        logger.warning(
+            f"Transactions default partition has rows | Partition: {DEFAULT_PARTITION} | Rows: {default_rows} | "
+            "Create the monthly partitions they belong to"
+        )
+    return created
+
+
+def _has_unsnapshotted_postings(conn, name: str) -> bool:
+    return conn.execute(sa.text(
+        f"SELECT 1 FROM {name} t LEFT JOIN balance_snapshots s ON s.account_id = t.account_id "
+        "WHERE t.signed_amount IS NOT NULL AND (s.through_date IS NULL OR t.transaction_date > s.through_date) LIMIT 1"
+    )).first() is not None
+
+
+def detach_partitions(bind=engine, today: Optional[date] = None, retention_months: int = TRANSACTION_PARTITION_RETENTION_MONTHS) -> List[str]:
+    """Detaches the partitions that ended more than retention_months months before today's month; returns their names."""
+    if bind.dialect.name != "postgresql" or retention_months <= 0:
+        return []
+    cutoff = add_months(today or utc_today(), -retention_months)
+    with bind.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        candidates = sorted(name for name, month in attached_partitions(conn).items() if add_months(month, 1) <= cutoff)
+        candidates = [name for name in candidates if not _has_unsnapshotted_postings(conn, name)]
+
+    concurrently = " CONCURRENTLY" if bind.dialect.server_version_info >= (14,) else ""
+    detached = []
+    for name in candidates:
+        # DETACH ... CONCURRENTLY cannot run inside a transaction block
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(sa.text(f"ALTER TABLE transactions DETACH PARTITION {name}{concurrently}"))
+        detached.append(name)
+        PARTITIONS_DETACHED.inc()
+        logger.info(f"Transactions partition detached | Partition: {name}")
+    return detached
+
+
+def run_partition_manager():
+    """Creates upcoming partitions and detaches expired ones."""
+    ensure_partitions()
+    detach_partitions()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the transactions table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ensure", help="create the partitions for this month and the next TRANSACTION_PARTITIONS_AHEAD")
+    detach = commands.add_parser("detach", help="detach partitions older than the retention period")
+    detach.add_argument("--retention-months", type=int, default=TRANSACTION_PARTITION_RETENTION_MONTHS)
+    commands.add_parser("list", help="list the attached monthly partitions")
+    args = parser.parse_args(argv)
+
+    if engine.dialect.name != "postgresql":
+        logger.error("Transactions partitioning requires PostgreSQL")
+        return 1
+    if args.command == "ensure":
+        ensure_partitions()
+    elif args.command == "detach":
+        detach_partitions(retention_months=args.retention_months)
+    else:
+        with engine.connect() as conn:
+            if not is_partitioned(conn):
+                logger.info("The transactions table is not partitioned")
+            for name, month in sorted(attached_partitions(conn).items(), key=lambda item: item[1]):
+                print(f"{name}\t{month.isoformat()}\t{add_months(month, 1).isoformat()}")
+            if has_default_partition(conn):
+                rows = conn.execute(sa.text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+                print(f"{DEFAULT_PARTITION}\tDEFAULT\t{rows} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# This file provides the password-hashing service used by the login and registration routes. It includes the following key components:
+# - Configuration: BCRYPT_ROUNDS sets the bcrypt work factor, PASSWORD_HASH_WORKERS the size of the process pool
+#   (0 hashes on the threadpool instead, for single-core hosts and tests) and PASSWORD_HASH_MAX_PENDING how many
+#   hashes may be queued before new requests are turned away with a 503.
+# - Process Pool: A bounded ProcessPoolExecutor, created lazily, so bcrypt runs on its own cores instead of holding
+#   request threads and the GIL while /balance and /transactions wait.
+# - hash_password / verify_password: Async wrappers that submit the work to the pool and await the result.
+# - needs_rehash: Detects hashes made with a different work factor so login can upgrade them transparently.
+# - hash_passwords: Synchronous bulk hashing across the same pool, for offline jobs such as bulk_onboarding.py.
+# - Prometheus Metrics: Queue depth, rejected submissions and end-to-end hash/verify latency.
+
+# password_hasher.py
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
+
+import bcrypt
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.concurrency import run_in_threadpool
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "1000"))
+
+# Prometheus Metrics
+PASSWORD_HASH_QUEUE_DEPTH = Gauge("password_hash_queue_depth", "Password hash/verify operations queued or running", multiprocess_mode="livesum")
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "Password hash/verify operations rejected because the queue was full")
+PASSWORD_HASH_LATENCY = Histogram("password_hash_latency_seconds", "Time from submitting a password hash/verify to its result", ["operation"])
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _verify(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+
+def get_executor():
+    """Returns the shared process pool, or None when hashing runs on the threadpool."""
+    global _executor
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn keeps the workers free of the server's threads and open connections
+                _executor = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def _submit(operation: str, fn, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(status_code=503, detail="Server busy, please retry")
+        _pending += 1
+    PASSWORD_HASH_QUEUE_DEPTH.inc()
+
+    start_time = time.perf_counter()
+    try:
+        executor = get_executor()
+        if executor is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        PASSWORD_HASH_LATENCY.labels(operation=operation).observe(time.perf_counter() - start_time)
+        PASSWORD_HASH_QUEUE_DEPTH.dec()
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """Hashes a password with the configured work factor."""
+    hashed = await _submit("hash", _hash, password.encode("utf-8"), BCRYPT_ROUNDS)
+    return hashed.decode("utf-8")
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _submit("verify", _verify, password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+def hash_passwords(passwords: List[str], rounds: Optional[int] = None) -> List[str]:
+    """Hashes many passwords in parallel on the process pool (blocking; not for use on the event loop)."""
+    rounds = BCRYPT_ROUNDS if rounds is None else rounds
+    encoded = [password.encode("utf-8") for password in passwords]
+    executor = get_executor()
+    start_time = time.perf_counter()
+    if executor is None:
+        hashed = [_hash(password, rounds) for password in encoded]
+    else:
+        chunksize = max(1, len(encoded) // (PASSWORD_HASH_WORKERS * 4))
+        hashed = list(executor.map(_hash, encoded, repeat(rounds), chunksize=chunksize))
+    PASSWORD_HASH_LATENCY.labels(operation="bulk_hash").observe(time.perf_counter() - start_time)
+    return [h.decode("utf-8") for h in hashed]
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """True when the stored hash was made with a different work factor than BCRYPT_ROUNDS."""
+    try:
+        return int(password_hash.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,119 @@
+# This file provides the authenticated-principal cache used by get_current_user. It includes the following key components:
+# - Principal: A lightweight, immutable snapshot of the authenticated user (id, username, email) handed to the routes.
+# - PrincipalCache: A bounded, thread-safe LRU of verified tokens keyed by the token's SHA-256 digest. Entries expire
+#   after PRINCIPAL_CACHE_TTL seconds and never outlive the token's own `exp` claim.
+# - Invalidation: invalidate_user() drops every cached token of a user and should be called whenever a user is
+#   deleted or changed; clear() drops everything.
+# - Prometheus Metrics: Hit/miss/invalidation counters and a gauge of cached entries.
+# With a warm cache the dashboard polling of /balance and /transactions skips both the JWT decode and the users lookup.
+
+# principal_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+
+# Prometheus Metrics
+PRINCIPAL_CACHE_HITS = Counter("principal_cache_hits", "Authenticated requests served from the principal cache")
+PRINCIPAL_CACHE_MISSES = Counter("principal_cache_misses", "Authenticated requests that had to verify the token and load the user")
+PRINCIPAL_CACHE_INVALIDATIONS = Counter("principal_cache_invalidations", "Principal cache entries dropped by invalidation")
+PRINCIPAL_CACHE_SIZE = Gauge("principal_cache_size", "Number of principals currently cached", multiprocess_mode="livesum")
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # digest -> (principal, monotonic expiry)
+        self._by_user = {}  # user id -> set of digests, for invalidation
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl_seconds > 0
+
+    @staticmethod
+    def token_digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[Principal]:
+        """Returns the cached principal for a token, or None on a miss or an expired entry."""
+        if not self.enabled:
+            return None
+        digest = self.token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(digest)
+                PRINCIPAL_CACHE_HITS.inc()
+                return entry[0]
+            if entry is not None:
+                self._remove(digest)
+        PRINCIPAL_CACHE_MISSES.inc()
+        return None
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        """Caches a verified principal until the TTL elapses or the token expires, whichever comes first."""
+        if not self.enabled:
+            return
+        lifetime = self.ttl_seconds
+        if token_exp is not None:
+            lifetime = min(lifetime, token_exp - time.time())
+        if lifetime <= 0:
+            return
+
+        digest = self.token_digest(token)
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (principal, time.monotonic() + lifetime)
+            self._by_user.setdefault(principal.id, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+            PRINCIPAL_CACHE_SIZE.set(len(self._entries))
+
+    def invalidate_user(self, user_id: int):
+        """Drops every cached token belonging to a user (call after deleting or changing the user)."""
+        with self._lock:
+            digests = self._by_user.pop(user_id, set())
+            for digest in digests:
+                self._entries.pop(digest, None)
+            PRINCIPAL_CACHE_INVALIDATIONS.inc(len(digests))
+            PRINCIPAL_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            PRINCIPAL_CACHE_INVALIDATIONS.inc(len(self._entries))
+            self._entries.clear()
+            self._by_user.clear()
+            PRINCIPAL_CACHE_SIZE.set(0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, digest: str):
+        principal, _ = self._entries.pop(digest)
+        digests = self._by_user.get(principal.id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[principal.id]
+        PRINCIPAL_CACHE_SIZE.set(len(self._entries))
+
+
+principal_cache = PrincipalCache(
+    max_size=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
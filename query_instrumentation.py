@@ -0,0 +1,115 @@
+# This file instruments every SQL statement through SQLAlchemy engine events. It includes the following key components:
+# - instrument_engine: Registers before_cursor_execute / after_cursor_execute / handle_error listeners on an engine
+#   (database.py attaches it to the sync engine and to the async engine's sync_engine).
+# - fingerprint: Normalizes a statement (placeholders, literals, IN lists and multi-row VALUES collapsed) into a
+#   bounded label such as "UPDATE accounts#1a2b3c4d", so the same query is one time series whatever its parameters.
+# - Route Attribution: Statements are labelled with the route template of the request that issued them, taken from
+#   the request context MetricsMiddleware sets; work outside a request is labelled "<background>". The middleware
+#   also records how many statements each request ran.
+# - Slow Query Log: Statements slower than SLOW_QUERY_THRESHOLD_MS (0 disables) are logged with their fingerprint,
+#   route, duration, row count and SQL text (never the parameters).
+# - Prometheus Metrics: Per-statement latency (seconds) and row-count histograms, plus statement and failure counters.
+#   Row counts are what the driver reports in cursor.rowcount, so SELECTs on drivers that report -1 are not observed.
+
+# query_instrumentation.py
+import hashlib
+import os
+import re
+import time
+from functools import lru_cache
+
+from loguru import logger
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+from metrics_middleware import current_request
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+BACKGROUND_ROUTE = "<background>"
+
+# Prometheus Metrics
+DB_QUERY_COUNT = Counter("db_query_count", "Total number of database statements executed", ["statement", "route"])
+DB_QUERY_TIME = Histogram(
+    "db_query_time_seconds", "Time taken to execute database statements", ["statement", "route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+DB_QUERY_ROWS = Histogram(
+    "db_query_rows", "Rows returned or affected per database statement", ["statement", "route"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 10000),
+)
+DB_QUERY_FAILURES = Counter("db_query_failures", "Total number of failed database statements", ["statement", "route"])
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_WHITESPACE = re.compile(r"\s+")
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN|TABLE)\s+\"?([\w.]+)", re.IGNORECASE)
+
+
+def normalize(statement: str) -> str:
+    """Strips everything that varies between executions of the same query."""
+    sql = _STRING.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?)", sql)
+    sql = _VALUES_ROWS.sub(r"\1", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Returns a short, stable label for a statement: "<VERB> <first table>#<hash of the normalized SQL>"."""
+    normalized = normalize(statement)
+    verb = normalized.split(" ", 1)[0].upper() if normalized else "?"
+    table = _TABLE.search(normalized)
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:8]
+    return f"{verb} {table.group(1) if table else '-'}#{digest}"
+
+
+def _current_route() -> str:
+    request = current_request.get()
+    if request is None:
+        return BACKGROUND_ROUTE
+    request.statements += 1
+    return request.route
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    label = fingerprint(statement)
+    route = _current_route()
+    rows = cursor.rowcount
+
+    DB_QUERY_COUNT.labels(statement=label, route=route).inc()
+    DB_QUERY_TIME.labels(statement=label, route=route).observe(elapsed)
+    if rows is not None and rows >= 0:
+        DB_QUERY_ROWS.labels(statement=label, route=route).observe(rows)
+
+    if SLOW_QUERY_THRESHOLD_MS > 0 and elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        logger.warning(
+            f"Slow query | Route: {route} | Statement: {label} | Duration: {elapsed * 1000:.1f}ms | Rows: {rows} | SQL: {_WHITESPACE.sub(' ', statement)[:1000]}"
+        )
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+    statement = exception_context.statement
+    DB_QUERY_FAILURES.labels(statement=fingerprint(statement) if statement else "-", route=_current_route()).inc()
+
+
+def instrument_engine(engine):
+    """Attaches the statement listeners to a sync Engine (pass async_engine.sync_engine for an AsyncEngine)."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
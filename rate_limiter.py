@@ -1,10 +1,79 @@
 # This file configures the rate limiter for the FastAPI application using SlowAPI.
 # It includes the following key components:
-# - Limiter: An instance of the Limiter class from SlowAPI.
-# - Key Function: Uses get_remote_address to identify clients based on their IP address.
+# - Limiter: An InstrumentedLimiter (a SlowAPI Limiter) whose counters live in RATE_LIMIT_STORAGE_URI. The default
+#   "memory://" keeps them in-process (single worker, tests); a Redis URI such as "redis://redis:6379/0" shares them
+#   across workers and pods, so "5 per minute" means 5 in total. The Redis storage checks and records each hit with a
+#   single atomic script call.
+# - Strategy: RATE_LIMIT_STRATEGY selects "moving-window" (default, exact sliding window), "sliding-window-counter"
+#   (approximate, constant memory) or "fixed-window".
+# - Failure Handling: If the shared storage becomes unreachable, limits fall back to in-memory counters per worker
+#   until it recovers instead of failing requests.
+# - Key Function: rate_limit_key limits authenticated requests per user (from a valid bearer token) and everything
+#   else per client IP address, so users behind one NAT do not share a budget and rotating IPs does not reset one.
+# - Prometheus Metrics: Limiter decision latency by outcome (allowed / blocked / error). SlowAPI has no public hook
+#   around a limit check, so InstrumentedLimiter wraps its private Limiter._check_request_limit; requirements.txt
+#   pins slowapi to the version this was written against, and tests/test_rate_limiter.py fails if the wrap stops
+#   seeing decisions after an upgrade.
 
 # rate_limiter.py
+import os
+import time
+
+import jwt
+from prometheus_client import Histogram
 from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
+from starlette.requests import Request
+
+from auth import JWT_SECRET, JWT_ALGORITHM
+
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "moving-window")
+
+# Prometheus Metrics
+RATE_LIMIT_DECISION_LATENCY = Histogram(
+    "rate_limit_decision_latency_seconds", "Time taken to check and record a rate limit hit", ["decision"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+def rate_limit_key(request: Request) -> str:
+    """Returns "user:<id>" for requests with a valid bearer token, otherwise "ip:<address>"."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            user_id = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get("id")
+        except jwt.PyJWTError:
+            user_id = None
+        if user_id is not None:
+            return f"user:{user_id}"
+    return f"ip:{get_remote_address(request)}"
+
+
+class InstrumentedLimiter(Limiter):
+    # Overrides a private SlowAPI method (pinned to slowapi==0.1.10, see requirements.txt)
+    def _check_request_limit(self, request, endpoint_func, in_middleware=True):
+        # SlowAPI records the last limit it evaluated here; passes that evaluate no limit are not decisions
+        before = getattr(request.state, "view_rate_limit", None)
+        start_time = time.perf_counter()
+        decision = "allowed"
+        try:
+            super()._check_request_limit(request, endpoint_func, in_middleware)
+        except RateLimitExceeded:
+            decision = "blocked"
+            raise
+        except Exception:
+            decision = "error"
+            raise
+        finally:
+            if decision != "allowed" or getattr(request.state, "view_rate_limit", None) is not before:
+                RATE_LIMIT_DECISION_LATENCY.labels(decision=decision).observe(time.perf_counter() - start_time)
+
 
-limiter = Limiter(key_func=get_remote_address)
+limiter = InstrumentedLimiter(
+    key_func=rate_limit_key,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    in_memory_fallback_enabled=not RATE_LIMIT_STORAGE_URI.startswith("memory://"),
+)
@@ -0,0 +1,138 @@
+# This file routes the read-only routes between the primary database and the streaming replica. It includes the following key components:
+# - ReplicaRouter: Decides per request whether a read can go to the replica (REPLICA_DATABASE_URL, see database.py).
+#   It only does so while the replica is known to be fresh enough: the replica_lag_monitor job measures its replay lag
+#   every REPLICA_LAG_CHECK_INTERVAL seconds, and reads fall back to the primary when the lag exceeds
+#   REPLICA_MAX_LAG_SECONDS, when the replica cannot be reached, or when no measurement is recent.
+# - Read-after-write Pinning: pin() sends a user's reads to the primary for REPLICA_PIN_SECONDS after a write
+#   (/transfer, /transfers/batch, /register), so the user never reads a balance older than their own transfer.
+#   Pins live in REPLICA_PIN_STORAGE_URI: "memory://" keeps them per worker, a Redis URI such as
+#   "redis://redis:6379/0" shares them, so a read landing on another worker sees the pin too. If Redis is unreachable
+#   reads go to the primary.
+# - Prometheus Metrics: Replica lag, reads routed per target and reason, and pins.
+# Without a replica configured every read uses the primary and none of this runs.
+
+# replicas.py
+import os
+import threading
+import time
+from typing import Optional
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter, Gauge
+
+from database import replica_engine, SessionLocal, ReplicaSessionLocal
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "10"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "1"))
+REPLICA_PIN_STORAGE_URI = os.getenv("REPLICA_PIN_STORAGE_URI", "memory://")
+
+# Lag on a caught-up replica is 0; otherwise the age of the last transaction it replayed
+_REPLICA_LAG_SQL = sa.text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+# Prometheus Metrics
+REPLICA_LAG = Gauge("replica_lag_seconds", "Replay lag of the read replica at the last check (-1 when unreachable)", multiprocess_mode="livemax")
+DB_READ_ROUTES = Counter("db_read_routes", "Read-only request sessions by database and reason", ["target", "reason"])
+REPLICA_PINS = Counter("replica_pins", "Users pinned to the primary after a write")
+
+
+class ReplicaRouter:
+    def __init__(self, engine=None, max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS, pin_seconds: float = REPLICA_PIN_SECONDS,
+                 check_interval: float = REPLICA_LAG_CHECK_INTERVAL, pin_storage_uri: str = REPLICA_PIN_STORAGE_URI):
+        self.engine = engine
+        self.max_lag_seconds = max_lag_seconds
+        self.pin_seconds = pin_seconds
+        self.check_interval = check_interval
+        self.lag = None  # seconds at the last check, None when unknown or unreachable
+        self._checked_at = 0.0
+        self._pins = {}  # user id -> monotonic expiry, with memory:// storage
+        self._lock = threading.Lock()
+        self._redis = None
+        if engine is not None and pin_storage_uri.startswith(("redis://", "rediss://")):
+            import redis.asyncio
+
+            self._redis = redis.asyncio.from_url(pin_storage_uri)
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    def measure_lag(self) -> float:
+        if self.engine.dialect.name != "postgresql":
+            return 0.0
+        with self.engine.connect() as conn:
+            return float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+
+    def check_lag(self):
+        """Measures the replica's lag; run by the replica_lag_monitor job."""
+        try:
+            lag = self.measure_lag()
+        except Exception as e:
+            if self.lag is not None:
+                logger.warning(f"Read replica unreachable, reading from the primary | Error: {str(e)}")
+            lag = None
+        else:
+            if lag > self.max_lag_seconds and (self.lag is None or self.lag <= self.max_lag_seconds):
+                logger.warning(f"Read replica lagging, reading from the primary | Lag: {lag:.1f}s | Max: {self.max_lag_seconds}s")
+        self.lag = lag
+        self._checked_at = time.monotonic()
+        REPLICA_LAG.set(-1 if lag is None else lag)
+
+        now = time.monotonic()
+        with self._lock:
+            self._pins = {user_id: expiry for user_id, expiry in self._pins.items() if expiry > now}
+
+    def replica_fresh(self) -> bool:
+        """True while the last lag check, taken within a few check intervals, found the replica within the bound."""
+        if not self.enabled or self.lag is None or self.lag > self.max_lag_seconds:
+            return False
+        return time.monotonic() - self._checked_at <= max(3 * self.check_interval, self.max_lag_seconds)
+
+    async def pin(self, user_id: int, seconds: Optional[float] = None):
+        """Sends the user's reads to the primary for the next `seconds` (default REPLICA_PIN_SECONDS)."""
+        if not self.enabled:
+            return
+        seconds = self.pin_seconds if seconds is None else seconds
+        REPLICA_PINS.inc()
+        if self._redis is not None:
+            try:
+                await self._redis.set(f"replica_pin:{user_id}", 1, px=max(1, int(seconds * 1000)))
+            except Exception as e:
+                logger.warning(f"Replica pin not stored | User ID: {user_id} | Error: {str(e)}")
+            return
+        with self._lock:
+            self._pins[user_id] = time.monotonic() + seconds
+
+    async def is_pinned(self, user_id: int) -> bool:
+        if self._redis is not None:
+            try:
+                return bool(await self._redis.exists(f"replica_pin:{user_id}"))
+            except Exception:
+                return True
+        with self._lock:
+            expiry = self._pins.get(user_id)
+        return expiry is not None and expiry > time.monotonic()
+
+    async def use_replica(self, user_id: int) -> bool:
+        """Whether this user's read-only request can be served by the replica."""
+        if not self.enabled:
+            return False
+        if not self.replica_fresh():
+            DB_READ_ROUTES.labels(target="primary", reason="lag").inc()
+            return False
+        if await self.is_pinned(user_id):
+            DB_READ_ROUTES.labels(target="primary", reason="pinned").inc()
+            return False
+        DB_READ_ROUTES.labels(target="replica", reason="fresh").inc()
+        return True
+
+    async def session_factory(self, user_id: int):
+        """The sync sessionmaker for a user's read, for work that opens its own session (the exports)."""
+        return ReplicaSessionLocal if await self.use_replica(user_id) else SessionLocal
+
+
+replica_router = ReplicaRouter(replica_engine)
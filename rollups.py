@@ -0,0 +1,268 @@
+# This file maintains the transaction and signup rollups. It includes the following key components:
+# - Rollup Tables: account_daily_rollups (count, credits and debits per account, day and transaction type),
+#   daily_transaction_totals (the same per day and type for the whole bank) and bank_counters (users and accounts).
+#   They are updated inside the transaction that writes the rows they count, so they are exact and a summary costs
+#   a handful of rows however large transactions grows.
+# - Slots: Every write lands on one of ROLLUP_SLOTS rows picked at random, so concurrent writers do not all queue on
+#   one hot counter row; readers sum the slots. That holds per account too: the credits to a popular account would
+#   otherwise serialize on its (account, day, type) row, the hot row that ledger mode and balance shards remove.
+# - record_transactions / record_signups: Upsert (INSERT ... ON CONFLICT DO UPDATE) the rollups for transaction rows
+#   and for new users and accounts through upsert(), which account_versions.py shares. Each call upserts every table
+#   once, in key order, so concurrent writers cannot deadlock provided each transaction records all its rows in one
+#   call; transfer_engine.record_transactions (and defer_records, for group commit) makes sure of that.
+# - account_summary / bank_summary: Read the per-account and bank-wide totals. Money is returned as exact decimal
+#   strings such as "12.50", like every other amount the API returns, and months are counted in UTC like the rows.
+# - rebuild: Recomputes every rollup from the base tables, for a database that had data before the rollups existed.
+#   Rows moved to the archive (see archive.py) are read back from its segments and counted too. If the archive
+#   watermark is set but ARCHIVE_DIR holds no segments, rebuild refuses to run rather than drop that history.
+#
+# Usage: python rollups.py rebuild
+
+# rollups.py
+import argparse
+import os
+import random
+import sys
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Union
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import archive
+from database import SessionLocal
+from partitions import utc_today
+from models import Account, AccountDailyRollup, BankCounter, DailyTransactionTotal, Transaction, User
+
+ROLLUP_SLOTS = int(os.getenv("ROLLUP_SLOTS", "16"))
+ZERO = Decimal("0.00")
+CENT = Decimal("0.01")
+
+account_rollups = AccountDailyRollup.__table__
+daily_totals = DailyTransactionTotal.__table__
+counters = BankCounter.__table__
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def upsert(db: Union[Session, Connection], table, keys: List[str], rows: List[Dict]):
+    """Inserts rows, adding every non-key value onto the existing row when the key is already there."""
+    if not rows:
+        return
+    bind = db.get_bind() if isinstance(db, Session) else db
+    stmt = _INSERTS[bind.dialect.name](table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + stmt.excluded[name] for name in rows[0] if name not in keys},
+    )
+    db.execute(stmt, sorted(rows, key=lambda row: tuple(row[k] for k in keys)))
+
+
+def record_transactions(db: Session, rows: Iterable[Dict]):
+    """Adds transaction rows (with account_id, transaction_type, amount, signed_amount and transaction_date) to the rollups."""
+    per_account = {}
+    per_day = {}
+    for row in rows:
+        amount = row["amount"]
+        credit, debit = (amount, ZERO) if row["signed_amount"] > 0 else (ZERO, amount)
+        day = row["transaction_date"].date()
+        for totals, key in ((per_account, (row["account_id"], day, row["transaction_type"])), (per_day, (day, row["transaction_type"]))):
+            count, credits, debits = totals.get(key, (0, ZERO, ZERO))
+            totals[key] = (count + 1, credits + credit, debits + debit)
+
+    slot = random.randrange(ROLLUP_SLOTS)
+    upsert(db, account_rollups, ["account_id", "day", "transaction_type", "slot"], [
+        {"account_id": account_id, "day": day, "transaction_type": transaction_type, "slot": slot, "count": count, "credits": credits, "debits": debits}
+        for (account_id, day, transaction_type), (count, credits, debits) in per_account.items()
+    ])
+    upsert(db, daily_totals, ["day", "transaction_type", "slot"], [
+        {"day": day, "transaction_type": transaction_type, "slot": slot, "count": count, "credits": credits, "debits": debits}
+        for (day, transaction_type), (count, credits, debits) in per_day.items()
+    ])
+
+
+def record_signups(db: Union[Session, Connection], users: int, accounts: int):
+    """Adds newly created users and accounts to the bank counters."""
+    slot = random.randrange(ROLLUP_SLOTS)
+    upsert(db, counters, ["name", "slot"], [
+        {"name": name, "slot": slot, "value": value} for name, value in (("accounts", accounts), ("users", users)) if value
+    ])
+
+
+def _totals(rows) -> Dict:
+    return {
+        "count": int(rows[0] or 0),
+        "credits": str(Decimal(rows[1] or 0).quantize(CENT)),
+        "debits": str(Decimal(rows[2] or 0).quantize(CENT)),
+    }
+
+
+def account_summary(db: Session, account_id: int, months: int = 12) -> Dict:
+    """Returns the account's totals per transaction type and per month over the last `months` calendar months."""
+    by_type = db.execute(
+        sa.select(
+            AccountDailyRollup.transaction_type,
+            sa.func.sum(AccountDailyRollup.count),
+            sa.func.sum(AccountDailyRollup.credits),
+            sa.func.sum(AccountDailyRollup.debits),
+        )
+        .where(AccountDailyRollup.account_id == account_id)
+        .group_by(AccountDailyRollup.transaction_type)
+        .order_by(AccountDailyRollup.transaction_type)
+    ).all()
+
+    # At most 31 rows per type and month; they are grouped by month here because date truncation differs per dialect
+    today = utc_today()
+    first_month = today.year * 12 + today.month - max(1, months)
+    since = date(first_month // 12, first_month % 12 + 1, 1)
+    monthly = {}
+    for day, count, credits, debits in db.execute(
+        sa.select(AccountDailyRollup.day, AccountDailyRollup.count, AccountDailyRollup.credits, AccountDailyRollup.debits)
+        .where(AccountDailyRollup.account_id == account_id, AccountDailyRollup.day >= since)
+    ):
+        month = day.strftime("%Y-%m")
+        total_count, total_credits, total_debits = monthly.get(month, (0, ZERO, ZERO))
+        monthly[month] = (total_count + count, total_credits + credits, total_debits + debits)
+
+    return {
+        "transaction_count": sum(int(row[1]) for row in by_type),
+        "by_type": {transaction_type: _totals(row) for transaction_type, *row in by_type},
+        "monthly": [{"month": month, **_totals(monthly[month])} for month in sorted(monthly)],
+    }
+
+
+def bank_summary(db: Session) -> Dict:
+    """Returns the bank-wide user, account and transaction totals."""
+    by_type = db.execute(
+        sa.select(
+            DailyTransactionTotal.transaction_type,
+            sa.func.sum(DailyTransactionTotal.count),
+            sa.func.sum(DailyTransactionTotal.credits),
+            sa.func.sum(DailyTransactionTotal.debits),
+        )
+        .group_by(DailyTransactionTotal.transaction_type)
+        .order_by(DailyTransactionTotal.transaction_type)
+    ).all()
+    named = dict(db.execute(sa.select(BankCounter.name, sa.func.sum(BankCounter.value)).group_by(BankCounter.name)).all())
+    return {
+        "users": int(named.get("users") or 0),
+        "accounts": int(named.get("accounts") or 0),
+        "transaction_count": sum(int(row[1]) for row in by_type),
+        "by_type": {transaction_type: _totals(row) for transaction_type, *row in by_type},
+    }
+
+
+def _is_credit(row) -> bool:
+    """The Python twin of the `incoming` expression in rebuild, for archived rows."""
+    if row.signed_amount is not None:
+        return row.signed_amount > 0
+    if row.transaction_type == "deposit":
+        return True
+    return row.transaction_type == "transfer" and (row.description or "").startswith("Transfer from")
+
+
+def rebuild(db: Session, archive_dir: Optional[str] = None):
+    """Replaces every rollup with totals recomputed from users, accounts, transactions and the archived
+    transactions. The caller commits."""
+    watermark = archive.archived_before(db)
+    if watermark is not None and not archive.has_segments(archive_dir or archive.ARCHIVE_DIR):
+        raise ValueError(
+            f"Transactions before {watermark.isoformat()} are archived, but {archive_dir or archive.ARCHIVE_DIR} "
+            "holds no segments; rebuild the rollups where ARCHIVE_DIR is available"
+        )
+
+    # Ledger postings carry their sign; in column mode only the description tells a transfer's two rows apart
+    incoming = sa.case(
+        (Transaction.signed_amount.is_not(None), Transaction.signed_amount > 0),
+        (Transaction.transaction_type == "deposit", sa.true()),
+        (Transaction.transaction_type == "transfer", Transaction.description.like("Transfer from%")),
+        else_=sa.false(),
+    )
+    day = sa.func.date(Transaction.transaction_date)
+    rows = db.execute(
+        sa.select(
+            Transaction.account_id,
+            day,
+            Transaction.transaction_type,
+            sa.func.count(),
+            sa.func.coalesce(sa.func.sum(sa.case((incoming, Transaction.amount), else_=0)), 0),
+            sa.func.coalesce(sa.func.sum(sa.case((incoming, 0), else_=Transaction.amount)), 0),
+        )
+        .group_by(Transaction.account_id, day, Transaction.transaction_type)
+    ).all()
+
+    per_account = {}
+    for account_id, row_day, transaction_type, count, credits, debits in rows:
+        if isinstance(row_day, str):
+            row_day = date.fromisoformat(row_day)
+        per_account[(account_id, row_day, transaction_type)] = (count, Decimal(credits), Decimal(debits))
+    archived = 0
+    for row in archive.iter_archived(watermark, archive_dir):
+        key = (row.account_id, row.transaction_date.date(), row.transaction_type)
+        count, credits, debits = per_account.get(key, (0, ZERO, ZERO))
+        if _is_credit(row):
+            per_account[key] = (count + 1, credits + row.amount, debits)
+        else:
+            per_account[key] = (count + 1, credits, debits + row.amount)
+        archived += 1
+
+    per_day = {}
+    account_rows = []
+    for (account_id, row_day, transaction_type), (count, credits, debits) in per_account.items():
+        account_rows.append({
+            "account_id": account_id, "day": row_day, "transaction_type": transaction_type, "slot": 0,
+            "count": count, "credits": credits, "debits": debits,
+        })
+        total_count, total_credits, total_debits = per_day.get((row_day, transaction_type), (0, ZERO, ZERO))
+        per_day[(row_day, transaction_type)] = (total_count + count, total_credits + credits, total_debits + debits)
+
+    db.execute(account_rollups.delete())
+    db.execute(daily_totals.delete())
+    db.execute(counters.delete())
+    upsert(db, account_rollups, ["account_id", "day", "transaction_type", "slot"], account_rows)
+    upsert(db, daily_totals, ["day", "transaction_type", "slot"], [
+        {"day": row_day, "transaction_type": transaction_type, "slot": 0, "count": count, "credits": credits, "debits": debits}
+        for (row_day, transaction_type), (count, credits, debits) in per_day.items()
+    ])
+    users = db.execute(sa.select(sa.func.count(User.id))).scalar_one()
+    accounts = db.execute(sa.select(sa.func.count(Account.id))).scalar_one()
+    upsert(db, counters, ["name", "slot"], [
+        {"name": name, "slot": 0, "value": value} for name, value in (("accounts", accounts), ("users", users))
+    ])
+    logger.info(
+        f"Rollups rebuilt | Account days: {len(account_rows)} | Archived transactions: {archived} | "
+        f"Users: {users} | Accounts: {accounts}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the transaction and signup rollups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="recompute every rollup from the base tables")
+    parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            # Block writers for the duration, so no write lands between the scan and the new rollups
+            db.execute(sa.text("LOCK TABLE users, accounts, transactions IN SHARE MODE"))
+        rebuild(db)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        logger.error(f"Rollups not rebuilt | Error: {str(e)}")
+        return 1
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,37 +2,34 @@
 
 # Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, JWT, bcrypt, Prometheus metrics, and logging.
 # Router: An instance of APIRouter to define the routes.
-# Logging: Configured using loguru to log information and errors to a JSON file.
+# Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
 # Prometheus Metrics: Counters and histograms to track login attempts, failed logins, successful logins, and login latency.
 # JWT Token Generation: A function create_access_token to generate JWT tokens for authenticated users.
-# Background Task: A function simulate_random_transaction to simulate random transactions for a user upon login.
-# Login Route: A POST route /login that authenticates users, generates JWT tokens, logs login attempts, and adds a background task to simulate a random transaction.
+# Login Route: A POST route /login that authenticates users, generates JWT tokens, logs login attempts, and queues a random transaction
+# for the user on the bounded, batched transaction_simulator worker (dropped, and counted, when that queue is full).
+# Password checks run on the password_hasher process pool; hashes made with an outdated work factor are upgraded on login.
 # The file integrates rate limiting, logging, and metrics to provide a robust authentication mechanism for the application.
 
-import bcrypt
 import jwt
 import os
-import random
 import time
 from datetime import datetime, timedelta
-from decimal import Decimal
 from loguru import logger
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from models import User, Account, Transaction
+from models import User
 from auth import get_db
 from prometheus_client import Counter, Histogram
 
-from database import SessionLocal, track_query
+from database import run_db
+from password_hasher import hash_password, verify_password, needs_rehash
 from rate_limiter import limiter
+import transaction_simulator
 
 router = APIRouter()
-# Configure logging
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
-
 # Prometheus Metrics
 LOGIN_ATTEMPTS = Counter("login_attempts", "Total login attempts")
 FAILED_LOGINS = Counter("failed_logins", "Total failed login attempts")
@@ -52,66 +49,45 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=1
     return token
 
 
-def simulate_random_transaction(user_id: int):
-    start_time = time.time()
-    db_session = SessionLocal()
-    try:
-        account = db_session.query(Account).filter(Account.user_id == user_id).first()
-        if not account:
-            return
-
-        transaction_type = random.choice(["deposit", "withdrawal"])
-        amount = Decimal(str(round(random.uniform(10, 100), 2)))
-
-        if transaction_type == "withdrawal" and account.balance < amount:
-            transaction_type = "deposit"
-
-        if transaction_type == "deposit":
-            account.balance += amount
-        else:
-            account.balance -= amount
-
-        txn = Transaction(
-            account_id=account.id,
-            transaction_type=transaction_type,
-            amount=amount,
-            description=f"Random {transaction_type} on login"
-        )
-
-        db_session.add(txn)
-        db_session.commit()
-        track_query(start_time)
-        logger.info(f"[BG TASK] Simulated {transaction_type} of {amount} for user {user_id}")
-    except Exception as e:
-        logger.error(f"[BG TASK ERROR] {e}")
-        db_session.rollback()
-    finally:
-        db_session.close()
+def _load_user(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+
+def _update_password_hash(db: Session, user_id: int, password_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash}, synchronize_session=False)
+    db.commit()
 
 
 @router.post("/login")
 @limiter.limit("5/minute") 
-def login(request: Request, background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Authenticates the user, generates a token, and adds a random transaction."""
     LOGIN_ATTEMPTS.inc()
     start_time = time.time()
 
     logger.info(f"Login attempt | Username: {form_data.username} | IP: {request.client.host}")
 
-    user = db.query(User).filter(User.username == form_data.username).first()
-    track_query(start_time)
+    user = await run_db(db, _load_user, form_data.username)
     
-    if not user or not bcrypt.checkpw(form_data.password.encode("utf-8"), user.password_hash.encode("utf-8")):
+    if not user or not await verify_password(form_data.password, user.password_hash):
         FAILED_LOGINS.inc()
         logger.warning(f"Failed login attempt | Username: {form_data.username} | Reason: Invalid credentials")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
+    # Upgrade hashes made with an old work factor while we still hold the plaintext
+    if needs_rehash(user.password_hash):
+        try:
+            await run_db(db, _update_password_hash, user.id, await hash_password(form_data.password))
+            logger.info(f"Password rehashed with current work factor | Username: {user.username}")
+        except Exception as e:
+            logger.error(f"Password rehash failed | Username: {user.username} | Error: {str(e)}")
+
     SUCCESSFUL_LOGINS.inc()
     token = create_access_token(data={"sub": user.username, "id": user.id})
     LOGIN_LATENCY.observe(time.time() - start_time)
 
     logger.info(f"Successful login | Username: {user.username}")
 
-    background_tasks.add_task(simulate_random_transaction, user.id)
-    
+    transaction_simulator.enqueue(user.id)
+
     return {"access_token": token, "token_type": "bearer"}
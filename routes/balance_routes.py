@@ -1,36 +1,64 @@
 # This file defines the balance routes for the FastAPI application. It includes the following key components:
 # - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, logging, and authentication dependencies.
 # - Router: An instance of APIRouter to define the routes.
-# - Logging: Configured using loguru to log information and errors to a JSON file.
+# - Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
 # - Balance Route: A GET route /balance that retrieves the balance for the authenticated user's account.
-# The route logs the request, checks the user's account, tracks query execution time, and returns the account balance.
+# The route logs the request, checks the user's account, and returns the account balance.
+# The route is async; its query runs through run_db so it works with both the sync and async database paths.
+# In ledger mode (BALANCE_MODE=ledger) the balance is the account's latest snapshot plus the postings after it;
+# a sharded account's balance is its accounts row plus its balance shards.
+# The balance is read as a Core row and returned as an exact decimal string ("1000.00") through FastJSONResponse.
+# The response carries an ETag built from the account's version (see account_versions.py); a request whose
+# If-None-Match still matches gets an empty 304 after that one version query, without computing the balance.
+# With a read replica configured the query runs there unless the replica lags or the user just wrote (see replicas.py).
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-import time
+from typing import Annotated, Optional
 from loguru import logger
 
-from auth import get_current_user, get_db
+from auth import get_current_user, get_read_db
 from models import Account
-from database import track_query
+from database import run_db
+import account_versions
+from fast_json import FastJSONResponse
+from ledger import ledger_enabled, user_balance
+from balance_shards import total_balance
 
 router = APIRouter()
 
-# Configure logging
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
+def _load_balance(db: Session, user_id: int, if_none_match: Optional[str] = None):
+    """Returns (etag, balance); etag is None without an account, balance is None when if_none_match is still current."""
+    version = account_versions.current_version(db, user_id)
+    if version is None:
+        return None, None
+    etag = account_versions.etag("balance", *version)
+    if account_versions.etag_matches(if_none_match, etag):
+        return etag, None
+    if ledger_enabled():
+        return etag, user_balance(db, user_id)
+    account = db.execute(select(Account.id, Account.balance, Account.shard_count).where(Account.id == version[0])).first()
+    return etag, total_balance(db, account) if account.shard_count else account.balance
 
 @router.get("/balance")
-def get_balance(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    start_time = time.time()
+async def get_balance(
+    current_user=Depends(get_current_user),
+    db=Depends(get_read_db),
+    if_none_match: Annotated[Optional[str], Header()] = None
+):
     logger.info(f"Balance check request | User ID: {current_user.id}")
 
-    account = db.query(Account).filter(Account.user_id == current_user.id).first()
-    track_query(start_time)
+    etag, balance = await run_db(db, _load_balance, current_user.id, if_none_match)
 
-    if not account:
+    if etag is None:
         logger.warning(f"Balance check failed | User ID: {current_user.id} | Reason: Account not found")
         raise HTTPException(status_code=404, detail="Account not found")
 
-    logger.info(f"Balance retrieved | User ID: {current_user.id} | Balance: {account.balance}")
+    if balance is None:
+        logger.info(f"Balance not modified | User ID: {current_user.id}")
+        return account_versions.not_modified("/balance", etag)
 
-    return {"balance": float(account.balance)}
+    logger.info(f"Balance retrieved | User ID: {current_user.id} | Balance: {balance}")
+
+    return FastJSONResponse({"balance": str(balance)}, headers={"ETag": etag, "Cache-Control": account_versions.CACHE_CONTROL})
@@ -0,0 +1,132 @@
+# This file defines the account event stream for the FastAPI application. It includes the following key components:
+# - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, logging, and authentication helpers.
+# - Router: An instance of APIRouter to define the routes.
+# - Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
+# - Ticket Route: A POST route /events/ticket that trades the bearer token for a single-use stream ticket valid for
+#   EVENTS_TICKET_SECONDS (see account_events.StreamTickets). EventSource cannot send an Authorization header, and a
+#   token in the URL would be written to every access log; a ticket in a log is already spent.
+# - Events Route: A GET route /events?ticket= that streams the ticket owner's balance and new transactions as
+#   Server-Sent Events, so the frontends no longer refetch /balance and /transactions after every transfer.
+#   The stream ends when the access token the ticket came from expires. A used ticket is refused, so clients
+#   reconnect with a new ticket rather than through the browser's automatic retry.
+#   The stream opens with a "balance" event. Each time the account's transactions commit (see account_events.py) it
+#   sends a "transactions" event with the new rows, newest first and in the /transactions item format, followed by a
+#   "balance" event. A comment line every EVENTS_KEEPALIVE_SECONDS keeps proxies from closing an idle stream.
+# An open stream holds no database connection: every update is read on the primary (a replica may not have the
+# commit yet) with a session closed straight after. An update whose account version has not moved (see
+# account_versions.py) costs one query: the account by user_id, joined to its version slots.
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from collections import deque
+import asyncio
+import os
+import time
+import orjson
+from loguru import logger
+from prometheus_client import Counter
+
+from auth import get_current_user, oauth2_scheme, verify_token
+from models import Transaction
+from database import SessionLocal
+from routes.balance_routes import _load_balance
+from routes.transactions_routes import TRANSACTION_COLUMNS, _transaction_json
+import account_events
+import account_versions
+
+router = APIRouter()
+
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+# Newest rows checked per update; ids already sent are skipped, so rows that commit slightly out of id order still
+# go out once
+EVENTS_MAX_TRANSACTIONS = int(os.getenv("EVENTS_MAX_TRANSACTIONS", "20"))
+
+# Prometheus Metrics
+EVENTS_SENT = Counter("account_events_sent", "Server-Sent Events written to /events streams", ["event"])
+
+
+def _load_update(user_id: int, account_id=None, etag=None):
+    """Returns (account id, etag, balance, newest rows) from the primary; balance and rows are None while etag is
+    current, and everything is None when the user has no account. account_id is looked up when not given."""
+    with SessionLocal() as db:
+        if account_id is None:
+            version = account_versions.current_version(db, user_id)
+            if version is None:
+                return None, None, None, None
+            account_id = version[0]
+        etag, balance = _load_balance(db, user_id, etag)
+        if balance is None:
+            return account_id, etag, None, None
+        rows = db.execute(
+            select(*TRANSACTION_COLUMNS).where(Transaction.account_id == account_id)
+            .order_by(Transaction.id.desc()).limit(EVENTS_MAX_TRANSACTIONS)
+        ).all()
+        return account_id, etag, balance, rows
+
+
+def _event(name: str, data) -> bytes:
+    EVENTS_SENT.labels(event=name).inc()
+    return b"event: " + name.encode("ascii") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def _stream(user_id: int, account_id: int, etag, balance, rows, expires_at):
+    # Rows that existed when the stream opened are what the client just loaded from /transactions
+    sent = deque((row.id for row in rows), maxlen=4 * EVENTS_MAX_TRANSACTIONS)
+    try:
+        with account_events.hub.subscribe(account_id) as changed:
+            # A change that committed between the first read and the subscription is picked up by one extra read
+            changed.set()
+            yield _event("balance", {"balance": str(balance)})
+            while expires_at is None or time.time() < expires_at:
+                timeout = EVENTS_KEEPALIVE_SECONDS
+                if expires_at is not None:
+                    timeout = max(0.0, min(timeout, expires_at - time.time()))
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                changed.clear()
+
+                _, etag, balance, rows = await run_in_threadpool(_load_update, user_id, account_id, etag)
+                if balance is None:
+                    continue
+                new = [row for row in rows if row.id not in sent]
+                if new:
+                    sent.extend(row.id for row in reversed(new))
+                    yield _event("transactions", {"transactions": [_transaction_json(row) for row in new]})
+                yield _event("balance", {"balance": str(balance)})
+    finally:
+        logger.info(f"Event stream closed | User ID: {user_id}")
+
+
+@router.post("/events/ticket")
+async def issue_events_ticket(token: str = Depends(oauth2_scheme), current_user=Depends(get_current_user)):
+    expires_at = verify_token(token).get("exp")
+    ticket = await account_events.tickets.issue(current_user.id, expires_at)
+    logger.info(f"Event stream ticket issued | User ID: {current_user.id}")
+    return {"ticket": ticket, "expires_in": account_events.tickets.ttl_seconds}
+
+
+@router.get("/events")
+async def stream_account_events(ticket: str):
+    redeemed = await account_events.tickets.redeem(ticket)
+    if redeemed is None:
+        logger.warning("Event stream refused | Reason: Invalid or expired ticket")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired ticket")
+    user_id, expires_at = redeemed
+    logger.info(f"Event stream opened | User ID: {user_id}")
+
+    account_id, etag, balance, rows = await run_in_threadpool(_load_update, user_id)
+    if account_id is None:
+        logger.warning(f"Event stream failed | User ID: {user_id} | Reason: Account not found")
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    return StreamingResponse(
+        _stream(user_id, account_id, etag, balance, rows, expires_at),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx-style proxies from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
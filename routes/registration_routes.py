@@ -1,39 +1,81 @@
 # This file defines the registration routes for the FastAPI application. It includes the following key components:
 # - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, bcrypt, logging, and authentication dependencies.
 # - Router: An instance of APIRouter to define the routes.
-# - Logging: Configured using loguru to log information and errors to a JSON file.
+# - Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
 # - Registration Route: A POST route /register that handles user registration.
-# The route logs the request, checks if the username or email is already registered, hashes the password, creates a new user and account, updates the user count metric, and returns a success message.
+# The route logs the request, checks if the username or email is already registered, hashes the password, creates a new user and account, increments the user count metric, and returns a success message.
+# Password hashing runs on the password_hasher process pool so signups do not hold request threads.
+# The user and the account are written in one transaction (flush assigns the user id), so a signup is one commit.
+# The same transaction adds them to the signup counters (see rollups.py) and starts the account's version (see
+# account_versions.py). The new user's reads are then pinned to the
+# primary for a while (see replicas.py), so the first dashboard load finds the account even if the replica lags.
 
 from fastapi import APIRouter, Depends, HTTPException, status, Form, Request
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-import bcrypt
-import time
 from loguru import logger
 
 from rate_limiter import limiter
 from models import User, Account
 from auth import get_db
-from database import track_query, update_user_count
+from database import run_db, USER_COUNT
+from password_hasher import hash_password
+from replicas import replica_router
+import account_versions
+import rollups
 
 router = APIRouter()
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
+
+
+def _find_existing_user(db: Session, username: str, email: str):
+    return db.query(User).filter((User.username == username) | (User.email == email)).first()
+
+
+def _create_user(db: Session, username: str, email: str, hashed_password: str) -> int:
+    # Create new user; flush sends the INSERT and fills in the generated id without committing
+    new_user = User(username=username, email=email, password_hash=hashed_password)
+    db.add(new_user)
+    try:
+        db.flush()
+
+        # Create an initial account with a default balance
+        account = Account(user_id=new_user.id, balance=1000.00)
+        db.add(account)
+        db.flush()
+        account_versions.bump(db, [account.id])
+        rollups.record_signups(db, users=1, accounts=1)
+        db.commit()
+    except IntegrityError:
+        # Another signup took the username or email between our check and the insert
+        db.rollback()
+        logger.warning(f"Registration failed (Username or email already exists) | Username: {username} | Email: {email}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already exists"
+        )
+
+    logger.info(f"User registered successfully | User ID: {new_user.id} | Username: {username}")
+    logger.info(f"Account created for user | User ID: {new_user.id} | Initial Balance: 1000.00")
+
+    # Update user count metric (the reconciler corrects any drift)
+    USER_COUNT.inc()
+
+    return new_user.id
+
 
 @router.post("/register")
 @limiter.limit("5 per minute")
-def register(
+async def register(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    start_time = time.time()
     logger.info(f"User registration request | Username: {username} | Email: {email}")
 
     # Check if the username or email is already registered
-    existing_user = db.query(User).filter((User.username == username) | (User.email == email)).first()
-    track_query(start_time)
+    existing_user = await run_db(db, _find_existing_user, username, email)
 
     if existing_user:
         logger.warning(f"Registration failed (Username or email already exists) | Username: {username} | Email: {email}")
@@ -42,27 +84,10 @@ def register(
             detail="Username or email already exists"
         )
 
-    # Hash the password securely using bcrypt
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
-    # Create new user
-    new_user = User(username=username, email=email, password_hash=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    track_query(start_time)
-
-    logger.info(f"User registered successfully | User ID: {new_user.id} | Username: {username}")
-
-    # Create an initial account with a default balance
-    new_account = Account(user_id=new_user.id, balance=1000.00)
-    db.add(new_account)
-    db.commit()
-    track_query(start_time)
-
-    logger.info(f"Account created for user | User ID: {new_user.id} | Initial Balance: 1000.00")
+    # Hash the password securely using bcrypt, off the event loop on the hashing pool
+    hashed_password = await hash_password(password)
 
-    # Update user count metric
-    update_user_count(db)
+    user_id = await run_db(db, _create_user, username, email, hashed_password)
+    await replica_router.pin(user_id)
 
-    return {"message": "Registration successful", "user_id": new_user.id}
+    return {"message": "Registration successful", "user_id": user_id}
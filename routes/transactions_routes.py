@@ -1,58 +1,293 @@
 # This file defines the transaction routes for the FastAPI application. It includes the following key components:
 # - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, logging, and authentication dependencies.
 # - Router: An instance of APIRouter to define the routes.
-# - Logging: Configured using loguru to log information and errors to a JSON file.
+# - Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
+# - Cursor Helpers: Encode/decode the opaque keyset cursor used to page through history on (transaction_date, id).
 # - Transactions Route: A GET route /transactions that retrieves the transactions for the authenticated user's account.
-# The route logs the request, checks the user's account, tracks query execution time, and returns the transactions.
+# The route logs the request, checks the user's account, and returns the transactions.
+# Pages are fetched with a keyset seek when a cursor is supplied, so every page costs the same regardless of depth;
+# the legacy page/limit offset paging is kept for older clients. limit is clamped to 1-100 rather than rejected, so
+# older clients asking for bigger pages get 100 rows and a next_cursor. The route is async and runs its queries through
+# run_db, so it works with both the sync and async database paths.
+# Pages select only the five returned columns as Core rows (no ORM objects) and are written by FastJSONResponse (see
+# fast_json.py) without a jsonable_encoder pass; amounts are exact decimal strings such as "12.50".
+# Every page carries an ETag built from the account's version and the page's parameters (see account_versions.py); a
+# request whose If-None-Match still matches gets an empty 304 without running the history query.
+# On a partitioned transactions table (see partitions.py) the cursor's upper bound on transaction_date prunes the
+# monthly partitions newer than the cursor, and the newest-first LIMIT stops before reaching older ones.
+# Once a page runs past the live rows it continues into the cold-history archive (see archive.py), whose rows are all
+# older than any live row, so pages, cursors and exports cover the full history.
+# - Export Route: A GET route /transactions/export that streams the account's full history as NDJSON or CSV from a
+#   server-side cursor, so memory stays flat and the first bytes go out before the query finishes.
+# - Summary Route: A GET route /transactions/summary that returns the account's transaction count, totals per type and
+#   money in/out per month from the rollup tables (see rollups.py), so its cost does not grow with the history.
+# All three routes only read, so with a read replica configured they run there unless the replica lags or the user
+# just wrote (see replicas.py).
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.orm import Session
-import time
+from datetime import datetime
+from typing import Annotated, Optional
+import base64
+import csv
+import io
+import itertools
+import json
+import os
 from loguru import logger
 
-from auth import get_current_user, get_db
+from auth import get_current_user, get_read_db
+from replicas import replica_router
 from models import Account, Transaction
-from database import track_query
+from database import SessionLocal, run_db
+from fast_json import FastJSONResponse
+import account_versions
+import archive
+import rollups
 
 router = APIRouter()
 
-# Configure logging
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
+# Rows fetched per server-side cursor round trip (and per chunk written to the client) during exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_COLUMNS = ("id", "transaction_type", "amount", "transaction_date", "description")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# The columns /transactions and the exports return, in EXPORT_COLUMNS order
+TRANSACTION_COLUMNS = (
+    Transaction.id,
+    Transaction.transaction_type,
+    Transaction.amount,
+    Transaction.transaction_date,
+    Transaction.description,
+)
+
+
+def encode_cursor(transaction_date: datetime, transaction_id) -> str:
+    """Encodes the (transaction_date, id) position of a row into an opaque, URL-safe cursor."""
+    raw = json.dumps({"d": transaction_date.isoformat(), "i": transaction_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Decodes a cursor produced by encode_cursor back into (transaction_date, id)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(data["d"]), data["i"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def seek_before(transaction_date: datetime, transaction_id):
+    """Keyset predicate for rows that sort after the cursor position in (transaction_date DESC, id DESC) order."""
+    # The redundant upper bound on transaction_date gives the planner an index range to seek on.
+    return and_(
+        Transaction.transaction_date <= transaction_date,
+        or_(
+            Transaction.transaction_date < transaction_date,
+            and_(Transaction.transaction_date == transaction_date, Transaction.id < transaction_id),
+        ),
+    )
+
+
+def _load_account(db: Session, user_id: int):
+    return db.query(Account).filter(Account.user_id == user_id).first()
+
+
+def _load_page(db: Session, user_id: int, position, page: int, limit: int, if_none_match: Optional[str] = None):
+    """Loads the page's ETag and one page of history (plus one look-ahead row) in a single DB hop.
+
+    Returns (etag, rows); etag is None without an account, rows is None when if_none_match is still current.
+    """
+    version = account_versions.current_version(db, user_id)
+    if version is None:
+        return None, None
+    etag = account_versions.etag("transactions", *version, position or page, limit)
+    if account_versions.etag_matches(if_none_match, etag):
+        return etag, None
+    account_id = version[0]
+
+    # Walks idx_transactions_account_date backwards; id breaks ties between rows sharing a timestamp.
+    stmt = select(*TRANSACTION_COLUMNS).where(Transaction.account_id == account_id)
+    if position:
+        stmt = stmt.where(seek_before(*position))
+    stmt = stmt.order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+    if not position:
+        stmt = stmt.offset((page - 1) * limit)
+
+    # One extra row tells us whether there is a next page without a separate COUNT.
+    txns = db.execute(stmt.limit(limit + 1)).all()
+    if len(txns) > limit or not archive.has_segments():
+        return etag, txns
+
+    # The page reaches past the live rows; the archive holds only older rows, so it continues from its newest one
+    skip = 0
+    if not position:
+        offset = (page - 1) * limit
+        live = offset + len(txns) if txns else db.execute(
+            select(func.count(Transaction.id)).where(Transaction.account_id == account_id)
+        ).scalar()
+        skip = max(0, offset - live)
+    archived = archive.iter_account(account_id, archive.archived_before(db), position)
+    return etag, txns + list(itertools.islice(archived, skip, skip + limit + 1 - len(txns)))
+
+
+def _transaction_json(row) -> dict:
+    """One /transactions item, ready for FastJSONResponse (the date is left for orjson to write)."""
+    return {
+        "id": row.id,
+        "transaction_type": row.transaction_type,
+        "amount": str(row.amount),
+        "transaction_date": row.transaction_date,
+        "description": row.description,
+    }
+
 
 @router.get("/transactions")
-def get_transactions(page: int = 1, limit: int = 10, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    start_time = time.time()
+async def get_transactions(
+    page: int = 1,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    current_user=Depends(get_current_user),
+    db=Depends(get_read_db),
+    if_none_match: Annotated[Optional[str], Header()] = None
+):
+    logger.info(f"Fetching transactions | User: {current_user.username} | Page: {page} | Limit: {limit} | Cursor: {cursor}")
 
-    logger.info(f"Fetching transactions | User: {current_user.username} | Page: {page} | Limit: {limit}")
+    limit = min(max(limit, 1), 100)
 
-    offset = (page - 1) * limit
-    account = db.query(Account).filter(Account.user_id == current_user.id).first()
-    track_query(start_time)
+    position = decode_cursor(cursor) if cursor else None
+    etag, txns = await run_db(db, _load_page, current_user.id, position, page, limit, if_none_match)
 
-    if not account:
+    if etag is None:
         logger.warning(f"Transactions fetch failed (Account not found) | User: {current_user.username}")
         raise HTTPException(status_code=404, detail="Account not found")
 
-    txns = (
-        db.query(Transaction)
-        .filter(Transaction.account_id == account.id)
-        .order_by(Transaction.transaction_date.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+    if txns is None:
+        logger.info(f"Transactions not modified | User: {current_user.username}")
+        return account_versions.not_modified("/transactions", etag)
+
+    has_more = len(txns) > limit
+    txns = txns[:limit]
 
-    transactions = [
-        {
-            "id": txn.id,
-            "transaction_type": txn.transaction_type,
-            "amount": float(txn.amount),
-            "transaction_date": txn.transaction_date,
-            "description": txn.description,
-        }
-        for txn in txns
-    ]
+    transactions = [_transaction_json(txn) for txn in txns]
 
     logger.info(f"Transactions retrieved | User: {current_user.username} | Transactions: {len(transactions)}")
 
-    return {"transactions": transactions}
+    next_cursor = None
+    if has_more:
+        last = txns[-1]
+        next_cursor = encode_cursor(last.transaction_date, last.id)
+
+    return FastJSONResponse(
+        {"transactions": transactions, "next_cursor": next_cursor},
+        headers={"ETag": etag, "Cache-Control": account_versions.CACHE_CONTROL},
+    )
+
+
+def _format_ndjson(rows):
+    return "".join(
+        json.dumps({
+            "id": row.id,
+            "transaction_type": row.transaction_type,
+            "amount": str(row.amount),
+            "transaction_date": row.transaction_date.isoformat() if row.transaction_date else None,
+            "description": row.description,
+        }) + "\n"
+        for row in rows
+    )
+
+
+def _format_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row.id,
+            row.transaction_type,
+            str(row.amount),
+            row.transaction_date.isoformat() if row.transaction_date else "",
+            row.description or "",
+        ])
+    return buffer.getvalue()
+
+
+def stream_transactions(account_id: int, export_format: str, session_factory=SessionLocal):
+    """Yields the account's history newest-first in chunks of EXPORT_BATCH_SIZE rows from a server-side cursor."""
+    db_session = session_factory()
+    exported = 0
+    try:
+        if export_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        stmt = (
+            select(*TRANSACTION_COLUMNS)
+            .where(Transaction.account_id == account_id)
+            .order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        formatter = _format_csv if export_format == "csv" else _format_ndjson
+        for rows in db_session.execute(stmt).partitions():
+            exported += len(rows)
+            yield formatter(rows)
+
+        if archive.has_segments():
+            archived = archive.iter_account(account_id, archive.archived_before(db_session))
+            while rows := list(itertools.islice(archived, EXPORT_BATCH_SIZE)):
+                exported += len(rows)
+                yield formatter(rows)
+
+        logger.info(f"Transactions export finished | Account ID: {account_id} | Format: {export_format} | Rows: {exported}")
+    except Exception as e:
+        logger.error(f"Transactions export failed | Account ID: {account_id} | Rows sent: {exported} | Error: {str(e)}")
+        raise
+    finally:
+        db_session.close()
+
+
+@router.get("/transactions/export")
+async def export_transactions(format: str = "ndjson", current_user=Depends(get_current_user), db=Depends(get_read_db)):
+    logger.info(f"Exporting transactions | User: {current_user.username} | Format: {format}")
+
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+
+    account = await run_db(db, _load_account, current_user.id)
+
+    if not account:
+        logger.warning(f"Transactions export failed (Account not found) | User: {current_user.username}")
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    # The stream owns its own session so it outlives this request's dependency-scoped one.
+    return StreamingResponse(
+        stream_transactions(account.id, format, await replica_router.session_factory(current_user.id)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="transactions-{account.id}.{format}"'},
+    )
+
+def _load_summary(db: Session, user_id: int, months: int):
+    account = _load_account(db, user_id)
+    if not account:
+        return None
+    return rollups.account_summary(db, account.id, months)
+
+
+@router.get("/transactions/summary")
+async def get_transactions_summary(months: int = 12, current_user=Depends(get_current_user), db=Depends(get_read_db)):
+    logger.info(f"Fetching transactions summary | User: {current_user.username} | Months: {months}")
+
+    if months < 1 or months > 120:
+        raise HTTPException(status_code=400, detail="Months must be between 1 and 120")
+
+    summary = await run_db(db, _load_summary, current_user.id, months)
+
+    if summary is None:
+        logger.warning(f"Transactions summary failed (Account not found) | User: {current_user.username}")
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    logger.info(f"Transactions summary retrieved | User: {current_user.username} | Transactions: {summary['transaction_count']}")
+    return summary
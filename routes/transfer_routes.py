@@ -2,20 +2,34 @@
 # - Imports: Necessary libraries and modules, including FastAPI, SQLAlchemy, logging, and authentication dependencies.
 # - Router: An instance of APIRouter to define the routes.
 # - Prometheus Metrics: Counters and histograms to track money transferred, failed transfer attempts, and transfer latency.
-# - Logging: Configured using loguru to log information and errors to a JSON file.
+# - Logging: Uses the shared loguru logger; the JSON log sink is configured once in logging_config.py.
 # - Transfer Route: A POST route /transfer that handles money transfers between user accounts.
-# The route logs the request, validates the transfer details, updates account balances, creates transaction records, tracks query execution time, updates Prometheus metrics, and returns a success message.
+# The route logs the request, validates the transfer details, updates account balances, creates transaction records, updates Prometheus metrics, and returns a success message.
+# The route is async; the transfer itself runs through run_db so it works with both the sync and async database paths.
+# Balances are moved by transfer_engine with conditional in-database updates taken in account id order, so concurrent
+# transfers neither lose updates nor deadlock; in ledger mode (BALANCE_MODE=ledger) they only insert postings.
+# With TRANSFER_COMMIT_MODE=group, /transfer hands the transfer to the group_commit writer, which commits many
+# transfers in one transaction; the validation and error messages are the same.
+# - Batch Transfer Route: A POST route /transfers/batch that applies many transfers from one sender in a single
+#   transaction (one auth, one rate-limit hit, one commit) and reports the outcome of each item.
+# After a transfer commits, the sender's reads are pinned to the primary for a while (see replicas.py), so the next
+# /balance or /transactions poll already shows it even when the read replica lags.
 
 from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from decimal import Decimal
+from typing import List
+import os
 import time
 from loguru import logger
 
 from rate_limiter import limiter
-from auth import get_current_user, get_db
-from models import Account, Transaction, User
-from database import track_query
+from auth import get_current_user, get_async_db
+from database import run_db
+from replicas import replica_router
+import group_commit
+import transfer_engine
 from prometheus_client import Counter, Histogram
 
 router = APIRouter()
@@ -24,95 +38,141 @@ router = APIRouter()
 MONEY_TRANSFERRED = Counter("money_transferred", "Total amount of money transferred")
 TRANSFER_FAILURES = Counter("transfer_failures", "Total failed transfer attempts")
 TRANSFER_LATENCY = Histogram("transfer_latency_seconds", "Time taken for a transfer transaction")
+BATCH_TRANSFER_SIZE = Histogram("batch_transfer_size", "Number of transfers submitted per batch", buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+BATCH_TRANSFER_LATENCY = Histogram("batch_transfer_latency_seconds", "Time taken for a batch transfer transaction")
 
-logger.add("logs.json", format="{time} {level} {message}", level="INFO", rotation="1 week", serialize=True)
+# Upper bound on items per /transfers/batch call, so one request cannot hold the sender's lock indefinitely
+MAX_BATCH_TRANSFERS = int(os.getenv("MAX_BATCH_TRANSFERS", "1000"))
+
+
+class TransferItem(BaseModel):
+    recipient_username: str
+    amount: Decimal
+
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[TransferItem]
 
 
 @router.post("/transfer")
 @limiter.limit("5 per minute")
-def transfer_funds(
+async def transfer_funds(
     request: Request,
     recipient_username: str,
     amount: float,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db=Depends(get_async_db)
 ):
     start_time = time.time()  # Start tracking transaction latency
 
     logger.info(f"Transfer initiated | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount}")
 
-    if amount <= 0:
+    amount = Decimal(str(amount))
+
+    if not transfer_engine.valid_amount(amount):
         TRANSFER_FAILURES.inc()
         logger.warning(f"Transfer failed (Invalid amount) | Sender: {current_user.username} | Amount: {amount}")
         raise HTTPException(status_code=400, detail="Invalid amount")
 
-    amount = Decimal(str(amount))
-
-    sender_account = db.query(Account).filter(Account.user_id == current_user.id).first()
-    if not sender_account:
+    try:
+        if group_commit.group_commit_enabled():
+            await group_commit.transfer(current_user.id, current_user.username, recipient_username, amount)
+        else:
+            await run_db(db, _execute_transfer, current_user.id, current_user.username, recipient_username, amount)
+    except HTTPException as e:
         TRANSFER_FAILURES.inc()
-        logger.error(f"Transfer failed (Sender account not found) | Sender: {current_user.username}")
-        raise HTTPException(status_code=404, detail="Sender account not found")
-
-    if sender_account.balance < amount:
+        logger.warning(f"Transfer failed ({e.detail}) | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount}")
+        raise
+    except Exception as e:
         TRANSFER_FAILURES.inc()
-        logger.warning(f"Transfer failed (Insufficient funds) | Sender: {current_user.username} | Balance: {sender_account.balance} | Amount: {amount}")
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+        logger.error(f"Transfer failed due to server error | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount} | Error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Transfer failed due to server error")
 
-    recipient_user = db.query(User).filter(User.username == recipient_username).first()
-    if not recipient_user:
-        TRANSFER_FAILURES.inc()
-        logger.error(f"Transfer failed (Recipient not found) | Sender: {current_user.username} | Recipient: {recipient_username}")
-        raise HTTPException(status_code=404, detail="Recipient not found")
-    
-    recipient_account = db.query(Account).filter(Account.user_id == recipient_user.id).first()
-    if not recipient_account:
-        TRANSFER_FAILURES.inc()
-        logger.error(f"Transfer failed (Recipient account not found) | Sender: {current_user.username} | Recipient: {recipient_username}")
-        raise HTTPException(status_code=404, detail="Recipient account not found")
-    
-    if recipient_username == current_user.username:
-        TRANSFER_FAILURES.inc()
-        logger.warning(f"Transfer failed (Self-transfer) | Sender: {current_user.username}")
-        raise HTTPException(status_code=400, detail="You cannot transfer money to yourself.")
+    await replica_router.pin(current_user.id)
+
+    # Update Prometheus metrics
+    MONEY_TRANSFERRED.inc(float(amount))
+    TRANSFER_LATENCY.observe(time.time() - start_time)
+
+    logger.info(f"Transfer successful | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount}")
 
+    return {"message": "Transfer successful"}
+
+
+def _execute_transfer(db: Session, sender_user_id: int, sender_username: str, recipient_username: str, amount: Decimal):
+    """Runs the transfer and commits it; any failure rolls back the partial balance updates."""
     try:
-        # Deduct from sender and add to recipient
-        sender_account.balance = Decimal(str(sender_account.balance)) - amount
-        recipient_account.balance = Decimal(str(recipient_account.balance)) + amount
-
-        # Create transaction records
-        txn_out = Transaction(
-            account_id=sender_account.id,
-            transaction_type="transfer",
-            amount=amount,
-            description=f"Transfer to {recipient_username}"
-        )
-        txn_in = Transaction(
-            account_id=recipient_account.id,
-            transaction_type="transfer",
-            amount=amount,
-            description=f"Transfer from {current_user.username}"
-        )
-        db.add(txn_out)
-        db.add(txn_in)
+        result = transfer_engine.transfer(db, sender_user_id, sender_username, recipient_username, amount)
         db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
 
-        # Track query execution time
-        track_query(start_time)
 
-        # Update Prometheus metrics
-        MONEY_TRANSFERRED.inc(float(amount))
-        TRANSFER_LATENCY.observe(time.time() - start_time)
+@router.post("/transfers/batch")
+@limiter.limit("5 per minute")
+async def batch_transfer_funds(
+    request: Request,
+    batch: BatchTransferRequest,
+    current_user=Depends(get_current_user),
+    db=Depends(get_async_db)
+):
+    start_time = time.time()
 
-        logger.info(f"Transfer successful | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount}")
+    logger.info(f"Batch transfer initiated | Sender: {current_user.username} | Transfers: {len(batch.transfers)}")
 
-        return {"message": "Transfer successful"}
+    if not batch.transfers or len(batch.transfers) > MAX_BATCH_TRANSFERS:
+        logger.warning(f"Batch transfer rejected (Invalid batch size) | Sender: {current_user.username} | Transfers: {len(batch.transfers)}")
+        raise HTTPException(status_code=400, detail=f"A batch must contain between 1 and {MAX_BATCH_TRANSFERS} transfers")
 
-    except Exception as e:
-        TRANSFER_FAILURES.inc()
-        db.rollback()
+    items = [(item.recipient_username, item.amount) for item in batch.transfers]
+    BATCH_TRANSFER_SIZE.observe(len(items))
 
-        logger.error(f"Transfer failed due to server error | Sender: {current_user.username} | Recipient: {recipient_username} | Amount: {amount} | Error: {str(e)}")
-        
+    try:
+        results = await run_db(db, _execute_batch, current_user.id, current_user.username, items)
+    except HTTPException as e:
+        TRANSFER_FAILURES.inc(len(items))
+        logger.warning(f"Batch transfer failed ({e.detail}) | Sender: {current_user.username} | Transfers: {len(items)}")
+        raise
+    except Exception as e:
+        TRANSFER_FAILURES.inc(len(items))
+        logger.error(f"Batch transfer failed due to server error | Sender: {current_user.username} | Transfers: {len(items)} | Error: {str(e)}")
         raise HTTPException(status_code=500, detail="Transfer failed due to server error")
+
+    succeeded = [r for r in results if r.status == "success"]
+    failed = len(results) - len(succeeded)
+    if succeeded:
+        await replica_router.pin(current_user.id)
+        MONEY_TRANSFERRED.inc(float(sum(r.amount for r in succeeded)))
+    if failed:
+        TRANSFER_FAILURES.inc(failed)
+    BATCH_TRANSFER_LATENCY.observe(time.time() - start_time)
+
+    logger.info(f"Batch transfer finished | Sender: {current_user.username} | Succeeded: {len(succeeded)} | Failed: {failed}")
+
+    return {
+        "results": [
+            {
+                "index": r.index,
+                "recipient_username": r.recipient_username,
+                "amount": str(r.amount),
+                "status": r.status,
+                "detail": r.detail,
+            }
+            for r in results
+        ],
+        "succeeded": len(succeeded),
+        "failed": failed,
+    }
+
+
+def _execute_batch(db: Session, sender_user_id: int, sender_username: str, items):
+    """Runs the batch and commits it in one transaction."""
+    try:
+        results = transfer_engine.transfer_batch(db, sender_user_id, sender_username, items)
+        db.commit()
+        return results
+    except Exception:
+        db.rollback()
+        raise
@@ -16,23 +16,102 @@ CREATE TABLE accounts (
     user_id INTEGER NOT NULL,
     balance NUMERIC(15, 2) DEFAULT 0.00,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    shard_count INTEGER, -- Set for hot accounts whose money is spread over account_balance_shards
     CONSTRAINT fk_user FOREIGN KEY(user_id)
         REFERENCES users(id)
         ON DELETE CASCADE
 );
 
--- Table to record transactions.
+-- Sub-balances of sharded hot accounts; the account's balance is accounts.balance plus the sum of its shards.
+CREATE TABLE account_balance_shards (
+    account_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    balance NUMERIC(15, 2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (account_id, shard),
+    CONSTRAINT fk_shard_account FOREIGN KEY(account_id)
+        REFERENCES accounts(id)
+        ON DELETE CASCADE
+);
+
+-- Table to record transactions, range partitioned by month on transaction_date.
 CREATE TABLE transactions (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(), -- Random UUID for uniqueness
+    id UUID DEFAULT uuid_generate_v4(), -- Random UUID for uniqueness
     account_id INTEGER NOT NULL,
     transaction_type VARCHAR(20) NOT NULL CHECK (transaction_type IN ('deposit', 'withdrawal', 'transfer')),
     amount NUMERIC(15, 2) NOT NULL CHECK (amount > 0),
-    transaction_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    transaction_date TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     description TEXT,
+    signed_amount NUMERIC(15, 2), -- Ledger mode postings: +amount into the account, -amount out of it
+    PRIMARY KEY (id, transaction_date), -- A partitioned table's keys must include the partition key
     CONSTRAINT fk_account FOREIGN KEY(account_id)
         REFERENCES accounts(id)
         ON DELETE CASCADE
-);
+) PARTITION BY RANGE (transaction_date);
+
+-- One partition per month; partitions.py creates them ahead of time and detaches expired ones, e.g.:
+-- CREATE TABLE transactions_y2026m01 PARTITION OF transactions FOR VALUES FROM ('2026-01-01') TO ('2026-02-01');
+
+-- Rows outside every monthly partition (a backfill, a month not created in time); partitions.py alerts while it has rows.
+CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
 
 -- Create an index to optimize lookups for transactions by account and date.
 CREATE INDEX idx_transactions_account_date ON transactions(account_id, transaction_date);
+
+-- BRIN index on the append-only date column, used by the ledger snapshotter to find recent postings.
+CREATE INDEX idx_transactions_date ON transactions USING brin (transaction_date);
+
+-- Ledger mode: compacted balance per account, covering every posting dated up to through_date.
+CREATE TABLE balance_snapshots (
+    account_id INTEGER PRIMARY KEY,
+    balance NUMERIC(15, 2) NOT NULL,
+    through_date TIMESTAMP NOT NULL,
+    taken_at TIMESTAMP,
+    CONSTRAINT fk_snapshot_account FOREIGN KEY(account_id)
+        REFERENCES accounts(id)
+        ON DELETE CASCADE
+);
+
+-- Bumped by every write to an account's balance or history; /balance and /transactions build their ETags from it.
+CREATE TABLE account_versions (
+    account_id INTEGER NOT NULL,
+    slot INTEGER NOT NULL DEFAULT 0, -- Writers bump a random slot; the version is the sum of the slots
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, slot),
+    CONSTRAINT fk_version_account FOREIGN KEY(account_id)
+        REFERENCES accounts(id)
+        ON DELETE CASCADE
+);
+
+-- Rollups maintained in the same transaction as every transactions/users write (see rollups.py).
+CREATE TABLE account_daily_rollups (
+    account_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    slot INTEGER NOT NULL DEFAULT 0, -- Writers add to a random slot; readers sum the slots
+    count INTEGER NOT NULL DEFAULT 0,
+    credits NUMERIC(15, 2) NOT NULL DEFAULT 0.00, -- Money into the account
+    debits NUMERIC(15, 2) NOT NULL DEFAULT 0.00, -- Money out of the account
+    PRIMARY KEY (account_id, day, transaction_type, slot),
+    CONSTRAINT fk_rollup_account FOREIGN KEY(account_id)
+        REFERENCES accounts(id)
+        ON DELETE CASCADE
+);
+
+-- Bank-wide totals per day and type; writers pick a random slot so they do not queue on one row.
+CREATE TABLE daily_transaction_totals (
+    day DATE NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    slot INTEGER NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    credits NUMERIC(20, 2) NOT NULL DEFAULT 0.00,
+    debits NUMERIC(20, 2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (day, transaction_type, slot)
+);
+
+-- Slotted signup counters ('users', 'accounts'); a total is the sum over its slots.
+CREATE TABLE bank_counters (
+    name VARCHAR(40) NOT NULL,
+    slot INTEGER NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, slot)
+);
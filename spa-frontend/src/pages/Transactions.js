@@ -19,6 +19,32 @@ import {
 } from '@mui/material';
 // import { useNavigate } from 'react-router-dom';
 
+// GETs an API URL with the ETag of the copy kept in sessionStorage; on 304 Not Modified the server did no work and
+// the kept copy is returned.
+async function fetchCached(url, token, errorMessage) {
+  const cached = JSON.parse(sessionStorage.getItem(`etag:${url}`) || 'null');
+  const headers = {
+    'Authorization': `Bearer ${token}`,
+    'Content-Type': 'application/json'
+  };
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
+  const response = await fetch(url, { method: 'GET', headers });
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+  if (!response.ok) {
+    throw new Error(errorMessage);
+  }
+  const data = await response.json();
+  const etag = response.headers.get('ETag');
+  if (etag) {
+    sessionStorage.setItem(`etag:${url}`, JSON.stringify({ etag, data }));
+  }
+  return data;
+}
+
 function TransactionsPage() {
   const [transactions, setTransactions] = useState([]);
   const [balance, setBalance] = useState(null);
@@ -29,6 +55,8 @@ function TransactionsPage() {
   const [transferRecipient, setTransferRecipient] = useState('');
   const [transferAmount, setTransferAmount] = useState('');
   const [transferLoading, setTransferLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [moreLoading, setMoreLoading] = useState(false);
 
   useEffect(() => {
     const token = localStorage.getItem('access_token');
@@ -40,21 +68,10 @@ function TransactionsPage() {
     }
 
     // Fetch transactions
-    fetch('http://localhost:8000/transactions?page=1&limit=10', {
-      method: 'GET',
-      headers: {
-        'Authorization': `Bearer ${token}`,
-        'Content-Type': 'application/json'
-      }
-    })
-      .then((response) => {
-        if (!response.ok) {
-          throw new Error('Failed to fetch transactions');
-        }
-        return response.json();
-      })
+    fetchCached('http://localhost:8000/transactions?limit=10', token, 'Failed to fetch transactions')
       .then((data) => {
         setTransactions(data.transactions || []);
+        setNextCursor(data.next_cursor || null);
         setLoading(false);
       })
       .catch((err) => {
@@ -63,19 +80,7 @@ function TransactionsPage() {
       });
 
     // Fetch balance
-    fetch('http://localhost:8000/balance', {
-      method: 'GET',
-      headers: {
-        'Authorization': `Bearer ${token}`,
-        'Content-Type': 'application/json'
-      }
-    })
-      .then((response) => {
-        if (!response.ok) {
-          throw new Error('Failed to fetch balance');
-        }
-        return response.json();
-      })
+    fetchCached('http://localhost:8000/balance', token, 'Failed to fetch balance')
       .then((data) => {
         setBalance(data.balance);
         setBalanceLoading(false);
@@ -86,9 +91,94 @@ function TransactionsPage() {
       });
   }, []);
 
+  // The server pushes the balance and new transactions over /events after every committed change; new rows go on
+  // top of the list, so the cursor for "Load more" stays valid. Each (re)connect trades the access token for a
+  // single-use ticket, so the token never appears in a URL.
+  useEffect(() => {
+    const token = localStorage.getItem('access_token');
+    if (!token) {
+      return undefined;
+    }
+    const addNewest = (pushed) => {
+      setTransactions((prev) => {
+        const known = new Set(prev.map((txn) => txn.id));
+        return pushed.filter((txn) => !known.has(txn.id)).concat(prev);
+      });
+    };
+    let events = null;
+    let retry = null;
+    let closed = false;
+    let subscribed = false;
+
+    const subscribe = async () => {
+      const response = await fetch('http://localhost:8000/events/ticket', {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      if (!response.ok) {
+        return;
+      }
+      const { ticket } = await response.json();
+      if (closed) {
+        return;
+      }
+      events = new EventSource(`http://localhost:8000/events?ticket=${encodeURIComponent(ticket)}`);
+      events.addEventListener('open', () => {
+        // After a reconnect, catch up on anything committed while the stream was down
+        if (subscribed) {
+          fetchCached('http://localhost:8000/transactions?limit=10', token, 'Failed to fetch transactions')
+            .then((data) => addNewest(data.transactions || []))
+            .catch(() => {});
+        }
+        subscribed = true;
+      });
+      events.addEventListener('balance', (event) => {
+        setBalance(JSON.parse(event.data).balance);
+      });
+      events.addEventListener('transactions', (event) => {
+        addNewest(JSON.parse(event.data).transactions);
+      });
+      events.addEventListener('error', () => {
+        // The browser would retry with the spent ticket; reconnect with a new one instead
+        events.close();
+        retry = setTimeout(() => subscribe().catch(() => {}), 3000);
+      });
+    };
+
+    subscribe().catch(() => {});
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (events) {
+        events.close();
+      }
+    };
+  }, []);
+
   if (loading || balanceLoading) return <p>Loading...</p>;
   if (error) return <p style={{ color: 'red' }}>{error}</p>;
 
+  // Fetch the next page by seeking from the last cursor the API handed back
+  const handleLoadMore = () => {
+    const token = localStorage.getItem('access_token');
+    if (!token || !nextCursor) {
+      return;
+    }
+
+    setMoreLoading(true);
+    fetchCached(`http://localhost:8000/transactions?limit=10&cursor=${encodeURIComponent(nextCursor)}`, token, 'Failed to fetch transactions')
+      .then((data) => {
+        setTransactions((prev) => prev.concat(data.transactions || []));
+        setNextCursor(data.next_cursor || null);
+      })
+      .catch((err) => {
+        setError(err.message);
+      })
+      .finally(() => {
+        setMoreLoading(false);
+      });
+  };
+
   // Handlers for opening/closing the transfer dialog
   const handleOpenTransferDialog = () => {
     setTransferDialogOpen(true);
@@ -133,7 +223,6 @@ function TransactionsPage() {
 
         if (response.ok) {
             alert('Transfer successful!');
-            window.location.reload();
         } else {
             alert(data.detail || data.message || 'Transfer Failed');
         }
@@ -266,6 +355,14 @@ function TransactionsPage() {
           No transactions found.
         </Typography>
       )}
+
+      {nextCursor && (
+        <Box sx={{ marginTop: 2 }}>
+          <Button variant="outlined" onClick={handleLoadMore} disabled={moreLoading}>
+            {moreLoading ? <CircularProgress size={24} /> : 'Load more'}
+          </Button>
+        </Box>
+      )}
     </Box>
   );
 }
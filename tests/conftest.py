@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Account, User
+
+
+@pytest.fixture
+def make_bank():
+    """Returns make_bank(accounts, account_ids=None): a new in-memory SQLite bank with one user per {username: balance}
+    entry, ids from 1 in order, each with an account holding that balance (None: no account). An account's id is its
+    user's id unless account_ids ({username: account id}) says otherwise. The sessionmaker it returns carries .engine
+    and .statements, the SQL run after the seed."""
+    engines = []
+
+    def make(accounts, account_ids=None):
+        engine = sa.create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        engines.append(engine)
+        Base.metadata.create_all(bind=engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            users = list(enumerate(accounts.items(), start=1))
+            db.add_all([User(id=i, username=name, email=f"{name}@example.com", password_hash="x") for i, (name, _) in users])
+            db.add_all([
+                Account(id=(account_ids or {}).get(name, i), user_id=i, balance=Decimal(balance))
+                for i, (name, balance) in users if balance is not None
+            ])
+            db.commit()
+        factory.engine = engine
+        factory.statements = []
+        sa.event.listen(engine, "before_cursor_execute", lambda conn, cursor, stmt, *args: factory.statements.append(stmt))
+        return factory
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def bank_accounts():
+    """The users and balances `bank` seeds; a test module overrides this fixture to seed others."""
+    return {"alice": "100.00", "bob": "50.00"}
+
+
+@pytest.fixture
+def bank(make_bank, bank_accounts):
+    """A sessionmaker for a bank seeded with bank_accounts (see make_bank)."""
+    return make_bank(bank_accounts)
+
+
+@pytest.fixture
+def db(bank):
+    """A session on `bank`; db.statements is the SQL run after the seed."""
+    session = bank()
+    session.statements = bank.statements
+    yield session
+    session.close()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import account_events
+import transfer_engine
+from routes import events_routes
+
+
+@pytest.fixture
+def bank(bank, monkeypatch):
+    """alice (user 1, account 1) with 100.00 and bob (user 2, account 2) with 50.00, and a hub of our own."""
+    monkeypatch.setattr(account_events, "hub", account_events.AccountEventHub())
+    monkeypatch.setattr(events_routes, "SessionLocal", bank)
+    return bank
+
+
+def transfer(factory, sender_id, sender, recipient, amount, commit=True):
+    with factory() as db:
+        transfer_engine.transfer(db, sender_id, sender, recipient, Decimal(amount))
+        db.commit() if commit else db.rollback()
+
+
+def test_only_committed_changes_reach_subscribers(bank):
+    async def run():
+        account_events.hub.start()
+        try:
+            with account_events.hub.subscribe(1) as alice, account_events.hub.subscribe(2) as bob:
+                await run_in_threadpool(transfer, bank, 1, "alice", "bob", "10.00", False)
+                await asyncio.sleep(0.05)
+                assert not alice.is_set() and not bob.is_set()
+
+                await run_in_threadpool(transfer, bank, 2, "bob", "alice", "5.00")
+                await asyncio.wait_for(alice.wait(), 1)
+                await asyncio.wait_for(bob.wait(), 1)
+            assert account_events.hub._subscribers == {}
+        finally:
+            await account_events.hub.stop()
+
+    asyncio.run(run())
+
+
+def test_stream_pushes_new_transactions_and_balance(bank):
+    def parse(chunk):
+        lines = chunk.decode().strip().split("\n")
+        return lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))
+
+    async def run():
+        account_events.hub.start()
+        try:
+            account_id, etag, balance, rows = await run_in_threadpool(events_routes._load_update, 1)
+            stream = events_routes._stream(1, account_id, etag, balance, rows, None)
+            assert parse(await stream.__anext__()) == ("balance", {"balance": "100.00"})
+
+            await run_in_threadpool(transfer, bank, 2, "bob", "alice", "5.00")
+            await run_in_threadpool(transfer, bank, 1, "alice", "bob", "20.00")
+            name, data = parse(await asyncio.wait_for(stream.__anext__(), 1))
+            # The opening re-check may already see the first transfer; either way each row goes out once, newest first
+            pushed = data["transactions"]
+            if len(pushed) == 1:
+                assert parse(await stream.__anext__()) == ("balance", {"balance": "105.00"})
+                name, data = parse(await asyncio.wait_for(stream.__anext__(), 1))
+                pushed = data["transactions"] + pushed
+            assert name == "transactions"
+            assert [(t["amount"], t["description"]) for t in pushed] == [("20.00", "Transfer to bob"), ("5.00", "Transfer from bob")]
+            assert parse(await stream.__anext__()) == ("balance", {"balance": "85.00"})
+            await stream.aclose()
+        finally:
+            await account_events.hub.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_backend_falls_back_to_local_subscribers():
+    backend = account_events.RedisBackend("redis://127.0.0.1:1/0")
+    notified = []
+    asyncio.run(backend.publish([3, 4], notified.extend))
+    assert notified == [3, 4]
+
+
+def test_stream_tickets_are_single_use_and_expire(bank, monkeypatch):
+    async def run():
+        tickets = account_events.StreamTickets(ttl_seconds=30)
+        ticket = await tickets.issue(1, 1234.0)
+        assert await tickets.redeem(ticket) == (1, 1234.0)
+        assert await tickets.redeem(ticket) is None
+
+        expired = account_events.StreamTickets(ttl_seconds=0)
+        assert await expired.redeem(await expired.issue(1, None)) is None
+
+        # A spent ticket cannot open a second stream
+        monkeypatch.setattr(account_events, "tickets", tickets)
+        with pytest.raises(HTTPException) as excinfo:
+            await events_routes.stream_account_events(ticket)
+        assert excinfo.value.status_code == 401
+
+    asyncio.run(run())
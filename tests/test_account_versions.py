@@ -0,0 +1,90 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import account_versions
+import transfer_engine
+from models import AccountVersion
+from principal_cache import Principal
+from routes.balance_routes import get_balance
+from routes.registration_routes import _create_user
+from routes.transactions_routes import get_transactions
+from transaction_simulator import simulate_batch
+
+ALICE = Principal(id=1, username="alice", email="alice@example.com")
+
+
+def versions(db):
+    return {user_id: account_versions.current_version(db, user_id)[1] for user_id in (1, 2)}
+
+
+def test_every_writer_bumps_the_accounts_it_touches(db):
+    assert versions(db) == {1: 0, 2: 0}
+
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("10.00"))
+    db.commit()
+    assert versions(db) == {1: 1, 2: 1}
+
+    transfer_engine.transfer_batch(db, 2, "bob", [("alice", Decimal("1.00")), ("alice", Decimal("2.00"))])
+    simulate_batch(db, [2])
+    db.commit()
+    assert versions(db) == {1: 2, 2: 3}
+
+    user_id = _create_user(db, "carol", "carol@example.com", "x")
+    assert account_versions.current_version(db, user_id)[1] == 1
+
+
+def test_versions_are_spread_over_slots(db, monkeypatch):
+    slots = iter([3, 3, 7, 7])
+    monkeypatch.setattr(account_versions.random, "randrange", lambda n: next(slots))
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("1.00"))
+    db.commit()
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("2.00"))
+    db.commit()
+
+    # Two credits to bob bumped two different rows, and the version is their sum
+    assert sorted(r.slot for r in db.query(AccountVersion).filter(AccountVersion.account_id == 2)) == [3, 7]
+    assert versions(db) == {1: 2, 2: 2}
+
+
+def test_balance_answers_a_current_etag_with_304_after_one_query(db):
+    first = asyncio.run(get_balance(ALICE, db))
+    etag = first.headers["etag"]
+    assert json.loads(first.body) == {"balance": "100.00"}
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    db.statements.clear()
+    cached = asyncio.run(get_balance(ALICE, db, etag))
+    assert (cached.status_code, cached.body, cached.headers["etag"]) == (304, b"", etag)
+    assert len(db.statements) == 1
+
+    transfer_engine.transfer(db, 2, "bob", "alice", Decimal("5.00"))
+    db.commit()
+    changed = asyncio.run(get_balance(ALICE, db, etag))
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert json.loads(changed.body) == {"balance": "105.00"}
+
+
+def test_transactions_etags_are_per_page(db):
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("10.00"))
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("20.00"))
+    db.commit()
+
+    first = asyncio.run(get_transactions(1, 1, None, ALICE, db))
+    second = asyncio.run(get_transactions(2, 1, None, ALICE, db))
+    assert first.headers["etag"] != second.headers["etag"]
+
+    db.statements.clear()
+    # Weak comparison and lists of ETags, as browsers send them
+    cached = asyncio.run(get_transactions(1, 1, None, ALICE, db, f'"other", W/{first.headers["etag"]}'))
+    assert cached.status_code == 304
+    assert len(db.statements) == 1
+    assert asyncio.run(get_transactions(1, 1, None, ALICE, db, second.headers["etag"])).status_code == 200
+
+
+def test_etag_matching():
+    etag = account_versions.etag("balance", 1, 7)
+    assert etag == '"balance-1-7"'
+    assert account_versions.etag_matches("*", etag)
+    assert not account_versions.etag_matches(None, etag)
+    assert not account_versions.etag_matches('"balance-1-6"', etag)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+
+import archive
+from archive import ArchivedTransaction, Segment, write_segment
+from models import BalanceSnapshot, Transaction
+from principal_cache import Principal
+from routes.transactions_routes import get_transactions, stream_transactions
+
+ALICE = Principal(id=1, username="alice", email="alice@example.com")
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    directory = str(tmp_path / "archive")
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", directory)
+    monkeypatch.setattr(archive, "ARCHIVE_ROW_GROUP_SIZE", 4)
+    monkeypatch.setattr(archive, "ARCHIVE_ACCOUNTS_PER_SEGMENT", 2)
+    return directory
+
+
+@pytest.fixture
+def session_factory(make_bank):
+    """alice (account 1) with 30 transactions over September to November 2025, bob (account 2) with one in September."""
+    factory = make_bank({"alice": "100.00", "bob": "100.00"})
+    with factory() as db:
+        db.execute(sa.insert(Transaction), [
+            {
+                "account_id": 1, "transaction_type": "deposit", "amount": Decimal(f"{i}.25"),
+                # Pairs of rows share a timestamp, so the id tie-break matters
+                "transaction_date": datetime(2025, 9 + i // 10, 1 + (i % 10) // 2 * 5, 12), "description": f"row {i}",
+            }
+            for i in range(30)
+        ] + [{"account_id": 2, "transaction_type": "withdrawal", "amount": Decimal("5.00"), "transaction_date": datetime(2025, 9, 3)}])
+        db.commit()
+    return factory
+
+
+def history(factory):
+    with factory() as db:
+        rows = db.query(Transaction).filter_by(account_id=1).order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+        return [(t.id, t.transaction_date, t.amount, t.description) for t in rows]
+
+
+def walk_cursor_pages(db, limit):
+    seen, cursor = [], None
+    while True:
+        page = json.loads(asyncio.run(get_transactions(1, limit, cursor, ALICE, db)).body)
+        seen += [(t["id"], datetime.fromisoformat(t["transaction_date"]), Decimal(t["amount"]), t["description"]) for t in page["transactions"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+def test_segment_round_trip(tmp_path):
+    rows = [
+        ArchivedTransaction(i, 1 + i % 3, "transfer", Decimal("1.05") * i, datetime(2025, 9, 1 + i, 8, 30, 0, 123456),
+                            None if i == 4 else f"Transfer {i}", Decimal("-1.05") * i if i % 2 else None)
+        for i in range(1, 11)
+    ]
+    path = str(tmp_path / "2025-09" / "accounts-0000000000.seg")
+    write_segment(path, datetime(2025, 9, 1).date(), rows, row_group_size=3)
+
+    segment = Segment(path)
+    assert segment.rows == 10 and len(segment.row_groups) == 4
+    assert segment.account_rows(2) == sorted((r for r in rows if r.account_id == 2), key=lambda r: r.transaction_date, reverse=True)
+    assert segment.account_rows(9) == []
+    assert segment.oldest(1) == datetime(2025, 9, 4, 8, 30, 0, 123456)
+    segment.close()
+
+
+def test_archiving_moves_whole_old_months(session_factory, archive_dir):
+    with session_factory() as db:
+        assert archive.archive_old_transactions(db, datetime(2025, 11, 15)) == 21
+
+    with session_factory() as db:
+        assert db.query(Transaction).count() == 10
+        assert archive.archived_before(db) == datetime(2025, 11, 1)
+    # Accounts 1 and 2 share a segment per month
+    assert archive.account_segments(1) == [f"{archive_dir}/2025-10/accounts-0000000000.seg", f"{archive_dir}/2025-09/accounts-0000000000.seg"]
+    assert [r.amount for r in archive.iter_account(2, datetime(2025, 11, 1))] == [Decimal("5.00")]
+
+
+def test_open_segments_are_bounded_and_closed_when_evicted(session_factory, archive_dir, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_OPEN_SEGMENTS", 1)
+    monkeypatch.setattr(archive, "_segments", OrderedDict())
+    with session_factory() as db:
+        archive.archive_old_transactions(db, datetime(2025, 12, 1))
+    october, september = archive.account_segments(1)[1:]
+
+    with archive.open_segment(october) as pinned:
+        # Evicted while a reader is inside it: still mapped until the reader leaves
+        with archive.open_segment(september) as newest:
+            assert list(archive._segments) == [september]
+            assert len(pinned.account_rows(1)) == 10 and not pinned._map.closed
+    assert pinned._map.closed and not newest._map.closed
+
+    # A full walk through the archive keeps one segment open
+    assert len(list(archive.iter_account(1, datetime(2025, 12, 1)))) == 30
+    assert len(archive._segments) == 1
+
+
+def test_pages_and_exports_continue_into_the_archive(session_factory, archive_dir):
+    before = history(session_factory)
+    with session_factory() as db:
+        archive.archive_old_transactions(db, datetime(2025, 12, 1))
+        assert db.query(Transaction).count() == 0
+        db.add(Transaction(account_id=1, transaction_type="deposit", amount=Decimal("9.99"), transaction_date=datetime(2025, 12, 2)))
+        db.commit()
+    before = history(session_factory) + before
+
+    with session_factory() as db:
+        assert walk_cursor_pages(db, 7) == before
+        # Offset pages: the first holds the one live row then archived ones
+        offset_pages = [json.loads(asyncio.run(get_transactions(page, 7, None, ALICE, db)).body)["transactions"] for page in range(1, 6)]
+        assert [t["id"] for page in offset_pages for t in page] == [row[0] for row in before]
+
+    exported = [json.loads(line) for chunk in stream_transactions(1, "ndjson", session_factory) for line in chunk.splitlines()]
+    assert [row["id"] for row in exported] == [row[0] for row in before]
+    assert exported[-1]["amount"] == "0.25"
+
+
+def test_unfinished_runs_are_not_visible_twice(session_factory, archive_dir):
+    with session_factory() as db:
+        # Files written, but the transaction never committed
+        archive.archive_month(db, datetime(2025, 9, 1).date())
+        db.rollback()
+    with session_factory() as db:
+        assert archive.archived_before(db) is None
+        assert len(walk_cursor_pages(db, 10)) == 30
+
+        assert archive.archive_old_transactions(db, datetime(2025, 10, 1)) == 11
+        assert len(walk_cursor_pages(db, 10)) == 30
+        # The rewritten segment merged the leftover file without repeating its rows
+        with archive.open_segment(archive.account_segments(1)[0]) as segment:
+            assert len(segment.all_rows()) == 10
+
+
+def test_months_with_unsnapshotted_postings_stay(session_factory, archive_dir):
+    with session_factory() as db:
+        db.execute(sa.update(Transaction).where(Transaction.account_id == 2).values(signed_amount=Decimal("-5.00")))
+        db.commit()
+        assert archive.archive_old_transactions(db, datetime(2025, 12, 1)) == 0
+
+        db.add(BalanceSnapshot(account_id=2, balance=Decimal("95.00"), through_date=datetime(2025, 9, 30)))
+        db.commit()
+        assert archive.archive_old_transactions(db, datetime(2025, 12, 1)) == 31
@@ -0,0 +1,41 @@
+import threading
+
+from background_jobs import PeriodicJob
+
+
+def test_job_runs_immediately_and_repeats():
+    ran = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        if len(calls) >= 2:
+            ran.set()
+
+    job = PeriodicJob("test_repeat", 0.01, work).start()
+    try:
+        assert ran.wait(2)
+    finally:
+        job.stop()
+
+
+def test_failures_do_not_stop_the_schedule():
+    ran = threading.Event()
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        ran.set()
+
+    job = PeriodicJob("test_flaky", 0.01, flaky).start()
+    try:
+        assert ran.wait(2)
+    finally:
+        job.stop()
+
+
+def test_non_positive_interval_disables_the_job():
+    job = PeriodicJob("test_disabled", 0, lambda: None).start()
+    assert job._thread is None
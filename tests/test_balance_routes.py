@@ -1,4 +1,7 @@
+import asyncio
+import json
 import pytest
+from decimal import Decimal
 from fastapi import HTTPException
 from unittest.mock import MagicMock
 from routes.balance_routes import get_balance
@@ -10,21 +13,22 @@ def test_get_balance_success():
     current_user = MagicMock()
     current_user.id = 1
     account = MagicMock()
-    account.balance = 100.0
+    account.balance = Decimal("100.00")
+    account.shard_count = None
 
-    db.query().filter().first.return_value = account
+    db.execute.return_value.first.return_value = account
 
-    response = get_balance(current_user, db)
-    assert response == {"balance": 100.0}
+    response = asyncio.run(get_balance(current_user, db))
+    assert json.loads(response.body) == {"balance": "100.00"}
 
 def test_get_balance_account_not_found():
     db = MagicMock()
     current_user = MagicMock()
     current_user.id = 1
 
-    db.query().filter().first.return_value = None
+    db.execute.return_value.first.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        get_balance(current_user, db)
+        asyncio.run(get_balance(current_user, db))
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Account not found"
\ No newline at end of file
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+from fastapi import HTTPException
+
+import balance_shards
+import transfer_engine
+from models import Account, AccountBalanceShard
+from principal_cache import Principal
+from routes.balance_routes import get_balance
+
+
+@pytest.fixture
+def bank_accounts():
+    return {"payer": "100.00", "merchant": "40.00"}
+
+
+@pytest.fixture
+def db(db):
+    """payer (user 1, account 1) with 100.00 and merchant (user 2, account 2) with 40.00, sharded 4 ways."""
+    balance_shards.configure_sharding(db, 2, 4)
+    db.commit()
+    return db
+
+
+def shard_balances(db, account_id=2):
+    db.expire_all()
+    return {s.shard: s.balance for s in db.query(AccountBalanceShard).filter_by(account_id=account_id).order_by(AccountBalanceShard.shard)}
+
+
+def total(db, account_id=2):
+    db.expire_all()
+    return balance_shards.total_balance(db, db.get(Account, account_id))
+
+
+def test_configure_sharding_spreads_and_restores_the_balance(db):
+    assert shard_balances(db) == {0: Decimal("10.00"), 1: Decimal("10.00"), 2: Decimal("10.00"), 3: Decimal("10.00")}
+    assert db.get(Account, 2).balance == Decimal("0.00")
+
+    balance_shards.configure_sharding(db, 2, None)
+    db.commit()
+    db.expire_all()
+    account = db.get(Account, 2)
+    assert (account.balance, account.shard_count) == (Decimal("40.00"), None)
+    assert shard_balances(db) == {}
+
+
+def test_even_split_hands_out_leftover_cents():
+    assert balance_shards.even_split(Decimal("10.01"), 3) == {0: Decimal("3.34"), 1: Decimal("3.34"), 2: Decimal("3.33")}
+
+
+def test_credit_updates_one_shard_not_the_account_row(db):
+    db.statements.clear()
+    transfer_engine.transfer(db, 1, "payer", "merchant", Decimal("5.00"))
+    db.commit()
+
+    updates = [s for s in db.statements if s.startswith("UPDATE")]
+    assert len(updates) == 2
+    assert "account_balance_shards" in updates[1]
+    assert sorted(shard_balances(db).values()) == [Decimal("10.00")] * 3 + [Decimal("15.00")]
+    assert total(db) == Decimal("45.00")
+    merchant = Principal(id=2, username="merchant", email="merchant@example.com")
+    assert json.loads(asyncio.run(get_balance(merchant, db)).body) == {"balance": "45.00"}
+
+
+def test_debit_spreads_across_shards_when_no_shard_covers_it(db):
+    transfer_engine.transfer(db, 2, "merchant", "payer", Decimal("8.00"))
+    db.commit()
+    assert total(db) == Decimal("32.00")
+
+    transfer_engine.transfer(db, 2, "merchant", "payer", Decimal("25.00"))
+    db.commit()
+    assert total(db) == Decimal("7.00")
+    assert db.get(Account, 1).balance == Decimal("133.00")
+
+    with pytest.raises(HTTPException) as excinfo:
+        transfer_engine.transfer(db, 2, "merchant", "payer", Decimal("7.01"))
+    assert excinfo.value.detail == "Insufficient funds"
+
+
+def test_batch_with_sharded_sender_and_recipient(db):
+    results = transfer_engine.transfer_batch(db, 1, "payer", [("merchant", Decimal("30.00"))] * 3 + [("merchant", Decimal("20.00"))])
+    db.commit()
+    assert [r.status for r in results] == ["success", "success", "success", "failed"]
+    assert total(db) == Decimal("130.00")
+    assert db.get(Account, 1).balance == Decimal("10.00")
+
+    results = transfer_engine.transfer_batch(db, 2, "merchant", [("payer", Decimal("60.00")), ("payer", Decimal("60.00")), ("payer", Decimal("20.00"))])
+    db.commit()
+    assert [r.status for r in results] == ["success", "success", "failed"]
+    assert total(db) == Decimal("10.00")
+    assert min(shard_balances(db).values()) >= 0
+    assert db.get(Account, 1).balance == Decimal("130.00")
+
+
+def test_rebalance_evens_out_shards_and_the_account_row(db):
+    db.execute(sa.update(AccountBalanceShard).where(AccountBalanceShard.shard == 0).values(balance=Decimal("25.00")))
+    db.execute(sa.update(Account).where(Account.id == 2).values(balance=Decimal("3.00")))
+    db.commit()
+
+    assert balance_shards.rebalance_account(db, 2, 4) is True
+    db.commit()
+    assert shard_balances(db) == {0: Decimal("14.50"), 1: Decimal("14.50"), 2: Decimal("14.50"), 3: Decimal("14.50")}
+    assert db.get(Account, 2).balance == Decimal("0.00")
+    assert balance_shards.rebalance_account(db, 2, 4) is False
+
+
+def test_credit_falls_back_to_the_account_row_after_unsharding(db):
+    balance_shards.configure_sharding(db, 2, None)
+    db.commit()
+
+    balance_shards.credit(db, 2, 4, Decimal("5.00"))
+    db.commit()
+    db.expire_all()
+    assert db.get(Account, 2).balance == Decimal("45.00")
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+import bcrypt
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+import password_hasher
+from bulk_onboarding import onboard_users
+from database import Base
+from models import Account, User
+
+CSV = """username,email,password,password_hash,balance
+alice,alice@example.com,alicepw,,
+bob,bob@example.com,bobpw,,250.50
+carol,carol@example.com,,{carol_hash},
+alice,alice2@example.com,again,,
+existing,new@example.com,pw,,
+,nobody@example.com,pw,,
+dave,dave@example.com,,,
+"""
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(password_hasher, "PASSWORD_HASH_WORKERS", 0)
+    engine = sa.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(username="existing", email="existing@example.com", password_hash="x"))
+        db.commit()
+    return engine
+
+
+def test_onboarding_imports_users_and_accounts(engine):
+    carol_hash = bcrypt.hashpw(b"carolpw", bcrypt.gensalt(4)).decode("utf-8")
+
+    report = onboard_users(engine, CSV.format(carol_hash=carol_hash).splitlines(), batch_size=2, rounds=4)
+
+    assert report.imported == 3
+    assert report.duplicates == 2  # alice repeated in the file, "existing" already registered
+    assert report.invalid == 2
+    with Session(engine) as db:
+        rows = {u.username: (u, a) for u, a in db.query(User, Account).join(Account, Account.user_id == User.id)}
+    assert set(rows) == {"alice", "bob", "carol"}
+    assert rows["alice"][1].balance == Decimal("1000.00")
+    assert rows["bob"][1].balance == Decimal("250.50")
+    assert bcrypt.checkpw(b"bobpw", rows["bob"][0].password_hash.encode("utf-8"))
+    assert rows["bob"][0].password_hash.startswith("$2b$04$")
+    assert rows["carol"][0].password_hash == carol_hash
+
+
+def test_rerunning_an_import_skips_everything(engine):
+    lines = "username,email,password\nerin,erin@example.com,pw\n".splitlines()
+    onboard_users(engine, lines, rounds=4)
+
+    report = onboard_users(engine, lines, rounds=4)
+
+    assert report.imported == 0
+    assert report.duplicates == 1
+
+
+def test_copy_method_requires_postgresql(engine):
+    with pytest.raises(ValueError):
+        onboard_users(engine, ["username,email,password"], method="copy")
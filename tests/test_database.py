@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from database import run_db, _async_database_url
+
+
+def test_async_database_url_maps_drivers():
+    assert _async_database_url("postgresql://u:p@db/bank") == "postgresql+asyncpg://u:p@db/bank"
+    assert _async_database_url("postgresql+psycopg2://u:p@db/bank") == "postgresql+asyncpg://u:p@db/bank"
+    assert _async_database_url("sqlite:////tmp/bank.db") == "sqlite+aiosqlite:////tmp/bank.db"
+
+
+def test_run_db_sync_session_runs_off_the_event_loop():
+    """A sync Session should be handed to the callable on a worker thread, not the loop thread."""
+    engine = sa.create_engine("sqlite://", connect_args={"check_same_thread": False})
+
+    def probe(db):
+        return threading.get_ident(), db.execute(sa.text("SELECT 1")).scalar()
+
+    async def main():
+        with Session(engine) as db:
+            return threading.get_ident(), await run_db(db, probe)
+
+    loop_thread, (worker_thread, value) = asyncio.run(main())
+    assert value == 1
+    assert worker_thread != loop_thread
+
+
+def test_run_db_async_session_uses_run_sync():
+    """An AsyncSession should run the same sync callable through run_sync on the asyncio driver."""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    def probe(db, offset):
+        return db.execute(sa.text("SELECT 41")).scalar() + offset
+
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        try:
+            async with AsyncSession(engine) as db:
+                return await run_db(db, probe, 1)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(main()) == 42
+
+
+def test_count_users_exact_and_estimate_fallback():
+    """Outside PostgreSQL there is no catalog estimate, so both methods count exactly."""
+    from database import Base, count_users
+    from models import User
+
+    engine = sa.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add_all([User(username=f"u{i}", email=f"u{i}@example.com", password_hash="x") for i in range(3)])
+        db.commit()
+
+        assert count_users(db) == 3
+        assert count_users(db, "estimate") == 3
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import group_commit
+import ledger
+import rollups
+from group_commit import GroupCommitWriter
+from models import Account, Transaction
+from principal_cache import Principal
+from rate_limiter import limiter
+from routes.transfer_routes import transfer_funds
+
+
+@pytest.fixture
+def session_factory(make_bank):
+    """alice (account 1) with 100.00, bob (account 2) and carol (account 3) with 0.00."""
+    factory = make_bank({"alice": "100.00", "bob": "0.00", "carol": "0.00"})
+    commits = []
+    sa.event.listen(factory.engine, "commit", lambda conn: commits.append(1))
+    factory.commits = commits
+    return factory
+
+
+def balances(session_factory):
+    with session_factory() as db:
+        return {a.id: a.balance for a in db.query(Account).order_by(Account.id)}
+
+
+def outcome(future):
+    try:
+        future.result(timeout=5)
+        return "ok"
+    except HTTPException as e:
+        return e.detail
+
+
+def test_transfers_arriving_together_share_one_commit(session_factory):
+    writer = GroupCommitWriter(session_factory, max_batch=10, linger_ms=200)
+    try:
+        futures = [
+            writer.submit(1, "alice", "bob", Decimal("30.00")),
+            writer.submit(1, "alice", "carol", Decimal("50.00")),
+            writer.submit(1, "alice", "bob", Decimal("30.00")),
+            writer.submit(1, "alice", "nobody", Decimal("1.00")),
+            writer.submit(2, "bob", "carol", Decimal("10.00")),
+        ]
+        results = [outcome(f) for f in futures]
+    finally:
+        writer.stop()
+
+    # The same messages as a standalone transfer, and failed transfers leave no trace
+    assert results == ["ok", "ok", "Insufficient funds", "Recipient not found", "ok"]
+    assert len(session_factory.commits) == 1
+    assert balances(session_factory) == {1: Decimal("20.00"), 2: Decimal("20.00"), 3: Decimal("60.00")}
+    with session_factory() as db:
+        assert db.query(Transaction).count() == 6
+
+
+def test_batches_are_capped_at_max_batch(session_factory):
+    writer = GroupCommitWriter(session_factory, max_batch=2, linger_ms=200)
+    try:
+        futures = [writer.submit(1, "alice", "bob", Decimal("1.00")) for _ in range(5)]
+        assert [outcome(f) for f in futures] == ["ok"] * 5
+    finally:
+        writer.stop()
+
+    assert len(session_factory.commits) == 3
+    assert balances(session_factory)[2] == Decimal("5.00")
+
+
+def test_a_failed_commit_fails_every_transfer_in_the_batch(session_factory):
+    def fail():
+        raise RuntimeError("disk full")
+
+    def failing_factory():
+        db = session_factory()
+        db.commit = fail
+        return db
+
+    writer = GroupCommitWriter(failing_factory, max_batch=10, linger_ms=100)
+    try:
+        futures = [writer.submit(1, "alice", "bob", Decimal("1.00")) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+    finally:
+        writer.stop()
+
+    assert balances(session_factory)[1] == Decimal("100.00")
+
+
+def test_full_queue_is_rejected_with_503(session_factory):
+    release = threading.Event()
+
+    def blocking_factory():
+        release.wait(5)
+        return session_factory()
+
+    writer = GroupCommitWriter(blocking_factory, max_batch=1, linger_ms=0, max_pending=1)
+    try:
+        first = writer.submit(1, "alice", "bob", Decimal("1.00"))
+        # Wait for the writer to pick up the first transfer, then fill the queue
+        for _ in range(100):
+            if writer._queue.empty():
+                break
+            threading.Event().wait(0.01)
+        second = writer.submit(1, "alice", "bob", Decimal("1.00"))
+        with pytest.raises(HTTPException) as excinfo:
+            writer.submit(1, "alice", "bob", Decimal("1.00"))
+        assert excinfo.value.status_code == 503
+        release.set()
+        assert outcome(first) == outcome(second) == "ok"
+    finally:
+        release.set()
+        writer.stop()
+
+
+def test_interleaved_batches_lock_rollup_rows_in_one_order(session_factory, monkeypatch):
+    """Two batches credit bob and carol in opposite orders. In ledger mode the writer does not lock recipients, so
+    only one sorted upsert per table and batch keeps two such writers from taking those rows in opposite orders."""
+    monkeypatch.setattr(ledger, "BALANCE_MODE", "ledger")
+    upserts = []
+    upsert = rollups.upsert
+
+    def recording_upsert(db, table, keys, rows):
+        # The slot is the same for the whole call, and picked at random
+        upserts.append((table.name, sorted(tuple(row[k] for k in keys if k != "slot") for row in rows)))
+        upsert(db, table, keys, rows)
+
+    monkeypatch.setattr(rollups, "upsert", recording_upsert)
+    writer = GroupCommitWriter(session_factory)
+    batches = [
+        [("bob", "10.00"), ("nobody", "1.00"), ("carol", "10.00")],
+        [("carol", "5.00"), ("bob", "5.00")],
+    ]
+    locked = []
+    for batch in batches:
+        items = [group_commit._Transfer(1, "alice", recipient, Decimal(amount), None) for recipient, amount in batch]
+        upserts.clear()
+        writer.apply(items)
+        assert [outcome(item.future) for item in items] == ["ok" if recipient != "nobody" else "Recipient not found" for recipient, _ in batch]
+        assert [table for table, _ in upserts] == ["account_daily_rollups", "daily_transaction_totals", "account_versions"]
+        locked.append([keys for _, keys in upserts])
+
+    assert locked[0] == locked[1]
+    assert [key[0] for key in locked[0][0]] == [1, 2, 3]
+    with session_factory() as db:
+        assert rollups.account_summary(db, 2)["by_type"]["transfer"]["credits"] == "15.00"
+        assert rollups.bank_summary(db)["transaction_count"] == 8
+
+
+def test_cancelled_transfers_are_not_applied(session_factory):
+    writer = GroupCommitWriter(session_factory, max_batch=10, linger_ms=0)
+    item = group_commit._Transfer(1, "alice", "bob", Decimal("1.00"), None)
+    assert item.future.cancel()
+    writer.apply([item])
+
+    assert session_factory.commits == []
+    assert balances(session_factory)[1] == Decimal("100.00")
+
+
+def test_transfer_route_in_group_mode(session_factory, monkeypatch):
+    limiter.reset()
+    monkeypatch.setattr(group_commit, "TRANSFER_COMMIT_MODE", "group")
+    monkeypatch.setattr(group_commit, "_writer", GroupCommitWriter(session_factory, linger_ms=1))
+    request = Request({"type": "http", "method": "POST", "path": "/transfer", "headers": [], "client": ("127.0.0.1", 1)})
+    alice = Principal(id=1, username="alice", email="alice@example.com")
+    try:
+        assert asyncio.run(transfer_funds(request, "bob", 25.0, alice, None)) == {"message": "Transfer successful"}
+        with pytest.raises(HTTPException) as excinfo:
+            asyncio.run(transfer_funds(request, "alice", 5.0, alice, None))
+        assert excinfo.value.detail == "You cannot transfer money to yourself."
+    finally:
+        group_commit.shutdown()
+
+    assert balances(session_factory) == {1: Decimal("75.00"), 2: Decimal("25.00"), 3: Decimal("0.00")}
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+
+import ledger
+import transfer_engine
+from database import upgrade_schema
+from models import Account, BalanceSnapshot, Transaction
+from principal_cache import Principal
+from routes.balance_routes import get_balance
+
+
+@pytest.fixture(autouse=True)
+def ledger_mode(monkeypatch):
+    monkeypatch.setattr(ledger, "BALANCE_MODE", "ledger")
+
+
+@pytest.fixture
+def bank_accounts():
+    """sender (user 1, account 1) with 100.00 and recipient (user 2, account 2) with 50.00."""
+    return {"sender": "100.00", "recipient": "50.00"}
+
+
+def test_transfer_only_inserts_postings(db):
+    result = transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("30.00"))
+    db.commit()
+
+    assert result.sender_balance == Decimal("70.00")
+    assert not [s for s in db.statements if s.lstrip().upper().startswith("UPDATE")]
+    # accounts.balance stays the opening balance; the postings carry the movement
+    assert {a.id: a.balance for a in db.query(Account)} == {1: Decimal("100.00"), 2: Decimal("50.00")}
+    assert sorted(t.signed_amount for t in db.query(Transaction)) == [Decimal("-30.00"), Decimal("30.00")]
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("70.00"), 2: Decimal("80.00")}
+
+
+def test_transfer_checks_the_ledger_balance(db):
+    transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("80.00"))
+    db.commit()
+
+    with pytest.raises(Exception) as excinfo:
+        transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("30.00"))
+    assert excinfo.value.detail == "Insufficient funds"
+
+
+def test_batch_posts_successful_items(db):
+    results = transfer_engine.transfer_batch(
+        db, 1, "sender", [("recipient", Decimal("60.00")), ("recipient", Decimal("60.00")), ("recipient", Decimal("40.00"))]
+    )
+    db.commit()
+
+    assert [r.status for r in results] == ["success", "failed", "success"]
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("0.00"), 2: Decimal("150.00")}
+
+
+def test_column_mode_rows_are_not_postings(db, monkeypatch):
+    """Rows written before the switch to ledger mode are already part of accounts.balance."""
+    monkeypatch.setattr(ledger, "BALANCE_MODE", "column")
+    transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("10.00"))
+    db.commit()
+    monkeypatch.setattr(ledger, "BALANCE_MODE", "ledger")
+
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("90.00"), 2: Decimal("60.00")}
+    assert ledger.take_snapshots(db, datetime.utcnow()) == 0
+
+
+def test_snapshots_compact_postings_without_changing_balances(db):
+    transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("30.00"))
+    db.commit()
+    first_cutoff = datetime.utcnow()
+
+    assert ledger.take_snapshots(db, first_cutoff) == 2
+    db.commit()
+    assert {s.account_id: (s.balance, s.through_date) for s in db.query(BalanceSnapshot)} == {
+        1: (Decimal("70.00"), first_cutoff),
+        2: (Decimal("80.00"), first_cutoff),
+    }
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("70.00"), 2: Decimal("80.00")}
+    # Nothing new since the last cutoff
+    assert ledger.take_snapshots(db, first_cutoff) == 0
+
+    transfer_engine.transfer(db, 2, "recipient", "sender", Decimal("5.00"))
+    db.commit()
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("75.00"), 2: Decimal("75.00")}
+
+    assert ledger.take_snapshots(db, datetime.utcnow()) == 2
+    db.commit()
+    assert {s.account_id: s.balance for s in db.query(BalanceSnapshot)} == {1: Decimal("75.00"), 2: Decimal("75.00")}
+    assert ledger.balances(db, [1, 2]) == {1: Decimal("75.00"), 2: Decimal("75.00")}
+
+
+def test_snapshots_skip_postings_newer_than_the_cutoff(db):
+    transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("30.00"))
+    db.commit()
+
+    assert ledger.take_snapshots(db, datetime.utcnow() - timedelta(minutes=5)) == 0
+    assert db.query(BalanceSnapshot).count() == 0
+
+
+def test_balance_route_reads_the_ledger(db):
+    transfer_engine.transfer(db, 1, "sender", "recipient", Decimal("30.00"))
+    db.commit()
+
+    user = Principal(id=2, username="recipient", email="recipient@example.com")
+    assert json.loads(asyncio.run(get_balance(user, db)).body) == {"balance": "80.00"}
+
+
+def test_upgrade_schema_adds_the_posting_column():
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, account_id INTEGER NOT NULL, "
+            "transaction_type VARCHAR(20) NOT NULL, amount NUMERIC(15, 2) NOT NULL, "
+            "transaction_date DATETIME, description TEXT)"
+        ))
+
+    upgrade_schema(engine)
+
+    inspector = sa.inspect(engine)
+    assert "signed_amount" in {c["name"] for c in inspector.get_columns("transactions")}
+    assert {"idx_transactions_account_date", "idx_transactions_date"} <= {i["name"] for i in inspector.get_indexes("transactions")}
@@ -0,0 +1,62 @@
+import json
+
+from loguru import logger
+
+from logging_config import BatchedLogWriter, LogSampler, parse_sample_rates, LOG_DROPPED
+
+
+def _capture(writer, sampler=None):
+    return logger.add(writer.sink, level="INFO", serialize=True, filter=sampler)
+
+
+def test_writer_flushes_batches_to_file(tmp_path):
+    path = tmp_path / "logs.json"
+    writer = BatchedLogWriter(str(path), batch_size=2, flush_interval=0.05).start()
+    handler_id = _capture(writer)
+    try:
+        for i in range(5):
+            logger.info(f"line {i}")
+    finally:
+        logger.remove(handler_id)
+        writer.stop()
+
+    records = [json.loads(line)["record"] for line in path.read_text().splitlines()]
+    assert [r["message"] for r in records] == [f"line {i}" for i in range(5)]
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    writer = BatchedLogWriter(str(tmp_path / "logs.json"), max_queue=1)  # not started, so nothing drains
+    handler_id = _capture(writer)
+    dropped = LOG_DROPPED.labels(reason="queue_full")
+    before = dropped._value.get()
+    try:
+        logger.info("kept")
+        logger.info("dropped")
+        logger.info("dropped")
+    finally:
+        logger.remove(handler_id)
+
+    assert writer.queue.qsize() == 1
+    assert dropped._value.get() - before == 2
+
+
+def test_sampler_keeps_warnings_and_samples_routes(tmp_path):
+    path = tmp_path / "logs.json"
+    writer = BatchedLogWriter(str(path), flush_interval=0.05).start()
+    handler_id = _capture(writer, LogSampler(parse_sample_rates("/balance=0, /transactions=1")))
+    try:
+        logger.bind(route="/balance").info("sampled out")
+        logger.bind(route="/balance").warning("always kept")
+        logger.bind(route="/transactions").info("kept")
+        logger.info("unconfigured route kept")
+    finally:
+        logger.remove(handler_id)
+        writer.stop()
+
+    messages = [json.loads(line)["record"]["message"] for line in path.read_text().splitlines()]
+    assert messages == ["always kept", "kept", "unconfigured route kept"]
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("") == {}
+    assert parse_sample_rates("/balance=0.1, routes.auth_routes=0.5") == {"/balance": 0.1, "routes.auth_routes": 0.5}
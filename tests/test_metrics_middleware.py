@@ -0,0 +1,54 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from metrics_middleware import MetricsMiddleware, UNMATCHED_ROUTE
+
+
+def _count(method, endpoint):
+    return REGISTRY.get_sample_value("request_count_total", {"method": method, "endpoint": endpoint}) or 0
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/mw-items/{item_id}")
+    def read_item(item_id: int):
+        return {"id": item_id}
+
+    @app.get("/mw-boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def test_requests_are_labelled_by_route_template(client):
+    before = _count("GET", "/mw-items/{item_id}")
+
+    assert client.get("/mw-items/1").status_code == 200
+    assert client.get("/mw-items/2").status_code == 200
+
+    assert _count("GET", "/mw-items/{item_id}") - before == 2
+    assert REGISTRY.get_sample_value("request_count_total", {"method": "GET", "endpoint": "/mw-items/1"}) is None
+
+
+def test_unmatched_paths_share_one_label(client):
+    before = _count("GET", UNMATCHED_ROUTE)
+
+    for path in ("/wp-admin.php", "/.env", "/mw-items/1/extra"):
+        assert client.get(path).status_code == 404
+
+    assert _count("GET", UNMATCHED_ROUTE) - before == 3
+
+
+def test_exceptions_are_counted_and_reraised(client):
+    before = REGISTRY.get_sample_value("exception_count_total", {"endpoint": "/mw-boom"}) or 0
+
+    assert client.get("/mw-boom").status_code == 500
+
+    assert REGISTRY.get_sample_value("exception_count_total", {"endpoint": "/mw-boom"}) - before == 1
+    assert _count("GET", "/mw-boom") >= 1
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+from prometheus_client import Counter, Gauge
+Counter("mp_requests", "requests").inc(3)
+Gauge("mp_users", "users", multiprocess_mode="mostrecent").set(10)
+Gauge("mp_queue", "queue", multiprocess_mode="livesum").set(2)
+"""
+
+SCRAPE = """
+import multiprocess_metrics
+print(multiprocess_metrics.cleanup_dead_workers())
+print(multiprocess_metrics.generate_metrics().decode())
+"""
+
+
+def _run(code, metrics_dir):
+    # Multi-process mode is chosen when prometheus_client is imported, so each step needs a fresh interpreter
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(metrics_dir), PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+
+
+def test_metrics_are_aggregated_across_workers(tmp_path):
+    _run(WORKER, tmp_path)
+    _run(WORKER, tmp_path)
+
+    output = _run(SCRAPE, tmp_path)
+
+    assert "mp_requests_total 6.0" in output
+    assert "mp_users 10.0" in output
+
+
+def test_dead_workers_live_gauges_are_cleaned_up(tmp_path):
+    _run(WORKER, tmp_path)
+    assert any(name.startswith("gauge_livesum_") for name in os.listdir(tmp_path))
+
+    output = _run(SCRAPE, tmp_path)
+
+    assert not any(name.startswith("gauge_livesum_") for name in os.listdir(tmp_path))
+    assert "mp_queue 2.0" not in output
+    assert "mp_requests_total 3.0" in output  # counters of dead workers are kept
@@ -0,0 +1,46 @@
+import asyncio
+import bcrypt
+import pytest
+from fastapi import HTTPException
+
+import password_hasher
+from password_hasher import hash_password, verify_password, needs_rehash
+
+
+@pytest.fixture(autouse=True)
+def low_cost(monkeypatch):
+    """Keep bcrypt cheap and on the threadpool so the tests stay fast."""
+    monkeypatch.setattr(password_hasher, "BCRYPT_ROUNDS", 4)
+    monkeypatch.setattr(password_hasher, "PASSWORD_HASH_WORKERS", 0)
+
+
+def test_hash_and_verify_round_trip():
+    hashed = asyncio.run(hash_password("password123"))
+
+    assert hashed.startswith("$2b$04$")
+    assert asyncio.run(verify_password("password123", hashed)) is True
+    assert asyncio.run(verify_password("wrong", hashed)) is False
+
+
+def test_process_pool_produces_compatible_hashes(monkeypatch):
+    monkeypatch.setattr(password_hasher, "PASSWORD_HASH_WORKERS", 1)
+    try:
+        hashed = asyncio.run(hash_password("password123"))
+    finally:
+        password_hasher.shutdown()
+
+    assert bcrypt.checkpw(b"password123", hashed.encode("utf-8"))
+
+
+def test_needs_rehash_compares_work_factor():
+    assert needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(4)).decode("utf-8")) is False
+    assert needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(5)).decode("utf-8")) is True
+    assert needs_rehash("not-a-bcrypt-hash") is True
+
+
+def test_full_queue_is_rejected(monkeypatch):
+    monkeypatch.setattr(password_hasher, "PASSWORD_HASH_MAX_PENDING", 0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(hash_password("password123"))
+    assert exc_info.value.status_code == 503
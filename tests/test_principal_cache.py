@@ -0,0 +1,78 @@
+import asyncio
+import time
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+import auth
+from auth import create_access_token, get_current_user
+from models import User
+from principal_cache import Principal, PrincipalCache
+
+
+def test_cache_hit_after_put():
+    cache = PrincipalCache(max_size=10, ttl_seconds=60)
+    principal = Principal(id=1, username="alice", email="alice@example.com")
+
+    assert cache.get("token-a") is None
+    cache.put("token-a", principal, time.time() + 3600)
+
+    assert cache.get("token-a") == principal
+    assert cache.get("token-b") is None
+
+
+def test_entry_never_outlives_token_exp():
+    cache = PrincipalCache(max_size=10, ttl_seconds=60)
+    principal = Principal(id=1, username="alice", email="alice@example.com")
+
+    cache.put("expired", principal, time.time() - 1)
+    cache.put("short", principal, time.time() + 0.05)
+
+    assert cache.get("expired") is None
+    assert cache.get("short") == principal
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PrincipalCache(max_size=2, ttl_seconds=60)
+    for i in range(2):
+        cache.put(f"token-{i}", Principal(id=i, username=f"user{i}", email=f"user{i}@example.com"))
+
+    cache.get("token-0")  # token-1 is now the least recently used
+    cache.put("token-2", Principal(id=2, username="user2", email="user2@example.com"))
+
+    assert cache.get("token-1") is None
+    assert cache.get("token-0") is not None
+    assert cache.get("token-2") is not None
+
+
+def test_invalidate_user_drops_all_of_their_tokens():
+    cache = PrincipalCache(max_size=10, ttl_seconds=60)
+    alice = Principal(id=1, username="alice", email="alice@example.com")
+    bob = Principal(id=2, username="bob", email="bob@example.com")
+    cache.put("alice-web", alice)
+    cache.put("alice-mobile", alice)
+    cache.put("bob-web", bob)
+
+    cache.invalidate_user(1)
+
+    assert cache.get("alice-web") is None
+    assert cache.get("alice-mobile") is None
+    assert cache.get("bob-web") == bob
+
+
+def test_get_current_user_warm_request_skips_db(monkeypatch):
+    """The second request with the same token should be served without touching the session."""
+    monkeypatch.setattr(auth, "principal_cache", PrincipalCache(max_size=10, ttl_seconds=60))
+    token = create_access_token({"sub": "alice", "id": 7}, expires_delta=timedelta(minutes=5))
+    db = MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = User(
+        id=7, username="alice", email="alice@example.com", password_hash="x"
+    )
+
+    first = asyncio.run(get_current_user(token, db))
+    second = asyncio.run(get_current_user(token, db))
+
+    assert first == second == Principal(id=7, username="alice", email="alice@example.com")
+    db.query.assert_called_once()
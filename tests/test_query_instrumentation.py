@@ -0,0 +1,88 @@
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import REGISTRY
+
+import query_instrumentation
+from metrics_middleware import RequestContext, current_request
+from query_instrumentation import BACKGROUND_ROUTE, fingerprint, instrument_engine, normalize
+
+
+class _Route:
+    path = "/qi-test/{item_id}"
+
+
+def _engine():
+    engine = instrument_engine(sa.create_engine("sqlite://"))
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE qi_items (id INTEGER PRIMARY KEY, name TEXT)"))
+    return engine
+
+
+def _count(statement, route):
+    return REGISTRY.get_sample_value("db_query_count_total", {"statement": statement, "route": route}) or 0
+
+
+def test_normalize_collapses_parameters_and_lists():
+    assert normalize("SELECT * FROM users WHERE id = %(id_1)s AND name = 'bob'") == "SELECT * FROM users WHERE id = ? AND name = ?"
+    assert normalize("SELECT id FROM users WHERE username IN (?, ?, ?)") == normalize("SELECT id FROM users WHERE username IN (?)")
+    assert normalize("INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4)") == "INSERT INTO t (a, b) VALUES (?, ?)"
+    assert normalize("SELECT 1\n  LIMIT 10 OFFSET 20") == "SELECT ? LIMIT ? OFFSET ?"
+
+
+def test_fingerprint_is_stable_across_parameters():
+    a = fingerprint("UPDATE accounts SET balance=(accounts.balance - ?) WHERE accounts.id = ? AND accounts.balance >= ?")
+    b = fingerprint("UPDATE accounts SET balance=(accounts.balance - %(balance_1)s) WHERE accounts.id = %(id_1)s AND accounts.balance >= %(balance_2)s")
+
+    assert a == b
+    assert a.startswith("UPDATE accounts#")
+    assert fingerprint("SELECT * FROM transactions") != fingerprint("SELECT * FROM accounts")
+
+
+def test_statements_are_attributed_to_the_current_request():
+    engine = _engine()
+    insert = fingerprint("INSERT INTO qi_items (name) VALUES (?)")
+    request = RequestContext({"route": _Route()})
+    before = _count(insert, _Route.path)
+
+    token = current_request.set(request)
+    try:
+        with engine.begin() as conn:
+            conn.execute(sa.text("INSERT INTO qi_items (name) VALUES (:name)"), [{"name": "a"}, {"name": "b"}])
+            conn.execute(sa.text("SELECT * FROM qi_items"))
+    finally:
+        current_request.reset(token)
+
+    assert _count(insert, _Route.path) - before == 1
+    assert request.statements == 2
+
+    with engine.connect() as conn:
+        conn.execute(sa.text("SELECT * FROM qi_items"))
+    assert _count(fingerprint("SELECT * FROM qi_items"), BACKGROUND_ROUTE) >= 1
+
+
+def test_slow_queries_are_logged(monkeypatch):
+    engine = _engine()
+    monkeypatch.setattr(query_instrumentation, "SLOW_QUERY_THRESHOLD_MS", 0.000001)
+    messages = []
+    handler_id = logger.add(messages.append, level="WARNING")
+    try:
+        with engine.connect() as conn:
+            conn.execute(sa.text("SELECT name FROM qi_items WHERE id = :id"), {"id": 1})
+    finally:
+        logger.remove(handler_id)
+
+    assert any("Slow query" in m and "SELECT qi_items#" in m and "WHERE id = ?" in m for m in messages)
+
+
+def test_failed_statements_are_counted():
+    engine = _engine()
+    label = fingerprint("SELECT * FROM qi_missing")
+    before = REGISTRY.get_sample_value("db_query_failures_total", {"statement": label, "route": BACKGROUND_ROUTE}) or 0
+
+    with engine.connect() as conn:
+        try:
+            conn.execute(sa.text("SELECT * FROM qi_missing"))
+        except sa.exc.OperationalError:
+            pass
+
+    assert REGISTRY.get_sample_value("db_query_failures_total", {"statement": label, "route": BACKGROUND_ROUTE}) - before == 1
@@ -0,0 +1,56 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+
+from auth import create_access_token
+from rate_limiter import InstrumentedLimiter, rate_limit_key
+
+
+def _decisions(decision):
+    return REGISTRY.get_sample_value("rate_limit_decision_latency_seconds_count", {"decision": decision}) or 0
+
+
+def _bearer(user_id):
+    return {"Authorization": f"Bearer {create_access_token({'sub': f'user{user_id}', 'id': user_id})}"}
+
+
+@pytest.fixture
+def client():
+    limiter = InstrumentedLimiter(key_func=rate_limit_key, storage_uri="memory://", strategy="moving-window")
+    app = FastAPI()
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+    @app.get("/rl-limited")
+    @limiter.limit("2 per minute")
+    def limited(request: Request):
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_authenticated_requests_are_limited_per_user(client):
+    assert [client.get("/rl-limited", headers=_bearer(1)).status_code for _ in range(3)] == [200, 200, 429]
+    # Same IP, different user: a separate budget
+    assert client.get("/rl-limited", headers=_bearer(2)).status_code == 200
+
+
+def test_anonymous_and_forged_tokens_share_the_ip_budget(client):
+    forged = {"Authorization": "Bearer not-a-real-token"}
+
+    assert client.get("/rl-limited").status_code == 200
+    assert client.get("/rl-limited", headers=forged).status_code == 200
+    assert client.get("/rl-limited").status_code == 429
+
+
+def test_decisions_are_timed(client):
+    allowed, blocked = _decisions("allowed"), _decisions("blocked")
+
+    for _ in range(3):
+        client.get("/rl-limited", headers=_bearer(3))
+
+    assert _decisions("allowed") - allowed == 2
+    assert _decisions("blocked") - blocked == 1
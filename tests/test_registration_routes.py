@@ -32,14 +32,15 @@ def test_register_success(mock_db):
     # Simulate 'no existing user' scenario
     mock_db.query.return_value.filter.return_value.first.return_value = None
     
-    # Mock the add/commit/refresh methods
-    mock_db.add = MagicMock()
+    # Mock the add/flush/commit methods
+    added = []
+    mock_db.add = MagicMock(side_effect=added.append)
     mock_db.commit = MagicMock()
-    mock_db.refresh = MagicMock()
+    mock_db.flush = MagicMock()
 
     # Mock the user ID upon insertion
-    new_user = User(id=1, username="testuser", email="test@example.com", password_hash="hashedpassword")
-    mock_db.refresh.side_effect = lambda obj: setattr(obj, "id", 1)  # Simulate DB refresh setting ID
+    mock_db.flush.side_effect = lambda: setattr(added[0], "id", 1)  # Simulate DB flush setting ID
+    mock_db.get_bind.return_value.dialect.name = "sqlite"  # Picks the dialect for the rollup upsert
 
     # Override the DB in the route
     app.dependency_overrides[get_db] = lambda: (yield mock_db)
@@ -57,7 +58,10 @@ def test_register_success(mock_db):
     # Verify DB calls
     mock_db.query.assert_called_once()  # or more specific checks
     mock_db.add.assert_called()         # user and account
-    mock_db.commit.assert_called()
+    mock_db.commit.assert_called_once()  # user and account in one transaction
+    mock_db.refresh.assert_not_called()
+    assert isinstance(added[0], User) and isinstance(added[1], Account)
+    assert added[1].user_id == 1
 
 
 def test_register_existing_user(mock_db):
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+import sqlalchemy as sa
+from starlette.requests import Request
+
+import auth
+from principal_cache import Principal
+from rate_limiter import limiter
+from replicas import ReplicaRouter
+from routes import transfer_routes
+from routes.balance_routes import get_balance
+
+ALICE = Principal(id=1, username="alice", email="alice@example.com")
+
+
+@pytest.fixture
+def router(make_bank, monkeypatch):
+    """Two local databases: the primary, and a "replica" that has not caught up with alice's last 30.00 out."""
+    primary = make_bank({"alice": "70.00", "bob": "0.00"})
+    replica = make_bank({"alice": "100.00", "bob": "0.00"})
+    router = ReplicaRouter(replica.engine, max_lag_seconds=5, pin_seconds=60, check_interval=1)
+    monkeypatch.setattr(auth, "replica_router", router)
+    monkeypatch.setattr(auth, "ReplicaSessionLocal", replica)
+    monkeypatch.setattr(auth, "AsyncReplicaSessionLocal", None)
+    monkeypatch.setattr(transfer_routes, "replica_router", router)
+    router.primary = primary
+    return router
+
+
+def read_balance(router):
+    """GET /balance through the get_read_db dependency."""
+    async def request():
+        primary_db = router.primary()
+        sessions = auth.get_read_db(ALICE, primary_db)
+        db = await sessions.__anext__()
+        try:
+            return json.loads((await get_balance(ALICE, db)).body)["balance"]
+        finally:
+            await sessions.aclose()
+            primary_db.close()
+    return asyncio.run(request())
+
+
+def test_reads_use_the_replica_only_once_it_is_known_fresh(router, monkeypatch):
+    assert read_balance(router) == "70.00"
+
+    router.check_lag()
+    assert router.lag == 0.0
+    assert read_balance(router) == "100.00"
+
+    monkeypatch.setattr(router, "measure_lag", lambda: 12.0)
+    router.check_lag()
+    assert read_balance(router) == "70.00"
+
+
+def test_unreachable_or_silent_replica_falls_back_to_the_primary(router, monkeypatch):
+    router.check_lag()
+    monkeypatch.setattr(router, "_checked_at", router._checked_at - 10)
+    assert not router.replica_fresh()
+
+    def unreachable():
+        raise sa.exc.OperationalError("SELECT 1", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(router, "measure_lag", unreachable)
+    router.check_lag()
+    assert router.lag is None
+    assert read_balance(router) == "70.00"
+
+
+def test_a_transfer_pins_the_sender_to_the_primary(router):
+    router.check_lag()
+    limiter.reset()
+    request = Request({"type": "http", "method": "POST", "path": "/transfer", "headers": [], "client": ("127.0.0.1", 12345)})
+    with router.primary() as db:
+        asyncio.run(transfer_routes.transfer_funds(request, "bob", 10.0, ALICE, db))
+
+    assert asyncio.run(router.is_pinned(1)) and not asyncio.run(router.is_pinned(2))
+    assert read_balance(router) == "60.00"
+
+    asyncio.run(router.pin(1, seconds=0))
+    assert read_balance(router) == "100.00"
+
+
+def test_expired_pins_are_dropped():
+    router = ReplicaRouter(sa.create_engine("sqlite://"))
+    asyncio.run(router.pin(1, seconds=60))
+    asyncio.run(router.pin(2, seconds=0))
+    router.check_lag()
+    assert list(router._pins) == [1]
@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+import archive
+import ledger
+import rollups
+import transfer_engine
+from models import AccountDailyRollup, BalanceSnapshot, BankCounter, DailyTransactionTotal, Transaction
+from partitions import add_months, utc_today
+from principal_cache import Principal
+from routes.transactions_routes import get_transactions_summary
+from transaction_simulator import simulate_batch
+
+
+@pytest.fixture
+def bank_accounts():
+    """alice (user 1, account 1) with 100.00 and bob (user 2, account 2) with 50.00; user 3 has no account."""
+    return {"alice": "100.00", "bob": "50.00", "carol": None}
+
+
+@pytest.fixture
+def db(db):
+    rollups.record_signups(db, users=3, accounts=2)
+    db.commit()
+    return db
+
+
+def snapshot(db):
+    """Every rollup row, with the slots summed."""
+    accounts = {}
+    for r in db.query(AccountDailyRollup):
+        count, credits, debits = accounts.get((r.account_id, r.day, r.transaction_type), (0, 0, 0))
+        accounts[(r.account_id, r.day, r.transaction_type)] = (count + r.count, credits + r.credits, debits + r.debits)
+    return accounts, rollups.bank_summary(db)
+
+
+def test_transfers_are_rolled_up_per_account_and_type(db):
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("30.00"))
+    transfer_engine.transfer_batch(db, 2, "bob", [("alice", Decimal("5.00")), ("alice", Decimal("500.00"))])
+    db.commit()
+
+    summary = rollups.account_summary(db, 1)
+    assert summary["transaction_count"] == 2
+    assert summary["by_type"] == {"transfer": {"count": 2, "credits": "5.00", "debits": "30.00"}}
+    assert summary["monthly"] == [{"month": utc_today().strftime("%Y-%m"), "count": 2, "credits": "5.00", "debits": "30.00"}]
+
+    bank = rollups.bank_summary(db)
+    assert (bank["users"], bank["accounts"], bank["transaction_count"]) == (3, 2, 4)
+    assert bank["by_type"] == {"transfer": {"count": 4, "credits": "35.00", "debits": "35.00"}}
+
+
+def test_monthly_window_counts_utc_months(db, monkeypatch):
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("30.00"))
+    db.commit()
+
+    # The window ends at the current UTC month, the clock the rows are dated with
+    monkeypatch.setattr(rollups, "utc_today", lambda: add_months(utc_today(), 1))
+    assert rollups.account_summary(db, 1, months=1)["monthly"] == []
+    assert [m["month"] for m in rollups.account_summary(db, 1, months=2)["monthly"]] == [utc_today().strftime("%Y-%m")]
+
+
+def test_rollups_roll_back_with_a_failed_transfer(db):
+    with pytest.raises(HTTPException):
+        transfer_engine.transfer(db, 2, "bob", "alice", Decimal("60.00"))
+    db.rollback()
+
+    assert db.query(AccountDailyRollup).count() == 0
+    assert db.query(DailyTransactionTotal).count() == 0
+
+
+def test_totals_are_spread_over_slots(db, monkeypatch):
+    # Per transfer: the rollups' slot, then the account versions' slot
+    slots = iter([3, 3, 7, 7])
+    monkeypatch.setattr(rollups.random, "randrange", lambda n: next(slots))
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("1.00"))
+    db.commit()
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("2.00"))
+    db.commit()
+
+    assert sorted(r.slot for r in db.query(DailyTransactionTotal)) == [3, 7]
+    assert rollups.bank_summary(db)["by_type"]["transfer"]["count"] == 4
+    # bob's two credits landed on two rows rather than queueing on one
+    assert sorted(r.slot for r in db.query(AccountDailyRollup).filter(AccountDailyRollup.account_id == 2)) == [3, 7]
+    assert rollups.account_summary(db, 2)["by_type"]["transfer"] == {"count": 2, "credits": "3.00", "debits": "0.00"}
+
+
+@pytest.mark.parametrize("mode", ["column", "ledger"])
+def test_rebuild_matches_the_incremental_rollups(db, monkeypatch, mode):
+    monkeypatch.setattr(ledger, "BALANCE_MODE", mode)
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("30.00"))
+    transfer_engine.transfer(db, 2, "bob", "alice", Decimal("12.50"))
+    simulate_batch(db, [1, 2, 1])
+    db.commit()
+    incremental = snapshot(db)
+
+    rollups.rebuild(db)
+    db.commit()
+    assert snapshot(db) == incremental
+    assert db.query(BankCounter).count() == 2
+
+
+@pytest.mark.parametrize("mode", ["column", "ledger"])
+def test_rebuild_counts_archived_transactions(db, bank, monkeypatch, tmp_path, mode):
+    monkeypatch.setattr(ledger, "BALANCE_MODE", mode)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("30.00"))
+    transfer_engine.transfer(db, 2, "bob", "alice", Decimal("12.50"))
+    simulate_batch(db, [1, 2, 1])
+    # Back-date the first transfer and the simulator's rows so September 2025 can be archived
+    db.query(Transaction).filter(Transaction.id.not_in([3, 4])).update({"transaction_date": datetime(2025, 9, 10, 12)})
+    # Ledger months are only archived once snapshots cover their postings
+    db.add_all([BalanceSnapshot(account_id=account_id, balance=Decimal("0.00"), through_date=datetime(2025, 9, 30)) for account_id in (1, 2)])
+    db.commit()
+    rollups.rebuild(db)
+    db.commit()
+    before = snapshot(db)
+
+    assert archive.archive_old_transactions(db, datetime(2025, 10, 15)) == 5
+    rollups.rebuild(db)
+    db.commit()
+    assert db.query(Transaction).count() == 2
+    assert snapshot(db) == before
+
+    # Without the segments the archived history would be lost, so rebuild refuses
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "elsewhere"))
+    with pytest.raises(ValueError):
+        rollups.rebuild(db)
+    monkeypatch.setattr(rollups, "SessionLocal", bank)
+    assert rollups.main(["rebuild"]) == 1
+    assert snapshot(db) == before
+
+
+def test_summary_route(db):
+    transfer_engine.transfer(db, 1, "alice", "bob", Decimal("30.00"))
+    db.commit()
+
+    bob = Principal(id=2, username="bob", email="bob@example.com")
+    summary = asyncio.run(get_transactions_summary(12, bob, db))
+    assert summary["by_type"] == {"transfer": {"count": 1, "credits": "30.00", "debits": "0.00"}}
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(get_transactions_summary(12, Principal(id=3, username="carol", email="carol@example.com"), db))
+    assert excinfo.value.status_code == 404
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(get_transactions_summary(0, bob, db))
+    assert excinfo.value.status_code == 400
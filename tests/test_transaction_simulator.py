@@ -0,0 +1,114 @@
+import threading
+from decimal import Decimal
+
+import pytest
+from prometheus_client import REGISTRY
+
+import ledger
+import transaction_simulator
+from models import Account, Transaction
+from transaction_simulator import SimulationWorker, simulate_batch
+
+
+@pytest.fixture
+def session_factory(make_bank):
+    """Users 1-3 with accounts 1-3 holding 5.00, 500.00 and 500.00; user 4 has no account."""
+    return make_bank({"u1": "5.00", "u2": "500.00", "u3": "500.00", "u4": None})
+
+
+def check_ledger(db, opening):
+    """Every simulated row matches the balance change of its account, and nothing is overdrawn."""
+    for account in db.query(Account):
+        moved = sum(
+            (t.amount if t.transaction_type == "deposit" else -t.amount)
+            for t in db.query(Transaction).filter_by(account_id=account.id)
+        )
+        assert account.balance == opening[account.id] + moved
+        assert account.balance >= 0
+
+
+def test_simulate_batch_uses_one_lock_one_update_one_insert_per_table(session_factory):
+    with session_factory() as db:
+        written = simulate_batch(db, [1, 2, 3, 2, 4])
+        db.commit()
+
+        assert written == 4
+        # The transactions insert follows the two rollup upserts and the version upsert
+        assert [s.split()[0] for s in session_factory.statements] == ["SELECT", "UPDATE", "INSERT", "INSERT", "INSERT", "INSERT"]
+        assert db.query(Transaction).count() == 4
+        check_ledger(db, {1: Decimal("5.00"), 2: Decimal("500.00"), 3: Decimal("500.00")})
+        # Account 1 can never cover a withdrawal of at least 10.00
+        assert db.query(Transaction).filter_by(account_id=1).one().transaction_type == "deposit"
+
+
+def test_simulate_batch_in_ledger_mode_only_inserts_postings(session_factory, monkeypatch):
+    monkeypatch.setattr(ledger, "BALANCE_MODE", "ledger")
+    with session_factory() as db:
+        assert simulate_batch(db, [1, 2]) == 2
+        db.commit()
+
+        assert not [s for s in session_factory.statements if s.startswith("UPDATE")]
+        assert {a.id: a.balance for a in db.query(Account)}[1] == Decimal("5.00")
+        postings = {t.account_id: t for t in db.query(Transaction)}
+        assert postings[1].signed_amount == postings[1].amount
+        assert ledger.balances(db, [1]) == {1: Decimal("5.00") + postings[1].amount}
+
+
+def test_worker_batches_queued_logins(session_factory):
+    worker = SimulationWorker(session_factory, batch_size=10, tick_ms=50)
+    for user_id in [1, 2, 3] * 4:
+        assert worker.enqueue(user_id)
+    worker.stop()
+
+    with session_factory() as db:
+        assert db.query(Transaction).count() == 12
+        check_ledger(db, {1: Decimal("5.00"), 2: Decimal("500.00"), 3: Decimal("500.00")})
+    # 12 logins at 10 per batch: two transactions' worth of statements
+    assert len([s for s in session_factory.statements if s.startswith("INSERT INTO transactions")]) == 2
+
+
+def test_full_queue_drops_and_counts(session_factory):
+    release = threading.Event()
+
+    def blocking_factory():
+        release.wait(5)
+        return session_factory()
+
+    before = REGISTRY.get_sample_value("simulation_dropped_total") or 0
+    worker = SimulationWorker(blocking_factory, queue_size=2, batch_size=1, tick_ms=0)
+    try:
+        accepted = [worker.enqueue(1) for _ in range(10)]
+    finally:
+        release.set()
+        worker.stop()
+
+    assert accepted.count(False) >= 7
+    assert REGISTRY.get_sample_value("simulation_dropped_total") - before == accepted.count(False)
+
+
+def test_failed_batch_is_discarded(session_factory):
+    def lost(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    def broken_factory():
+        db = session_factory()
+        db.execute = lost
+        return db
+
+    before = REGISTRY.get_sample_value("simulation_batch_failures_total") or 0
+    worker = SimulationWorker(broken_factory, tick_ms=0)
+    worker.apply([1, 2])
+
+    assert REGISTRY.get_sample_value("simulation_batch_failures_total") - before == 1
+    with session_factory() as db:
+        assert db.query(Transaction).count() == 0
+
+
+def test_module_enqueue_uses_a_shared_worker(session_factory, monkeypatch):
+    monkeypatch.setattr(transaction_simulator, "_worker", SimulationWorker(session_factory, tick_ms=10))
+    assert transaction_simulator.enqueue(2)
+    transaction_simulator.shutdown()
+
+    assert transaction_simulator._worker is None
+    with session_factory() as db:
+        assert db.query(Transaction).filter_by(account_id=2).count() == 1
@@ -3,16 +3,18 @@
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
+import json
 
 from main import app
-from auth import get_db, get_current_user
-from models import Account, Transaction
+from auth import get_async_db, get_current_user
+from models import Transaction
+from routes.transactions_routes import encode_cursor, decode_cursor, stream_transactions
 
 client = TestClient(app)
 
-def override_get_db():
+def override_get_async_db():
     """Provide a MagicMock session instead of a real DB."""
     db = MagicMock()
     yield db
@@ -25,7 +27,7 @@ def override_get_current_user():
     return mock_user
 
 # Apply the overrides to all tests in this file
-app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 
@@ -34,20 +36,21 @@ def test_get_transactions_no_account():
     If the user has no account, /transactions should return 404 with "Account not found".
     """
     mock_db = MagicMock()
-    # When we query for the account, return None to simulate "no account"
-    mock_db.query.return_value.filter.return_value.first.return_value = None
+    # When we look up the account and its version, return no row to simulate "no account"
+    mock_db.execute.return_value.first.return_value = None
     
     # Override get_db for this test
-    app.dependency_overrides[get_db] = lambda: (yield mock_db)
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
 
     # Make the GET request
     response = client.get("/transactions")
 
     assert response.status_code == 404
-    assert response.json() == {"detail": "Account not found"}
+    # main.http_exception_handler returns errors as {"error": detail}
+    assert response.json() == {"error": "Account not found"}
 
     # Clean up
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
 
 
 def test_get_transactions_success():
@@ -56,9 +59,8 @@ def test_get_transactions_success():
     """
     mock_db = MagicMock()
 
-    # 1️⃣ Mock the Account
-    mock_account = Account(id=1, user_id=123, balance=Decimal("1000.00"))
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_account
+    # 1️⃣ Mock the account id
+    mock_db.execute.return_value.scalar.return_value = 1
 
     # 2️⃣ Mock some Transactions
     mock_tx1 = Transaction(
@@ -78,12 +80,11 @@ def test_get_transactions_success():
         description="Mock withdrawal"
     )
 
-    # 3️⃣ Mock the query chain to return these transactions
-    mock_db.query.return_value.filter.return_value.order_by.return_value\
-          .offset.return_value.limit.return_value.all.return_value = [mock_tx1, mock_tx2]
+    # 3️⃣ Mock the page query to return these transactions
+    mock_db.execute.return_value.all.return_value = [mock_tx1, mock_tx2]
 
     # Override get_db for this test
-    app.dependency_overrides[get_db] = lambda: (yield mock_db)
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
 
     # Make the GET request (with pagination params, if desired)
     response = client.get("/transactions?page=1&limit=10")
@@ -96,14 +97,175 @@ def test_get_transactions_success():
     # 4️⃣ Validate the first transaction
     assert data["transactions"][0]["id"] == 10
     assert data["transactions"][0]["transaction_type"] == "deposit"
-    assert data["transactions"][0]["amount"] == 50.0
+    assert data["transactions"][0]["amount"] == "50.00"
     assert data["transactions"][0]["description"] == "Mock deposit"
 
     # 5️⃣ Validate the second transaction
     assert data["transactions"][1]["id"] == 11
     assert data["transactions"][1]["transaction_type"] == "withdrawal"
-    assert data["transactions"][1]["amount"] == 20.0
+    assert data["transactions"][1]["amount"] == "20.00"
     assert data["transactions"][1]["description"] == "Mock withdrawal"
 
     # Clean up
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def test_get_transactions_returns_next_cursor():
+    """
+    When more rows exist than the page holds, /transactions should return an opaque cursor
+    pointing at the last row of the page.
+    """
+    mock_db = MagicMock()
+    mock_db.execute.return_value.scalar.return_value = 1
+
+    rows = [
+        Transaction(id=12 - i, account_id=1, transaction_type="deposit", amount=Decimal("5.00"),
+                    transaction_date=datetime(2025, 1, 3 - i, 12, 0), description="Mock deposit")
+        for i in range(3)
+    ]
+    mock_db.execute.return_value.all.return_value = rows
+
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
+
+    response = client.get("/transactions?limit=2")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["transactions"]) == 2
+    assert decode_cursor(data["next_cursor"]) == (datetime(2025, 1, 2, 12, 0), 11)
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def test_get_transactions_clamps_limit_to_100():
+    """
+    A limit above 100 is served as a page of 100 rows rather than rejected.
+    """
+    mock_db = MagicMock()
+    rows = [
+        Transaction(id=200 - i, account_id=1, transaction_type="deposit", amount=Decimal("5.00"),
+                    transaction_date=datetime(2025, 1, 1, 12, 0) - timedelta(minutes=i), description="Mock deposit")
+        for i in range(101)
+    ]
+    mock_db.execute.return_value.all.return_value = rows
+
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
+
+    response = client.get("/transactions?limit=500")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["transactions"]) == 100
+    assert data["next_cursor"] is not None
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def test_get_transactions_with_cursor_seeks_instead_of_offsetting():
+    """
+    A cursor request should add a keyset filter and skip OFFSET entirely; the last page has no next_cursor.
+    """
+    mock_db = MagicMock()
+    mock_db.execute.return_value.scalar.return_value = 1
+    mock_db.execute.return_value.all.return_value = [
+        Transaction(id=9, account_id=1, transaction_type="deposit", amount=Decimal("5.00"),
+                    transaction_date=datetime(2025, 1, 1, 12, 0), description="Mock deposit")
+    ]
+
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
+
+    cursor = encode_cursor(datetime(2025, 1, 2, 12, 0), 11)
+    response = client.get(f"/transactions?limit=2&cursor={cursor}")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [t["id"] for t in data["transactions"]] == [9]
+    assert data["next_cursor"] is None
+    page_query = str(mock_db.execute.call_args_list[-1].args[0])
+    assert "transactions.id < :id_1" in page_query
+    assert "OFFSET" not in page_query
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def test_get_transactions_invalid_cursor():
+    """
+    A cursor that cannot be decoded should be rejected with 400 rather than a server error.
+    """
+    mock_db = MagicMock()
+    mock_db.execute.return_value.scalar.return_value = 1
+
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
+
+    response = client.get("/transactions?cursor=not-a-cursor")
+
+    assert response.status_code == 400
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+@pytest.fixture
+def export_session_factory(make_bank):
+    """An in-memory SQLite bank holding one account with three transactions."""
+    factory = make_bank({"exporter": "100.00"})
+    with factory() as session:
+        for i in range(3):
+            session.add(Transaction(
+                id=i + 1,
+                account_id=1,
+                transaction_type="deposit",
+                amount=Decimal("10.05"),
+                transaction_date=datetime(2025, 1, i + 1, 9, 0),
+                description=f"Deposit, #{i + 1}",
+            ))
+        session.commit()
+    return factory
+
+
+def test_stream_transactions_ndjson(export_session_factory):
+    """
+    NDJSON export should stream one JSON object per line, newest first, with exact decimal amounts.
+    """
+    body = "".join(stream_transactions(1, "ndjson", session_factory=export_session_factory))
+    lines = [json.loads(line) for line in body.splitlines()]
+
+    assert [line["id"] for line in lines] == [3, 2, 1]
+    assert lines[0]["amount"] == "10.05"
+    assert lines[0]["transaction_date"] == "2025-01-03T09:00:00"
+
+
+def test_stream_transactions_csv_sends_header_first(export_session_factory):
+    """
+    CSV export should emit the header before touching the database, then quote fields that need it.
+    """
+    chunks = stream_transactions(1, "csv", session_factory=export_session_factory)
+
+    assert next(chunks).strip() == "id,transaction_type,amount,transaction_date,description"
+    rows = "".join(chunks).splitlines()
+    assert len(rows) == 3
+    assert rows[0] == '3,deposit,10.05,2025-01-03T09:00:00,"Deposit, #3"'
+
+
+def test_export_transactions_unsupported_format():
+    """
+    Asking for an unknown export format should fail fast with 400.
+    """
+    response = client.get("/transactions/export?format=xml")
+
+    assert response.status_code == 400
+
+
+def test_export_transactions_no_account():
+    """
+    Exporting without an account should return 404 before any streaming starts.
+    """
+    mock_db = MagicMock()
+    mock_db.query.return_value.filter.return_value.first.return_value = None
+
+    app.dependency_overrides[get_async_db] = lambda: (yield mock_db)
+
+    response = client.get("/transactions/export?format=csv")
+
+    assert response.status_code == 404
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
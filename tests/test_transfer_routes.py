@@ -1,11 +1,16 @@
+import asyncio
 import pytest
 from fastapi import FastAPI, HTTPException, Request, Depends
 from sqlalchemy.orm import Session
 from decimal import Decimal
 from unittest.mock import MagicMock
-from routes.transfer_routes import transfer_funds
+from routes.transfer_routes import transfer_funds, batch_transfer_funds, BatchTransferRequest
 from starlette.testclient import TestClient
 
+from models import User, Account, Transaction
+from principal_cache import Principal
+from rate_limiter import limiter
+
 # Create a custom test app without rate limiting middleware
 test_app = FastAPI()
 
@@ -16,8 +21,13 @@ def get_db():
     return MagicMock()
 
 @test_app.post("/transfer")
-def transfer_endpoint(request: Request, recipient_username: str, amount: float, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    return transfer_funds(request, recipient_username, amount, current_user, db)
+async def transfer_endpoint(request: Request, recipient_username: str, amount: float, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    return await transfer_funds(request, recipient_username, amount, current_user, db)
+
+@pytest.fixture(autouse=True)
+def reset_limiter():
+    """Every test starts with a fresh 5/minute budget."""
+    limiter.reset()
 
 @pytest.fixture
 def fake_request():
@@ -31,155 +41,168 @@ def fake_request():
     }
     return Request(scope)
 
-def test_transfer_success(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
-    
-    sender_account = MagicMock()
-    sender_account.id = 1
-    sender_account.balance = Decimal('100.00')
-
-    recipient_user = MagicMock()
-    recipient_user.id = 2
-    recipient_user.username = "recipient"
-
-    recipient_account = MagicMock()
-    recipient_account.id = 2
-    recipient_account.balance = Decimal('50.00')
-
-    # Simulate .filter().first() calls in order
-    db.query().filter().first.side_effect = [
-        sender_account,        # sender_account
-        recipient_user,        # recipient_user
-        recipient_account      # recipient_account
+@pytest.fixture
+def bank(make_bank):
+    """
+    In-memory SQLite bank:
+    - sender (user 1, account 2) with 100.00
+    - recipient (user 2, account 1) with 50.00
+    - noaccount (user 3) without an account
+    """
+    return make_bank({"sender": "100.00", "recipient": "50.00", "noaccount": None}, account_ids={"sender": 2, "recipient": 1})
+
+def balances(db):
+    db.expire_all()
+    return {a.id: a.balance for a in db.query(Account).all()}
+
+def sender():
+    return Principal(id=1, username="sender", email="sender@example.com")
+
+def test_transfer_success(fake_request, db):
+    response = asyncio.run(transfer_funds(fake_request, "recipient", 50.0, sender(), db))
+    assert response == {"message": "Transfer successful"}
+
+    assert balances(db) == {1: Decimal("100.00"), 2: Decimal("50.00")}
+    txns = db.query(Transaction).order_by(Transaction.id).all()
+    assert [(t.account_id, t.amount, t.description) for t in txns] == [
+        (2, Decimal("50.00"), "Transfer to recipient"),
+        (1, Decimal("50.00"), "Transfer from sender"),
     ]
 
-    response = transfer_funds(fake_request, "recipient", 50.0, current_user, db)
-    assert response == {"message": "Transfer successful"}
+def test_transfer_uses_seven_statements(fake_request, db):
+    """One joined lookup and two conditional updates, then the two rollup upserts, the version upsert and one bulk insert.
+
+    Three round trips move the money; the other four write one table each (transactions, account_rollups, daily_totals,
+    account_versions), and SQLite cannot write several tables in one statement.
+    """
+    asyncio.run(transfer_funds(fake_request, "recipient", 10.0, sender(), db))
 
-def test_transfer_invalid_amount(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.username = "sender"
+    verbs = [s.split()[0] for s in db.statements]
+    assert verbs == ["SELECT", "UPDATE", "UPDATE", "INSERT", "INSERT", "INSERT", "INSERT"]
 
+def test_transfer_invalid_amount(fake_request, db):
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", -10.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "recipient", -10.0, sender(), db))
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "Invalid amount"
 
-def test_sender_account_not_found(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
+def test_transfer_sub_cent_amount(fake_request, db):
+    """Amounts are stored in whole cents, so 0.001 would be written as a 0.00 transfer."""
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(transfer_funds(fake_request, "recipient", 0.001, sender(), db))
+    assert excinfo.value.detail == "Invalid amount"
+    assert db.query(Transaction).count() == 0
 
-    db.query().filter().first.side_effect = [None]
+def test_sender_account_not_found(fake_request, db):
+    current_user = Principal(id=3, username="noaccount", email="noaccount@example.com")
 
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", 50.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "recipient", 50.0, current_user, db))
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Sender account not found"
 
-def test_insufficient_funds(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
-
-    sender_account = MagicMock()
-    sender_account.balance = Decimal('10.00')
-
-    db.query().filter().first.side_effect = [sender_account]
-
+def test_insufficient_funds(fake_request, db):
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", 50.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "recipient", 500.0, sender(), db))
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "Insufficient funds"
 
-def test_recipient_not_found(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
-
-    sender_account = MagicMock()
-    sender_account.balance = Decimal('100.00')
-
-    db.query().filter().first.side_effect = [sender_account, None]
+    # The recipient (lower account id) was credited first; the failed debit must roll that back.
+    assert balances(db) == {1: Decimal("50.00"), 2: Decimal("100.00")}
+    assert db.query(Transaction).count() == 0
 
+def test_recipient_not_found(fake_request, db):
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", 50.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "nobody", 50.0, sender(), db))
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Recipient not found"
 
-def test_recipient_account_not_found(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
-
-    sender_account = MagicMock()
-    sender_account.balance = Decimal('100.00')
-
-    recipient_user = MagicMock()
-    recipient_user.id = 2
-    recipient_user.username = "recipient"
-
-    db.query().filter().first.side_effect = [sender_account, recipient_user, None]
-
+def test_recipient_account_not_found(fake_request, db):
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", 50.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "noaccount", 50.0, sender(), db))
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Recipient account not found"
 
-def test_self_transfer(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
-
-    sender_account = MagicMock()
-    sender_account.balance = Decimal('100.00')
-
-    recipient_user = MagicMock()
-    recipient_user.id = 1  # Same as sender
-    recipient_user.username = "sender"
-
-    recipient_account = MagicMock()
-
-    db.query().filter().first.side_effect = [sender_account, recipient_user, recipient_account]
+@pytest.mark.parametrize("recipient", ["nobody", "noaccount", "sender"])
+def test_insufficient_funds_comes_before_recipient_errors(fake_request, db, recipient):
+    """As in the original /transfer, an overdraft is reported before a missing or invalid recipient."""
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(transfer_funds(fake_request, recipient, 500.0, sender(), db))
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Insufficient funds"
 
+def test_self_transfer(fake_request, db):
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "sender", 50.0, current_user, db)
+        asyncio.run(transfer_funds(fake_request, "sender", 50.0, sender(), db))
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "You cannot transfer money to yourself."
 
-def test_transfer_server_error(fake_request):
-    db = MagicMock()
-    current_user = MagicMock()
-    current_user.id = 1
-    current_user.username = "sender"
+def test_transfer_server_error(fake_request, db, monkeypatch):
+    monkeypatch.setattr(db, "commit", MagicMock(side_effect=Exception("Simulated DB error")))
 
-    sender_account = MagicMock()
-    sender_account.id = 1
-    sender_account.balance = Decimal('100.00')
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(transfer_funds(fake_request, "recipient", 50.0, sender(), db))
+    assert excinfo.value.status_code == 500
+    assert excinfo.value.detail == "Transfer failed due to server error"
+    assert balances(db) == {1: Decimal("50.00"), 2: Decimal("100.00")}
+
+def batch(*items):
+    return BatchTransferRequest(transfers=[{"recipient_username": u, "amount": a} for u, a in items])
+
+def test_batch_transfer_reports_each_item(fake_request, db):
+    db.add(User(id=4, username="merchant", email="merchant@example.com", password_hash="x"))
+    db.add(Account(id=3, user_id=4, balance=Decimal("0.00")))
+    db.commit()
+
+    response = asyncio.run(batch_transfer_funds(fake_request, batch(
+        ("recipient", "30.00"),
+        ("merchant", "40.00"),
+        ("merchant", "40.00"),     # only 30.00 left
+        ("nobody", "1.00"),
+        ("noaccount", "1.00"),
+        ("sender", "1.00"),
+        ("merchant", "-5"),
+        ("merchant", "0.001"),     # sub-cent
+        ("merchant", "1e-30"),
+        ("merchant", "30.00"),
+    ), sender(), db))
+
+    assert [(r["status"], r["detail"]) for r in response["results"]] == [
+        ("success", None),
+        ("success", None),
+        ("failed", "Insufficient funds"),
+        ("failed", "Recipient not found"),
+        ("failed", "Recipient account not found"),
+        ("failed", "You cannot transfer money to yourself."),
+        ("failed", "Invalid amount"),
+        ("failed", "Invalid amount"),
+        ("failed", "Invalid amount"),
+        ("success", None),
+    ]
+    assert response["results"][0]["amount"] == "30.00"
+    assert response["succeeded"] == 3
+    assert response["failed"] == 7
+    assert balances(db) == {1: Decimal("80.00"), 2: Decimal("0.00"), 3: Decimal("70.00")}
+    assert db.query(Transaction).count() == 6
 
-    recipient_user = MagicMock()
-    recipient_user.id = 2
-    recipient_user.username = "recipient"
+def test_batch_transfer_uses_bulk_statements(fake_request, db):
+    """Recipient lookup, sender lock and one executemany update, then the two rollup upserts, the version upsert and one
+    bulk insert, regardless of batch size."""
+    asyncio.run(batch_transfer_funds(fake_request, batch(*[("recipient", "1.00")] * 20), sender(), db))
 
-    recipient_account = MagicMock()
-    recipient_account.id = 2
-    recipient_account.balance = Decimal('50.00')
+    verbs = [s.split()[0] for s in db.statements]
+    assert verbs == ["SELECT", "SELECT", "UPDATE", "INSERT", "INSERT", "INSERT", "INSERT"]
+    assert balances(db) == {1: Decimal("70.00"), 2: Decimal("80.00")}
 
-    db.query().filter().first.side_effect = [
-        sender_account, recipient_user, recipient_account
-    ]
-    db.commit.side_effect = Exception("Simulated DB error")
+def test_batch_transfer_sender_account_not_found(fake_request, db):
+    current_user = Principal(id=3, username="noaccount", email="noaccount@example.com")
 
     with pytest.raises(HTTPException) as excinfo:
-        transfer_funds(fake_request, "recipient", 50.0, current_user, db)
-    assert excinfo.value.status_code == 500
-    assert excinfo.value.detail == "Transfer failed due to server error"
\ No newline at end of file
+        asyncio.run(batch_transfer_funds(fake_request, batch(("recipient", "1.00")), current_user, db))
+    assert excinfo.value.status_code == 404
+    assert excinfo.value.detail == "Sender account not found"
+
+def test_batch_transfer_empty_batch(fake_request, db):
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(batch_transfer_funds(fake_request, batch(), sender(), db))
+    assert excinfo.value.status_code == 400
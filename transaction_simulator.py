@@ -0,0 +1,202 @@
+# This file contains the worker that applies the random transaction simulated for every login. It includes the following key components:
+# - SimulationWorker: One daemon thread per worker process with a bounded queue. Every SIMULATION_TICK_MS it takes up
+#   to SIMULATION_BATCH_SIZE queued logins and applies them in one transaction on one pooled connection, so a login
+#   burst no longer turns into a burst of sessions, pool checkouts and commits competing with live requests.
+# - enqueue: Called by /login; never blocks. When SIMULATION_QUEUE_SIZE simulations are already waiting the new one is
+#   dropped and counted, so a login burst cannot build an unbounded backlog.
+# - simulate_batch: Picks a random deposit or withdrawal (a withdrawal only when the balance covers it) per queued login,
+#   locking the accounts with one SELECT ... FOR UPDATE in ascending id order and writing one executemany UPDATE and
+#   one bulk INSERT (plus the rollup upserts, see rollups.py). In ledger mode (BALANCE_MODE=ledger) it takes the ledger's FOR NO KEY UPDATE lock, reads the
+#   balances in one query and only inserts postings.
+# - Prometheus Metrics: Queue depth, dropped simulations, batch size, batch latency and failed batches.
+
+# transaction_simulator.py
+import os
+import queue
+import random
+import threading
+import time
+from decimal import Decimal
+from typing import Iterable, List
+
+import sqlalchemy as sa
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy.orm import Session
+
+import balance_shards
+import ledger
+import transfer_engine
+from database import SessionLocal
+from models import Account
+
+SIMULATION_QUEUE_SIZE = int(os.getenv("SIMULATION_QUEUE_SIZE", "1000"))
+SIMULATION_BATCH_SIZE = int(os.getenv("SIMULATION_BATCH_SIZE", "200"))
+SIMULATION_TICK_MS = float(os.getenv("SIMULATION_TICK_MS", "250"))
+
+# Prometheus Metrics
+SIMULATION_QUEUE_DEPTH = Gauge("simulation_queue_depth", "Login transaction simulations waiting to be applied", multiprocess_mode="livesum")
+SIMULATION_DROPPED = Counter("simulation_dropped", "Login transaction simulations dropped because the queue was full")
+SIMULATION_BATCH_SIZE_HISTOGRAM = Histogram(
+    "simulation_batch_size", "Login transaction simulations applied per batch",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200, 500, 1000),
+)
+SIMULATION_BATCH_LATENCY = Histogram("simulation_batch_latency_seconds", "Time taken to apply and commit one simulation batch")
+SIMULATION_BATCH_FAILURES = Counter("simulation_batch_failures", "Simulation batches that failed and were discarded")
+
+
+def simulate_batch(db: Session, user_ids: Iterable[int]) -> int:
+    """Applies one random deposit or withdrawal per user id (repeats allowed); returns the number written. The caller commits."""
+    user_ids = list(user_ids)
+    locked = db.execute(
+        sa.select(Account.id, Account.user_id, Account.balance)
+        .where(Account.user_id.in_(set(user_ids)))
+        .order_by(Account.id)
+        .with_for_update(key_share=ledger.ledger_enabled())
+    ).all()
+
+    accounts = {}
+    balances = {}
+    for account_id, user_id, balance in locked:
+        if user_id not in accounts:
+            accounts[user_id] = account_id
+            balances[account_id] = balance
+    if ledger.ledger_enabled() and balances:
+        balances.update(ledger.balances(db, balances))
+
+    deltas = {}
+    rows = []
+    for user_id in user_ids:
+        account_id = accounts.get(user_id)
+        if account_id is None:
+            continue
+        transaction_type = random.choice(["deposit", "withdrawal"])
+        amount = Decimal(str(round(random.uniform(10, 100), 2)))
+        if transaction_type == "withdrawal" and balances[account_id] < amount:
+            transaction_type = "deposit"
+
+        delta = amount if transaction_type == "deposit" else -amount
+        balances[account_id] += delta
+        deltas[account_id] = deltas.get(account_id, Decimal("0")) + delta
+        rows.append({
+            "account_id": account_id,
+            "transaction_type": transaction_type,
+            "amount": amount,
+            "description": f"Random {transaction_type} on login",
+            "signed_amount": delta,
+        })
+
+    if not rows:
+        return 0
+    if not ledger.ledger_enabled():
+        # A sharded account's row is part of its balance too, so its simulations can stay on the locked row
+        balance_shards.apply_deltas(db, {account_id: {None: delta} for account_id, delta in deltas.items()})
+    transfer_engine.insert_transactions(db, rows)
+    return len(rows)
+
+
+class SimulationWorker:
+    def __init__(self, session_factory=SessionLocal, queue_size: int = SIMULATION_QUEUE_SIZE,
+                 batch_size: int = SIMULATION_BATCH_SIZE, tick_ms: float = SIMULATION_TICK_MS):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.tick = max(0.0, tick_ms) / 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="transaction-simulator", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """Applies what is still queued, then stops the worker thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+
+    def enqueue(self, user_id: int) -> bool:
+        """Queues a simulation for the user; returns False when it was dropped because the queue is full."""
+        self.start()
+        try:
+            self._queue.put_nowait(user_id)
+        except queue.Full:
+            SIMULATION_DROPPED.inc()
+            return False
+        SIMULATION_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    def _take(self) -> List[int]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        SIMULATION_QUEUE_DEPTH.set(self._queue.qsize())
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Wait for the next tick unless a full batch is already waiting
+            if self._queue.qsize() < self.batch_size:
+                self._stop.wait(self.tick)
+            batch = self._take()
+            if batch:
+                self.apply(batch)
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            self.apply(batch)
+
+    def apply(self, user_ids: List[int]):
+        start_time = time.perf_counter()
+        db = self.session_factory()
+        try:
+            written = simulate_batch(db, user_ids)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            SIMULATION_BATCH_FAILURES.inc()
+            logger.error(f"[BG TASK ERROR] Login simulation batch failed | Logins: {len(user_ids)} | Error: {str(e)}")
+            return
+        finally:
+            db.close()
+        latency = time.perf_counter() - start_time
+        SIMULATION_BATCH_SIZE_HISTOGRAM.observe(len(user_ids))
+        SIMULATION_BATCH_LATENCY.observe(latency)
+        logger.info(f"[BG TASK] Simulated {written} login transactions | Logins: {len(user_ids)} | Latency: {latency:.4f}s")
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> SimulationWorker:
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = SimulationWorker()
+    return _worker
+
+
+def enqueue(user_id: int) -> bool:
+    return get_worker().enqueue(user_id)
+
+
+def shutdown():
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop()
+            _worker = None
@@ -0,0 +1,370 @@
+# This file contains the transfer engine shared by the money-moving routes. It includes the following key components:
+# - resolve_accounts: Resolves the sender's account and any number of recipients (user + account) in one joined query,
+#   along with which of those accounts are sharded.
+# - debit_account / credit_account: Conditional, in-database balance updates
+#   (UPDATE ... SET balance = balance - :amt WHERE id = :id AND balance >= :amt RETURNING balance), so concurrent
+#   transfers can never lose an update or overdraw an account.
+# - transfer: Validates a single transfer with the same rules, messages and order of checks as /transfer (insufficient
+#   funds before any recipient error), takes the row locks in ascending account id order so concurrent transfers
+#   between the same accounts cannot deadlock, and records the transaction rows with one bulk insert.
+# - available_balance: An unlocked read of an account's balance, used only to order transfer's error messages.
+# - valid_amount: An amount must be positive and in whole cents; transactions store Numeric(15, 2), so a sub-cent
+#   amount such as 0.001 would be written as a 0.00 transfer.
+# - transfer_batch: Applies N transfers from one sender against a single locked sender balance, resolving all
+#   recipients with one IN (...) query and writing the balance updates and transaction rows in bulk; each item gets
+#   its own outcome using the same validation rules and messages as transfer.
+# - lock_transfer_accounts: Locks every account row a set of transfers will update, in ascending id order, so a writer
+#   that then applies them one at a time in one transaction (group_commit.py) cannot deadlock with anyone else.
+# - Sharded Accounts: Accounts with balance shards (see balance_shards.py) are credited on one random shard and
+#   debited from their shards instead of through their accounts row, still in ascending account id order.
+# - Ledger Mode: With BALANCE_MODE=ledger (see ledger.py) both functions lock only the sender, check its ledger
+#   balance and insert signed postings; recipients' account rows are neither updated nor locked.
+# - insert_transactions: Writes transaction rows with one bulk insert and records them through record_transactions;
+#   every writer of transactions rows goes through it.
+# - record_transactions: Adds rows to the rollups (see rollups.py), bumps the versions of the accounts they touch (see
+#   account_versions.py) and marks them for the /events streams once the caller commits (see account_events.py).
+#   Each of those is one upsert sorted by key, so writers take those rows' locks in one global order; a transaction
+#   must therefore record all its rows in one call. A writer that inserts several times per transaction (group
+#   commit) wraps the inserts in defer_records() and calls record_deferred() once before committing.
+# The engine never commits; the caller owns the transaction and must roll back when an HTTPException is raised.
+
+# transfer_engine.py
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import account_events
+import account_versions
+import balance_shards
+import ledger
+import rollups
+from models import Account, Transaction, User
+
+CENT = Decimal("0.01")
+
+
+def valid_amount(amount: Decimal) -> bool:
+    """True for a positive amount in whole cents."""
+    try:
+        return amount > 0 and amount == amount.quantize(CENT)
+    except InvalidOperation:
+        # Too many digits to quantize, or NaN
+        return False
+
+
+@dataclass(frozen=True)
+class Recipient:
+    user_id: int
+    account_id: Optional[int]
+
+
+@dataclass(frozen=True)
+class BatchItemResult:
+    index: int
+    recipient_username: str
+    amount: Decimal
+    status: str
+    detail: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TransferResult:
+    sender_account_id: int
+    recipient_account_id: int
+    # Not computed for sharded accounts, or for the recipient in ledger mode, where it is only sent a posting
+    sender_balance: Optional[Decimal]
+    recipient_balance: Optional[Decimal]
+
+
+def resolve_accounts(db: Session, sender_user_id: int, recipient_usernames: Iterable[str]) -> Tuple[Optional[int], Dict[str, Recipient], Dict[int, int]]:
+    """Returns the sender's account id, a {username: Recipient} map for the recipients that exist and the
+    {account_id: shard_count} of the sharded accounts among them."""
+    usernames = set(recipient_usernames)
+    rows = db.execute(
+        sa.select(User.id, User.username, Account.id, Account.shard_count)
+        .outerjoin(Account, Account.user_id == User.id)
+        .where(sa.or_(User.id == sender_user_id, User.username.in_(usernames)))
+        .order_by(Account.id)
+    ).all()
+
+    sender_account_id = None
+    recipients = {}
+    shard_counts = {}
+    for user_id, username, account_id, shard_count in rows:
+        if shard_count:
+            shard_counts[account_id] = shard_count
+        if user_id == sender_user_id and sender_account_id is None:
+            sender_account_id = account_id
+        if username in usernames and username not in recipients:
+            recipients[username] = Recipient(user_id=user_id, account_id=account_id)
+    return sender_account_id, recipients, shard_counts
+
+
+def available_balance(db: Session, account_id: int, shard_counts: Dict[int, int]) -> Decimal:
+    """Reads the account's balance without locking it: its ledger balance, its shards' total or its accounts row."""
+    if ledger.ledger_enabled():
+        return ledger.balances(db, [account_id])[account_id]
+    account = db.get(Account, account_id)
+    if account_id in shard_counts:
+        return balance_shards.total_balance(db, account)
+    return account.balance
+
+
+def debit_account(db: Session, account_id: int, amount: Decimal) -> Optional[Decimal]:
+    """Subtracts amount if the balance covers it; returns the new balance, or None when funds are insufficient."""
+    return db.execute(
+        sa.update(Account)
+        .where(Account.id == account_id, Account.balance >= amount)
+        .values(balance=Account.balance - amount)
+        .returning(Account.balance)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+
+def credit_account(db: Session, account_id: int, amount: Decimal) -> Decimal:
+    """Adds amount to the balance and returns the new balance."""
+    return db.execute(
+        sa.update(Account)
+        .where(Account.id == account_id)
+        .values(balance=Account.balance + amount)
+        .returning(Account.balance)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+
+
+def insert_transactions(db: Session, rows: List[Dict]):
+    """Inserts transaction rows, each carrying its signed_amount (stored in ledger mode only), and records them."""
+    now = datetime.utcnow()
+    for row in rows:
+        row.setdefault("transaction_date", now)
+    deferred = db.info.get("deferred_transactions")
+    if deferred is None:
+        record_transactions(db, rows)
+    else:
+        deferred.extend(rows)
+    if not ledger.ledger_enabled():
+        rows = [{key: value for key, value in row.items() if key != "signed_amount"} for row in rows]
+    db.execute(sa.insert(Transaction), rows)
+
+
+def record_transactions(db: Session, rows: List[Dict]):
+    """Rolls up transaction rows and bumps and announces their accounts; call it once per transaction."""
+    rollups.record_transactions(db, rows)
+    account_versions.bump(db, (row["account_id"] for row in rows))
+    account_events.record(db, (row["account_id"] for row in rows))
+
+
+def defer_records(db: Session) -> List[Dict]:
+    """Makes insert_transactions collect its rows instead of recording them; returns the list they collect in.
+
+    A caller that rolls back a savepoint truncates the list back to its length before the savepoint.
+    """
+    return db.info.setdefault("deferred_transactions", [])
+
+
+def record_deferred(db: Session):
+    """Records the rows collected since defer_records in one call; the caller commits."""
+    rows = db.info.pop("deferred_transactions", [])
+    if rows:
+        record_transactions(db, rows)
+
+
+def _transfer_rows(sender_account_id: int, recipient_account_id: int, sender_username: str, recipient_username: str, amount: Decimal) -> List[Dict]:
+    """Returns the two transaction rows recording a transfer."""
+    rows = [
+        {
+            "account_id": sender_account_id,
+            "transaction_type": "transfer",
+            "amount": amount,
+            "description": f"Transfer to {recipient_username}",
+            "signed_amount": -amount,
+        },
+        {
+            "account_id": recipient_account_id,
+            "transaction_type": "transfer",
+            "amount": amount,
+            "description": f"Transfer from {sender_username}",
+            "signed_amount": amount,
+        },
+    ]
+    return rows
+
+
+def lock_transfer_accounts(db: Session, transfers: Iterable[Tuple[int, str]]):
+    """Locks the account rows that the (sender_user_id, recipient_username) transfers will update."""
+    transfers = list(transfers)
+    sender_user_ids = {sender_user_id for sender_user_id, _ in transfers}
+    rows = db.execute(
+        sa.select(User.id, Account.id, Account.shard_count)
+        .join(Account, Account.user_id == User.id)
+        .where(sa.or_(User.id.in_(sender_user_ids), User.username.in_({username for _, username in transfers})))
+    ).all()
+    if ledger.ledger_enabled():
+        # Only senders are locked in ledger mode, and with the same FOR NO KEY UPDATE as ledger.lock_balance
+        account_ids = {account_id for user_id, account_id, _ in rows if user_id in sender_user_ids}
+    else:
+        # Shard rows are taken one at a time by credits and debits, after every account row is held
+        account_ids = {account_id for _, account_id, shard_count in rows if not shard_count}
+    if account_ids:
+        db.execute(
+            sa.select(Account.id)
+            .where(Account.id.in_(account_ids))
+            .order_by(Account.id)
+            .with_for_update(key_share=ledger.ledger_enabled())
+        ).all()
+
+
+def transfer(db: Session, sender_user_id: int, sender_username: str, recipient_username: str, amount: Decimal) -> TransferResult:
+    """Moves amount from the sender to the recipient inside the caller's transaction."""
+    sender_account_id, recipients, shard_counts = resolve_accounts(db, sender_user_id, [recipient_username])
+    if sender_account_id is None:
+        raise HTTPException(status_code=404, detail="Sender account not found")
+
+    recipient = recipients.get(recipient_username)
+    if recipient is None or recipient.account_id is None or recipient_username == sender_username:
+        # /transfer reports insufficient funds before any recipient error; the locked checks below only run for a
+        # valid recipient, so this path reads the balance first.
+        if available_balance(db, sender_account_id, shard_counts) < amount:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+    if recipient is None:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+    if recipient.account_id is None:
+        raise HTTPException(status_code=404, detail="Recipient account not found")
+    if recipient_username == sender_username:
+        raise HTTPException(status_code=400, detail="You cannot transfer money to yourself.")
+
+    rows = _transfer_rows(sender_account_id, recipient.account_id, sender_username, recipient_username, amount)
+    if ledger.ledger_enabled():
+        available = ledger.lock_balance(db, sender_account_id)
+        if available is None or available < amount:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+        insert_transactions(db, rows)
+        return TransferResult(
+            sender_account_id=sender_account_id,
+            recipient_account_id=recipient.account_id,
+            sender_balance=available - amount,
+            recipient_balance=None,
+        )
+
+    # Lock rows in ascending id order so two opposite transfers always queue instead of deadlocking.
+    balances = {}
+    for account_id in sorted((sender_account_id, recipient.account_id)):
+        if account_id == sender_account_id and account_id in shard_counts:
+            if not balance_shards.debit(db, account_id, amount):
+                raise HTTPException(status_code=400, detail="Insufficient funds")
+            balances[account_id] = None
+        elif account_id == sender_account_id:
+            balances[account_id] = debit_account(db, account_id, amount)
+            if balances[account_id] is None:
+                raise HTTPException(status_code=400, detail="Insufficient funds")
+        elif account_id in shard_counts:
+            balance_shards.credit(db, account_id, shard_counts[account_id], amount)
+            balances[account_id] = None
+        else:
+            balances[account_id] = credit_account(db, account_id, amount)
+
+    insert_transactions(db, rows)
+
+    return TransferResult(
+        sender_account_id=sender_account_id,
+        recipient_account_id=recipient.account_id,
+        sender_balance=balances[sender_account_id],
+        recipient_balance=balances[recipient.account_id],
+    )
+
+
+def _lock_accounts(db: Session, account_ids: Iterable[int], shard_counts: Dict[int, int], sender_account_id: int) -> Dict[int, Dict[Optional[int], Optional[Decimal]]]:
+    """Locks the rows a batch updates in ascending account id order; returns {account_id: {shard: balance}}, where
+    shard None is the accounts row. A sharded sender locks all its rows, a sharded recipient one random shard."""
+    locked = {}
+    plain = []
+
+    def lock_plain():
+        rows = db.execute(
+            sa.select(Account.id, Account.balance)
+            .where(Account.id.in_(plain))
+            .order_by(Account.id)
+            .with_for_update()
+        ).all()
+        locked.update({account_id: {None: balance} for account_id, balance in rows})
+        plain.clear()
+
+    for account_id in sorted(set(account_ids)):
+        if account_id not in shard_counts:
+            plain.append(account_id)
+            continue
+        if plain:
+            lock_plain()
+        if account_id == sender_account_id:
+            locked[account_id] = balance_shards.lock_all(db, account_id)
+        else:
+            locked[account_id] = {balance_shards.lock_one(db, account_id, shard_counts[account_id]): None}
+    if plain:
+        lock_plain()
+    return locked
+
+
+def transfer_batch(db: Session, sender_user_id: int, sender_username: str, items: List[Tuple[str, Decimal]]) -> List[BatchItemResult]:
+    """Applies (recipient_username, amount) items in order; failed items are skipped, the rest are written in bulk."""
+    sender_account_id, recipients, shard_counts = resolve_accounts(db, sender_user_id, [username for username, _ in items])
+    if sender_account_id is None:
+        raise HTTPException(status_code=404, detail="Sender account not found")
+
+    if ledger.ledger_enabled():
+        # Recipients only receive postings, so the sender is the only row that needs a lock
+        opening = ledger.lock_balance(db, sender_account_id)
+    else:
+        locked = _lock_accounts(
+            db, [sender_account_id] + [r.account_id for r in recipients.values() if r.account_id is not None],
+            shard_counts, sender_account_id,
+        )
+        opening = sum(locked[sender_account_id].values())
+    available = opening
+
+    results = []
+    credits = {}
+    rows = []
+    for index, (recipient_username, amount) in enumerate(items):
+        recipient = recipients.get(recipient_username)
+        if not valid_amount(amount):
+            detail = "Invalid amount"
+        elif recipient is None:
+            detail = "Recipient not found"
+        elif recipient.account_id is None:
+            detail = "Recipient account not found"
+        elif recipient_username == sender_username:
+            detail = "You cannot transfer money to yourself."
+        elif available < amount:
+            detail = "Insufficient funds"
+        else:
+            detail = None
+
+        if detail is not None:
+            results.append(BatchItemResult(index, recipient_username, amount, "failed", detail))
+            continue
+
+        available -= amount
+        credits[recipient.account_id] = credits.get(recipient.account_id, Decimal("0")) + amount
+        rows.extend(_transfer_rows(sender_account_id, recipient.account_id, sender_username, recipient_username, amount))
+        results.append(BatchItemResult(index, recipient_username, amount, "success"))
+
+    if not rows:
+        return results
+    if ledger.ledger_enabled():
+        insert_transactions(db, rows)
+        return results
+
+    # Every row is already locked, so the updates themselves cannot fail or deadlock.
+    deltas = {account_id: {next(iter(locked[account_id])): credit} for account_id, credit in credits.items()}
+    if sender_account_id in shard_counts:
+        deltas[sender_account_id] = balance_shards.drain(locked[sender_account_id], opening - available)
+    else:
+        deltas[sender_account_id] = {None: -(opening - available)}
+    balance_shards.apply_deltas(db, deltas)
+    insert_transactions(db, rows)
+    return results